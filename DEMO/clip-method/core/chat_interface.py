@@ -1,13 +1,34 @@
 import streamlit as st
 from chatbot import Chatbot
+from dotenv import dotenv_values
+from sys import path
 import re
+import base64
+
+path.append('../')
+
+from utils.resources import resources
 
 dotenv_path = ".env"
 
 
+@st.cache_resource
+def warm_up_resources() -> None:
+    # Load the models and clients once per process in the background, the page renders without waiting for them
+    budget = float(dotenv_values(dotenv_path).get("cold_start_budget", "120"))
+    resources.warm_up_in_background(budget=budget)
+
+
+@st.cache_resource
+def get_chatbot() -> Chatbot:
+    # A Chatbot keeps no per-request state, so every session shares one instance
+    return Chatbot()
+
+
 class ChatInterface:
     def __init__(self):
-        self.chatbot = Chatbot()
+        warm_up_resources()
+        self.chatbot = get_chatbot()
 
     def display_chat(self, messages):
         for message in messages:
@@ -122,11 +143,22 @@ class ChatInterface:
             with st.chat_message("assistant"):
                 message_placeholder = st.empty()
                 full_response = ""
-                completion = self.chatbot.get_response(query=user_input, history=st.session_state.messages, stream=False)
+                documents = []
+                images = []
+                completion = self.chatbot.get_response(query=user_input, history=st.session_state.messages, stream=True)
 
                 reference_mode = True
                 for response in completion:
-                    full_response += response
+                    if "documents" in response:
+                        documents = response["documents"]
+
+                    if "images" in response:
+                        images = response["images"]
+
+                    if "answer" not in response:
+                        continue
+
+                    full_response += response["answer"]
 
                     if "::" in full_response:
                         reference_mode = False
@@ -138,10 +170,16 @@ class ChatInterface:
                 message_placeholder.markdown(full_response)
 
                 # try:
-                references_tag = [int(reference[1:-1]) for reference in full_response.split('::')[0].split()]
-                file_id = self.chatbot.get_latest_context()[0][0]
+                # Image tags (<image1>) are skipped, their images are shown below the answer
+                references_tag = [int(reference[1:-1]) for reference in full_response.split('::')[0].split()
+                                  if reference[1:-1].isdigit()]
+                # Each tag is a chunk number, look up which of the retrieved documents it belongs to
+                files_id = {document.metadata['chunk_number']: document.metadata['file_id'] for document in documents
+                            if 'chunk_number' in document.metadata}
+                references_tag = [tag for tag in references_tag if tag in files_id]
                 if references_tag and 0 not in references_tag:
-                    references = "<br>".join([self.chatbot.get_formatted_references(tag, file_id) for tag in references_tag])
+                    references = "<br>".join([self.chatbot.get_formatted_references(tag, files_id[tag])
+                                              for tag in references_tag])
                     
                     markdown_message = showing_response + "\n\n\n" \
                                     '<div class="hover-container">\n' \
@@ -156,6 +194,11 @@ class ChatInterface:
                 # except:
                 #     print("ERROR ")
 
+                if images:
+                    with st.expander("Related images"):
+                        st.image([base64.b64decode(image.metadata["thumbnail"]) for image in images],
+                                 caption=[image.metadata["caption"] for image in images])
+
             st.session_state.messages.append({'role': 'user', 'content': user_input})
             st.session_state.messages.append({'role': 'assistant', 'content': full_response})
 
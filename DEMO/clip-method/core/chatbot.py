@@ -1,9 +1,12 @@
 from sys import path
 from dotenv import dotenv_values
 from collections import OrderedDict
-from typing import List, Iterator, Dict, Tuple
+from typing import List, Iterator, AsyncIterator, Dict, Tuple, Any
+from operator import itemgetter
+from functools import cached_property
+from PIL import Image
 from uuid import uuid4, UUID
-from pymilvus import MilvusClient
+from pymilvus import MilvusClient, DataType
 
 from langchain_milvus import Milvus
 from langchain_openai import OpenAI
@@ -11,16 +14,77 @@ from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
 from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.runnables import RunnableLambda, RunnableParallel
 
 path.append('../')
 
 from utils.document_processor import DocumentProcessor
+from utils.clip_embedder import ClipEmbedder, thumbnail_base64
 from utils.tokenizer import encode_history
+from utils.resources import resources
 
 dotenv_path = '.env'
 
 
+# Factories of the heavy resources, they run on first use instead of at import time
+def _create_embedding() -> HuggingFaceEmbeddings:
+    embedding = HuggingFaceEmbeddings(model_name=Chatbot._embedding_model_name,
+                                      model_kwargs=Chatbot._embedding_model_kwargs)
+    # Do not check the token length of inputs and automatically split inputs
+    # longer than embedding_ctx_length. (Won't work with nomic-embed-text)
+    embedding.check_embedding_ctx_length = False
+    return embedding
+
+
+def _create_llm() -> OpenAI:
+    return OpenAI(base_url=Chatbot._env_values["openAI_base_url"],
+                  api_key=Chatbot._env_values["openAI_api_key"],
+                  model=Chatbot._env_values["LLM_model_name"])
+
+
+def _create_milvus() -> Milvus:
+    return Milvus(
+        embedding_function=resources.get("embedding"),
+        connection_args={"uri": Chatbot._env_values["milvus_uri"]},
+        collection_name=Chatbot._env_values["collection_name"],
+        drop_old=True,
+    )
+
+
+def _create_pymilvus_client() -> MilvusClient:
+    return MilvusClient(uri=Chatbot._env_values["milvus_uri"])
+
+
+def _create_clip() -> ClipEmbedder:
+    return ClipEmbedder(model_name=Chatbot._env_values.get("clip_model_name", "xlm-roberta-base-ViT-B-32"),
+                        pretrained=Chatbot._env_values.get("clip_pretrained", "laion5b_s13b_b90k"),
+                        batch_size=int(Chatbot._env_values.get("clip_batch_size", "16")))
+
+
+def _create_image_collection() -> str:
+    # Image vectors have the dimension of the CLIP model, not of the text embedding, so they get their own collection
+    client: MilvusClient = resources.get("pymilvus_client")
+    collection_name = f"{Chatbot._env_values['collection_name']}_images"
+
+    if client.has_collection(collection_name):
+        client.drop_collection(collection_name)
+
+    schema = MilvusClient.create_schema(auto_id=True, enable_dynamic_field=False)
+    schema.add_field("id", DataType.INT64, is_primary=True)
+    schema.add_field("vector", DataType.FLOAT_VECTOR, dim=resources.get("clip").dimensions)
+    schema.add_field("file_id", DataType.VARCHAR, max_length=256)
+    schema.add_field("file_name", DataType.VARCHAR, max_length=1024)
+    schema.add_field("page_number", DataType.INT64)
+    schema.add_field("image_number", DataType.INT64)
+    schema.add_field("thumbnail", DataType.VARCHAR, max_length=65535)
+    schema.add_field("page_text", DataType.VARCHAR, max_length=65535)
+
+    index_params = client.prepare_index_params()
+    index_params.add_index(field_name="vector", index_type="AUTOINDEX", metric_type="IP")
+    client.create_collection(collection_name=collection_name, schema=schema, index_params=index_params)
+    return collection_name
+
+
 class Chatbot:
     _user_header_tag: str = "<|eot_id|><|start_header_id|>user<|end_header_id|>"
     _assistant_header_tag: str = "<|eot_id|><|start_header_id|>assistant<|end_header_id|>"
@@ -48,46 +112,72 @@ class Chatbot:
     _env_values: OrderedDict = dotenv_values(dotenv_path)
 
     _documentProcessor: DocumentProcessor = DocumentProcessor(chunk_size=int(_env_values["chunk_size"]))
+    # Stages of the PDF extraction this pipeline uses, "text" alone skips reading and decoding every image
+    _extraction_stages: Tuple[str, ...] = tuple(stage.strip() for stage in
+                                                _env_values.get("extraction_stages", "text,images").split(","))
 
     _embedding_model_name = "Alibaba-NLP/gte-multilingual-base"
     _embedding_model_kwargs = {"trust_remote_code": True}
-    _embedding: HuggingFaceEmbeddings = HuggingFaceEmbeddings(model_name=_embedding_model_name,
-                                                              model_kwargs=_embedding_model_kwargs)
-
-    # Do not check the token length of inputs and automatically split inputs
-    # longer than embedding_ctx_length. (Won't work with nomic-embed-text)
-    _embedding.check_embedding_ctx_length = False
-    _llm: OpenAI = OpenAI(base_url=_env_values["openAI_base_url"],
-                          api_key=_env_values["openAI_api_key"],
-                          model=_env_values["LLM_model_name"])
-    _milvus: Milvus = Milvus(
-        embedding_function=_embedding,
-        connection_args={"uri": _env_values["milvus_uri"]},
-        collection_name=_env_values["collection_name"],
-        drop_old=True,
-    )
-
-    _pymilvus_client: MilvusClient = MilvusClient(
-        uri=_env_values["milvus_uri"]
-    )
-
-    def __init__(self, prompt_template: str = _prompt_template, limit: int = 3):
-        self._history = None
-        self._latest_contexts = None
+    _embedding: HuggingFaceEmbeddings = resources.lazy("embedding", _create_embedding)
+    _llm: OpenAI = resources.lazy("llm", _create_llm)
+    _milvus: Milvus = resources.lazy("milvus", _create_milvus)
+
+    _pymilvus_client: MilvusClient = resources.lazy("pymilvus_client", _create_pymilvus_client)
+
+    # Registered only when images are extracted, so a text-only pipeline never loads CLIP (warm-up included) nor
+    # creates the image collection
+    _clip: ClipEmbedder = resources.lazy("clip", _create_clip) if "images" in _extraction_stages else None
+    _image_collection: str = resources.lazy("image_collection", _create_image_collection) \
+        if "images" in _extraction_stages else None
+    # Icons, bullets and rules are not worth an embedding
+    _min_image_size: int = int(_env_values.get("min_image_size", "64"))
+    # Characters of the page text kept with each image, what the LLM reads about it (at most 4 bytes each in UTF-8,
+    # so the default stays far below the 65535 bytes of the field)
+    _image_text_chars: int = int(_env_values.get("image_text_chars", "1000"))
+
+    def __init__(self, prompt_template: str = _prompt_template, limit: int = 3,
+                 image_limit: int = int(_env_values.get("image_limit", "3")),
+                 image_score_threshold: float = float(_env_values.get("image_score_threshold", "0.2")),
+                 rrf_k: int = int(_env_values.get("rrf_k", "60"))):
         self.prompt_template = prompt_template
         self.limit = limit
+        self.image_limit = image_limit
+        self.image_score_threshold = image_score_threshold
+        self.rrf_k = rrf_k
         self._rag_prompt: PromptTemplate = PromptTemplate.from_template(prompt_template)
-        self._retriever = self.__class__._milvus.as_retriever(search_type="similarity", search_kwargs={"k": limit})
 
-        self._rag_chain = {"context": self._retriever | self._format_doc, "history": RunnableLambda(self.get_history),
-                           "question": RunnablePassthrough()} | self._rag_prompt | self.__class__._llm | StrOutputParser()
+    # Built on first use, so creating a Chatbot doesn't wait for the shared resources to load
+    @cached_property
+    def _retriever(self):
+        return self.__class__._milvus.as_retriever(search_type="similarity", search_kwargs={"k": self.limit})
+
+    @cached_property
+    def _rag_chain(self):
+        # Retrieval and history encoding are independent branches, so they run concurrently.
+        # Retrieved documents are returned with the answer, nothing about a request is kept on the instance.
+        # Images are searched with the CLIP text tower next to the text search, then both rankings are fused into
+        # the documents of the context. The LLM reads the text of the page of a fused image, the images themselves
+        # are returned beside the answer for display.
+        retrieval = RunnableParallel(documents=itemgetter("question") | self._retriever,
+                                     images=itemgetter("question") | RunnableLambda(self._search_images),
+                                     history=itemgetter("history") | RunnableLambda(self._encode_history),
+                                     question=itemgetter("question"))
+        retrieval = retrieval.assign(documents=RunnableLambda(self._fuse_rankings))
+        generation = {"context": itemgetter("documents") | RunnableLambda(self._format_doc),
+                      "history": itemgetter("history"),
+                      "question": itemgetter("question")} | self._rag_prompt | self.__class__._llm | StrOutputParser()
+        return retrieval.assign(answer=generation).pick(["answer", "documents", "images"])
 
     def __repr__(self):
         return (f"{self.__class__.__name__}("
                 f"prompt_template={self.prompt_template}, "
-                f"limit={self.limit})")
+                f"limit={self.limit}, "
+                f"image_limit={self.image_limit}, "
+                f"image_score_threshold={self.image_score_threshold}, "
+                f"rrf_k={self.rrf_k})")
 
-    def get_response(self, query: str, history: List[Dict[str, str]], stream: bool = False) -> Iterator[str] | str:
+    def get_response(self, query: str, history: List[Dict[str, str]],
+                     stream: bool = False) -> Iterator[Dict[str, Any]] | Dict[str, Any]:
         """
         Get response from LLM model.
 
@@ -99,26 +189,52 @@ class Chatbot:
         stream (bool): if true return streamed version of answer
 
         Returns:
-        str: output of chain invoke
+        Dict[str, Any]: 'answer', the retrieved 'documents' and 'images' (partial dictionaries of them if stream is true)
         """
 
-        self._history = encode_history(
-            user_header_tag=self.__class__._user_header_tag,
-            assistant_header_tag=self.__class__._assistant_header_tag,
-            histories=history,
-        )
+        chain_input = {"question": query, "history": history}
 
         if stream:
-            return self._rag_chain.stream(query)
+            return self._rag_chain.stream(chain_input)
 
-        return self._rag_chain.invoke(query)
+        return self._rag_chain.invoke(chain_input)
+
+    async def aget_response(self, query: str, history: List[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        Get response from LLM model asynchronously.
+
+        This method is the async version of get_response. Embedding and Milvus search run in the default executor
+        next to history encoding and the LLM is called through the async OpenAI client.
+
+        Parameters:
+        query (str): user question without embeddings.
+        history (List[Dict[str, str]]): that chat history between user and model.
+
+        Returns:
+        Dict[str, Any]: 'answer', the retrieved 'documents' and 'images'
+        """
+        return await self._rag_chain.ainvoke({"question": query, "history": history})
+
+    async def astream(self, query: str, history: List[Dict[str, str]]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream response from LLM model asynchronously.
+
+        Parameters:
+        query (str): user question without embeddings.
+        history (List[Dict[str, str]]): that chat history between user and model.
+
+        Returns:
+        AsyncIterator[Dict[str, Any]]: 'documents' and 'images' once retrieved, then chunks of the 'answer' as they are generated
+        """
+        async for chunk in self._rag_chain.astream({"question": query, "history": history}):
+            yield chunk
 
     def save_pdf(self, file) -> None:
         """
         Save embedded chunks into Milvus db.
 
         This method get PDF file and split it using DocumentProcessor class and convert them into vectors
-        and save it into Milvus db.
+        and save it into Milvus db. The images of the PDF are embedded with CLIP into the image collection.
 
         Parameters:
         file (file | streamlit file_uploader like objects): returning object of streamlit.file_uploader
@@ -127,7 +243,9 @@ class Chatbot:
         None
         """
 
-        chunks: List[str] = self.__class__._documentProcessor.load_pdf(file=file)["chunks"]
+        pdf: Dict[str, List[Any]] = self.__class__._documentProcessor.load_pdf(
+            file=file, stages=self.__class__._extraction_stages)
+        chunks: List[str] = pdf.get("chunks", [])
         documents: List[Document] = [Document(
             page_content=chunks[chunk_number],
             metadata={"file_id": file.file_id, "file_name": file.name, "chunk_number": chunk_number + 1}
@@ -135,6 +253,37 @@ class Chatbot:
         document_ids: List[str] = [str(uuid4()) for _ in documents]
         self.__class__._milvus.add_documents(documents=documents, ids=document_ids)
 
+        if "images" in pdf:
+            self._save_images(file, images=pdf["images"], pages=pdf["image_pages"], texts=pdf["image_texts"])
+
+    def _save_images(self, file, images: List[Image.Image], pages: List[int], texts: List[str]) -> None:
+        """
+        Embed the images of a PDF with CLIP and save them into the image collection.
+
+        Parameters:
+        file (file | streamlit file_uploader like objects): the PDF the images come from.
+        images (List[Image.Image]): images of the PDF.
+        pages (List[int]): page number of each image.
+        texts (List[str]): text of the page of each image.
+
+        Returns:
+        None
+        """
+        kept = [(image_number, image, page, text)
+                for image_number, (image, page, text) in enumerate(zip(images, pages, texts), start=1)
+                if min(image.size) >= self.__class__._min_image_size]
+
+        if not kept:
+            return
+
+        vectors = self.__class__._clip.embed_images([image for _, image, _, _ in kept])
+        rows = [{"vector": vector.tolist(), "file_id": file.file_id, "file_name": file.name, "page_number": page,
+                 "image_number": image_number, "thumbnail": thumbnail_base64(image),
+                 "page_text": text[:self.__class__._image_text_chars]}
+                for (image_number, image, page, text), vector in zip(kept, vectors)]
+
+        self.__class__._pymilvus_client.insert(collection_name=self.__class__._image_collection, data=rows)
+
     def delete_pdf(self, file_id: str):
         """
         Delete vectors from a pdf file from Milvus db.
@@ -150,6 +299,10 @@ class Chatbot:
         documents_id: List[str] = self.__class__._milvus.get_pks(expr=f"file_id == '{file_id}'")
         self.__class__._milvus.delete(ids=documents_id)
 
+        if "images" in self.__class__._extraction_stages:
+            self.__class__._pymilvus_client.delete(collection_name=self.__class__._image_collection,
+                                                   filter=f"file_id == '{file_id}'")
+
     def get_formatted_references(self, chunk_number: int, file_id: str) -> str:
         """
         Get texts near the real reference by given chunk_number.
@@ -203,7 +356,69 @@ class Chatbot:
         contexts: List[str] = [document.page_content for document in similar_documents]
         return contexts
 
-    def _format_doc(self, docs: List[Document]) -> str:
+    def _search_images(self, query: str) -> List[Document]:
+        """
+        Search the images of the uploaded PDFs with the CLIP text embedding of the question.
+
+        Parameters:
+        query (str): user question without embeddings.
+
+        Returns:
+        List[Document]: matching images, best first, described by the text of their page. Their page, its text, a
+        short caption, the thumbnail and the similarity are in the metadata.
+        """
+        if self.image_limit <= 0 or "images" not in self.__class__._extraction_stages:
+            return []
+
+        vector = self.__class__._clip.embed_texts([query])[0]
+        hits = self.__class__._pymilvus_client.search(
+            collection_name=self.__class__._image_collection,
+            data=[vector.tolist()],
+            limit=self.image_limit,
+            output_fields=["file_id", "file_name", "page_number", "image_number", "thumbnail", "page_text"],
+            search_params={"metric_type": "IP"},
+        )[0]
+
+        images = []
+        for hit in hits:
+            if hit["distance"] < self.image_score_threshold:
+                continue
+
+            caption = (f"Image {hit['entity']['image_number']} on page {hit['entity']['page_number']} of "
+                       f"{hit['entity']['file_name']}")
+            images.append(Document(page_content=f"{caption}. Text of the page: {hit['entity']['page_text']}",
+                                   metadata={**hit["entity"], "caption": caption, "data_type": "image",
+                                             "score": hit["distance"]}))
+
+        return images
+
+    def _fuse_rankings(self, inputs: Dict[str, Any]) -> List[Document]:
+        """
+        Fuse the text and image rankings with reciprocal-rank fusion.
+
+        CLIP similarities and text embedding similarities are not on the same scale, so only the rank of a hit in its
+        own list is used: each hit scores 1 / (rrf_k + rank), and the best `limit` hits of both lists are kept. An
+        image enters the context through the text of its page, an image on a page without text has nothing to give
+        the LLM and is only shown beside the answer.
+
+        Parameters:
+        inputs (Dict[str, Any]): the retrieved 'documents' and 'images', best first.
+
+        Returns:
+        List[Document]: the fused documents, best first, with their fused score as 'rrf_score' in the metadata.
+        """
+        images = [image for image in inputs["images"] if image.metadata.get("page_text")]
+        ranked = [(1 / (self.rrf_k + rank), document)
+                  for ranking in (inputs["documents"], images)
+                  for rank, document in enumerate(ranking, start=1)]
+        # Stable sort, so on a tie (the same rank in both lists) the text hit stays first
+        ranked.sort(key=lambda hit: -hit[0])
+
+        return [Document(page_content=document.page_content, metadata={**document.metadata, "rrf_score": score})
+                for score, document in ranked[:self.limit]]
+
+    @staticmethod
+    def _format_doc(docs: List[Document]) -> str:
         """
         Joins page_content of each element using \n\n.
 
@@ -215,18 +430,17 @@ class Chatbot:
         Returns:
         str: output of joins on the page contents.
         """
-        formated_contexts = [(doc.metadata['file_id'], "<" + str(doc.metadata['chunk_number']) + ">" + doc.page_content +
-                            "</" + str(doc.metadata['chunk_number']) + ">") for doc in docs]
-
-        self._latest_context = formated_contexts
-
-        formated_documents = "\n".join("<" + str(doc.metadata['chunk_number']) + ">" + doc.page_content +
-                            "</" + str(doc.metadata['chunk_number']) + ">" for doc in docs)
+        # Images have no chunk number, they are tagged image<n> in the order of the context
+        tags = [str(doc.metadata['chunk_number']) if 'chunk_number' in doc.metadata else f"image{index}"
+                for index, doc in enumerate(docs, start=1)]
+        formated_documents = "\n".join("<" + tag + ">" + doc.page_content + "</" + tag + ">"
+                                       for tag, doc in zip(tags, docs))
 
         return formated_documents
 
-    def get_history(self, _):
-        return self._history
-    
-    def get_latest_context(self):
-        return self._latest_context
+    def _encode_history(self, history: List[Dict[str, str]]) -> str:
+        return encode_history(
+            user_header_tag=self.__class__._user_header_tag,
+            assistant_header_tag=self.__class__._assistant_header_tag,
+            histories=history,
+        )
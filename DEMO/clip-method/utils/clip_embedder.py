@@ -0,0 +1,94 @@
+from typing import List
+import base64
+import io
+
+import numpy as np
+import open_clip
+import torch
+from PIL import Image
+
+
+class ClipEmbedder:
+    """
+    Embeds images and texts into the shared space of an open_clip model.
+
+    Both towers return L2 normalized vectors, so the inner product of a text and an image is their cosine similarity.
+    Images are embedded on the CPU in batches, which is much cheaper than asking the LLM to describe every image.
+    """
+
+    def __init__(self, model_name: str = "xlm-roberta-base-ViT-B-32", pretrained: str = "laion5b_s13b_b90k",
+                 device: str = "cpu", batch_size: int = 16):
+        self.model_name = model_name
+        self.pretrained = pretrained
+        self.device = device
+        self.batch_size = batch_size
+
+        self.model, _, self.preprocess = open_clip.create_model_and_transforms(model_name, pretrained=pretrained,
+                                                                               device=device)
+        self.model.eval()
+        self.tokenizer = open_clip.get_tokenizer(model_name)
+        self.dimensions: int = int(self.embed_texts([""]).shape[1])
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(model_name={self.model_name!r}, pretrained={self.pretrained!r}, "
+                f"device={self.device!r}, batch_size={self.batch_size!r})")
+
+    def embed_images(self, images: List[Image.Image]) -> np.ndarray:
+        """
+        Embed images with the vision tower.
+
+        Parameters:
+        images (List[Image.Image]): images to embed.
+
+        Returns:
+        np.ndarray: one normalized float32 vector per image.
+        """
+        vectors = []
+
+        with torch.inference_mode():
+            for position in range(0, len(images), self.batch_size):
+                batch = torch.stack([self.preprocess(image.convert("RGB"))
+                                     for image in images[position:position + self.batch_size]]).to(self.device)
+                features = self.model.encode_image(batch)
+                vectors.append(torch.nn.functional.normalize(features, dim=-1).cpu().numpy())
+
+        return np.vstack(vectors).astype(np.float32) if vectors else np.empty((0, self.dimensions), np.float32)
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts with the text tower, e.g. a user question to search images with.
+
+        Parameters:
+        texts (List[str]): texts to embed.
+
+        Returns:
+        np.ndarray: one normalized float32 vector per text.
+        """
+        with torch.inference_mode():
+            features = self.model.encode_text(self.tokenizer(texts).to(self.device))
+            return torch.nn.functional.normalize(features, dim=-1).cpu().numpy().astype(np.float32)
+
+
+def thumbnail_base64(image: Image.Image, size: int = 256, max_length: int = 65_000) -> str:
+    """
+    Encode a small JPEG preview of an image, small enough for a Milvus VARCHAR field.
+
+    Parameters:
+    image (Image.Image): image to preview.
+    size (int): longest side of the preview in pixels.
+    max_length (int): maximum length of the returned string, the preview shrinks until it fits.
+
+    Returns:
+    str: base64 encoded JPEG.
+    """
+    while True:
+        preview = image.convert("RGB")
+        preview.thumbnail((size, size))
+        buffer = io.BytesIO()
+        preview.save(buffer, format="JPEG", quality=80)
+        encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+
+        if len(encoded) <= max_length or size <= 32:
+            return encoded
+
+        size //= 2
@@ -1,13 +1,14 @@
 import fitz
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from typing import List, Dict, Any
+from typing import Iterable, List, Dict, Any, Tuple
 from PIL import Image
 import io
 
 
 class DocumentProcessor:
     _separators: List[str] = [".", ","]
+    stages: Tuple[str, ...] = ("text", "images")
 
     def __init__(self, chunk_size: int = 400):
         self.chunk_size = chunk_size
@@ -22,39 +23,62 @@ class DocumentProcessor:
     def __repr__(self):
         return f"{self.__class__.__name__}(chunk_size={self.chunk_size!r})"
 
-    def load_pdf(self, file) -> Dict[str, List[Any]]:
+    def load_pdf(self, file, stages: Iterable[str] = ("text", "images")) -> Dict[str, List[Any]]:
         """
         Extracts text and images from a PDF file and splits it into chunks (just texts)
 
         This method using split the text using langchain.text_splitter.RecursiveCharacterTextSplitter to split the text.
+        Only the requested stages run, a text only pipeline never reads the image xrefs, let alone decodes them.
 
         Parameters:
         file (file | streamlit file_uploader like objects): returning object of streamlit.file_uploader
+        stages (Iterable[str]): extraction stages to run, any of "text" and "images".
 
         Returns:
         Dict[str, List[Any]] = chunks: chunks that separated using RecursiveCharacterTextSplitter
                                images: images that finded in the pdf file.
+                               image_pages: page number (starting from 1) of each image.
+                               image_texts: text of the page of each image, whitespace collapsed.
+                               (keys of the stages that did not run are missing)
         """
+        stages = set(stages)
+        unknown = stages - set(self.stages)
+        if unknown:
+            raise ValueError(f"Unknown extraction stages {sorted(unknown)}, expected some of {list(self.stages)}")
+
         pdf_document = fitz.open(stream=file.read(), filetype="pdf")
-        text = ""
-        pdf = {"chunks": [], "images": []}
+        texts = []
+        pdf = {}
+
+        if "images" in stages:
+            pdf["images"], pdf["image_pages"], pdf["image_texts"] = [], [], []
 
         for page_num in range(len(pdf_document)):
             page = pdf_document.load_page(page_num)
-            text += page.get_text()
 
-            images = page.get_images(full=True)
+            if "text" in stages:
+                texts.append(page.get_text())
 
-            for image in images:
-                xref = image[0]
-                image_data = pdf_document.extract_image(xref)
-                image_bytes = image_data["image"]
+            if "images" in stages:
+                images = page.get_images(full=True)
+                # The text of the page is what the LLM reads about an image found by CLIP, it cannot see the image
+                page_text = texts[-1] if "text" in stages else page.get_text() if images else ""
+                page_text = " ".join(page_text.split())
 
-                pil_image = Image.open(io.BytesIO(image_bytes))
-                pdf['images'].append(pil_image)
+                for image in images:
+                    xref = image[0]
+                    image_data = pdf_document.extract_image(xref)
+                    image_bytes = image_data["image"]
+
+                    pil_image = Image.open(io.BytesIO(image_bytes))
+                    pdf['images'].append(pil_image)
+                    pdf['image_pages'].append(page_num + 1)
+                    pdf['image_texts'].append(page_text)
 
         pdf_document.close()
 
-        text = text.replace("\n", " ")
-        pdf['chunks'] = self.text_splitter.split_text(text)
-        return pdf 
+        if "text" in stages:
+            text = "".join(texts).replace("\n", " ")
+            pdf['chunks'] = self.text_splitter.split_text(text)
+
+        return pdf
@@ -15,6 +15,15 @@ class EnvManager:
             ("openAI_base_url", "your open ai base url for connection"): "http://localhost:1234/v1",
             ("openAI_api_key", "your open ai api key"): "lm-studio",
             ("LLM_model_name", "LLM model name"): "lmstudio-community/Meta-Llama-3.1-8B-Instruct-GGUF",
+            ("extraction_stages", "PDF extraction stages, comma separated (text,images or text)"): "text,images",
+            ("clip_model_name", "open_clip model used to embed the images of the PDFs"): "xlm-roberta-base-ViT-B-32",
+            ("clip_pretrained", "pretrained weights of the open_clip model"): "laion5b_s13b_b90k",
+            ("clip_batch_size", "images embedded at once by CLIP"): "16",
+            ("min_image_size", "images with a smaller side (in pixels) are not embedded"): "64",
+            ("image_limit", "number of images returned with an answer (0 disables image search)"): "3",
+            ("image_score_threshold", "minimum CLIP similarity of a returned image"): "0.2",
+            ("image_text_chars", "characters of the page text the LLM reads about a retrieved image"): "1000",
+            ("rrf_k", "rank constant of the fusion of text and image hits"): "60",
         }
         
         self.path = dotenv_path
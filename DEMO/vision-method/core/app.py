@@ -14,6 +14,10 @@ def main():
     # Run the Streamlit app interface
     system("streamlit run chat_interface.py")
 
+def serve():
+    # Run the headless HTTP API (see server.py for the worker pool and queue options)
+    system("python server.py")
+
 def setup_env():
     # Function to set up environment variables interactively
     print("Suppose this is your first time running the app!")
@@ -72,14 +76,18 @@ if __name__ == "__main__":
         setup_env()
         print("Setup configuration has completed!")
 
-    option = int(input("1) Update configuration\n2) Continue to run app\nEnter your choice: "))
-    while option not in (1, 2):
+    menu = "1) Update configuration\n2) Continue to run app\n3) Run headless API server\nEnter your choice: "
+    option = int(input(menu))
+    while option not in (1, 2, 3):
         print("Invalid input!")  # Handle invalid input
-        option = int(input("1) Update configuration\n2) Continue to run app\nEnter your choice: "))
+        option = int(input(menu))
 
     if option == 1:
         update_env()
         print("Updating configuration has completed!")
 
     print("All done!")
-    main()
+    if option == 3:
+        serve()
+    else:
+        main()
@@ -0,0 +1,249 @@
+from argparse import ArgumentParser
+from typing import Any, Dict, List, Optional, Set, Tuple
+from sys import path
+import hashlib
+import asyncio
+import json
+import time
+import csv
+import os
+
+path.append('../')
+
+from chatbot import Chatbot
+from utils.document_processor import UploadedPDF
+from utils.resources import resources
+
+
+def read_questions(file_path: str, question_field: str = "question", id_field: str = "id") -> List[Dict[str, str]]:
+    """
+    Read the questions of a CSV or JSON lines file.
+
+    Parameters:
+    -----------
+    file_path : str
+        `.csv` file with a header row, or `.jsonl` file with one object per line.
+    question_field : str
+        Column or key holding the question.
+    id_field : str
+        Column or key holding a stable id of the question, the row number is used when it is missing. Ids are what a
+        resumed run uses to skip the answered questions, so they must not change between runs.
+
+    Returns:
+    --------
+    List[Dict[str, str]]
+        The `id` and `question` of every row.
+    """
+    with open(file_path, encoding="utf-8", newline="") as file:
+        if file_path.endswith(".csv"):
+            rows = list(csv.DictReader(file))
+        else:
+            rows = [json.loads(line) for line in file if line.strip()]
+
+    return [{"id": str(row.get(id_field) or number), "question": row[question_field]}
+            for number, row in enumerate(rows, start=1) if row.get(question_field)]
+
+
+def answered_ids(output_path: str) -> Set[str]:
+    # The checkpoint is the output itself: every line written without an error is a question that is done.
+    # A line cut by a crash is not valid JSON and is answered again.
+    done = set()
+
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            if "id" in record and not record.get("error"):
+                done.add(record["id"])
+
+    return done
+
+
+def ingested_files(output_path: str, state: str = "ingested") -> Set[Tuple[str, Optional[str]]]:
+    # The (file_id, tenant_id) of the PDFs a previous run started ("started") or finished ("ingested") ingesting,
+    # recorded in the same checkpoint
+    done = set()
+
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            if state in record:
+                done.add((record[state], record.get("tenant_id")))
+
+    return done
+
+
+def reference(document, score: float) -> Dict[str, Any]:
+    metadata = document.metadata
+    return {"file_name": metadata.get("file_name"), "page_num": metadata.get("page_num"),
+            "chunk_number": metadata.get("chunk_number"), "data_type": metadata.get("data_type"),
+            "score": score, "text": document.page_content}
+
+
+async def answer_questions(chatbot: Chatbot, questions: List[Dict[str, str]], output_path: str,
+                           concurrency: int = 4, search_batch_size: int = 64,
+                           tenant_id: Optional[str] = None) -> Dict[str, float]:
+    """
+    Answer questions in bulk and append every answer to a JSON lines file as soon as it is generated.
+
+    Each batch of questions is embedded and searched with one `Chatbot.search_many` call, then its generations are
+    sent to the LLM with at most `concurrency` requests in flight. Questions already answered in `output_path` are
+    skipped, so a crashed or interrupted run resumes where it stopped.
+
+    Parameters:
+    -----------
+    chatbot : Chatbot
+        The chatbot whose collection holds the corpus.
+    questions : List[Dict[str, str]]
+        The `id` and `question` of every question.
+    output_path : str
+        JSON lines file of the answers, also the checkpoint of the run.
+    concurrency : int
+        Generation requests sent to the LLM server at the same time.
+    search_batch_size : int
+        Questions embedded and searched together.
+    tenant_id : str, optional
+        Tenant whose documents are searched.
+
+    Returns:
+    --------
+    Dict[str, float]
+        Number of answered, failed and skipped questions and the answers per second.
+    """
+    done = answered_ids(output_path)
+    pending = [question for question in questions if question["id"] not in done]
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"answered": 0, "failed": 0, "skipped": len(questions) - len(pending)}
+    start = time.perf_counter()
+
+    async def answer(question: Dict[str, str], documents: list) -> Dict[str, Any]:
+        async with semaphore:
+            answer_start = time.perf_counter()
+            record = {**question, "answer": None, "error": None,
+                      "references": [reference(document, score) for document, score in documents]}
+
+            try:
+                record["answer"] = await chatbot.agenerate(question["question"],
+                                                           [document for document, _ in documents])
+            except Exception as error:
+                record["error"] = f"{type(error).__name__}: {error}"
+
+            record["seconds"] = time.perf_counter() - answer_start
+            return record
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        for batch_start in range(0, len(pending), search_batch_size):
+            batch = pending[batch_start:batch_start + search_batch_size]
+            # search_many blocks on the embedding model and Milvus, keep the event loop free meanwhile
+            results = await asyncio.to_thread(chatbot.search_many, [question["question"] for question in batch],
+                                              tenant_id=tenant_id)
+
+            for task in asyncio.as_completed([answer(question, documents)
+                                              for question, documents in zip(batch, results)]):
+                record = await task
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                counts["failed" if record["error"] else "answered"] += 1
+
+            elapsed = time.perf_counter() - start
+            print(f"{batch_start + len(batch)}/{len(pending)} questions, {counts['failed']} failed, "
+                  f"{counts['answered'] / elapsed:.2f} answers/s")
+
+    counts["answers_per_second"] = counts["answered"] / max(time.perf_counter() - start, 1e-9)
+    return counts
+
+
+def ingest(chatbot: Chatbot, pdf_paths: List[str], output_path: str, tenant_id: Optional[str] = None) -> None:
+    """
+    Save the PDFs of the corpus, skipping those a previous run already ingested.
+
+    The file_id of a PDF is its tenant followed by the hash of its content, so the same PDF never gets two copies in
+    the collection of a tenant, and the PDF uploaded by another tenant is never touched. Every PDF is recorded in the
+    output file, the checkpoint of the run, when its ingestion starts and when it is done: only a PDF started and never
+    finished has partial records to remove.
+
+    Parameters:
+    -----------
+    chatbot : Chatbot
+        The chatbot whose collection receives the PDFs.
+    pdf_paths : List[str]
+        The PDFs of the corpus.
+    output_path : str
+        JSON lines file of the answers, also the checkpoint of the run.
+    tenant_id : str, optional
+        Tenant the PDFs are saved for.
+
+    Returns:
+    --------
+    None
+    """
+    done = ingested_files(output_path)
+    started = ingested_files(output_path, state="started")
+    tenant = tenant_id or Chatbot._default_tenant
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        for pdf_path in pdf_paths:
+            with open(pdf_path, "rb") as file:
+                data = file.read()
+
+            pdf = UploadedPDF(data=data, name=os.path.basename(pdf_path),
+                              file_id=f"{tenant}-{hashlib.sha256(data).hexdigest()}")
+            if (pdf.file_id, tenant_id) in done:
+                print(f"Skipped {pdf.name}, already ingested")
+                continue
+
+            start = time.perf_counter()
+            if (pdf.file_id, tenant_id) in started:
+                # Whatever the interrupted run stored for this PDF is removed first
+                chatbot.delete_pdf(pdf.file_id, tenant_id=tenant_id)
+            else:
+                output.write(json.dumps({"started": pdf.file_id, "file_name": pdf.name, "tenant_id": tenant_id}) + "\n")
+                output.flush()
+
+            chatbot.save_pdf(pdf, tenant_id=tenant_id)
+
+            output.write(json.dumps({"ingested": pdf.file_id, "file_name": pdf.name, "tenant_id": tenant_id}) + "\n")
+            output.flush()
+            done.add((pdf.file_id, tenant_id))
+            print(f"Ingested {pdf.name} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Answer a file of questions against a set of PDFs.")
+    parser.add_argument("questions", help="CSV (with a header) or JSON lines file of questions")
+    parser.add_argument("--pdf", nargs="+", default=[],
+                        help="PDFs to ingest first, those a previous run ingested are skipped")
+    parser.add_argument("--output", default="answers.jsonl", help="answers, appended to and used to resume")
+    parser.add_argument("--question-field", default="question")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM requests in flight")
+    parser.add_argument("--search-batch-size", type=int, default=64, help="questions embedded and searched at once")
+    parser.add_argument("--limit", type=int, default=3, help="documents retrieved per question")
+    parser.add_argument("--tenant", help="tenant the PDFs are ingested for and searched in")
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions, question_field=args.question_field, id_field=args.id_field)
+
+    # The collection is kept between runs, so a resumed run still finds the PDFs it skips
+    Chatbot._env_values["drop_old_collection"] = "false"
+    chatbot = Chatbot(limit=args.limit)
+    resources.warm_up()
+    ingest(chatbot, args.pdf, args.output, tenant_id=args.tenant)
+
+    counts = asyncio.run(answer_questions(chatbot, questions, args.output, concurrency=args.concurrency,
+                                          search_batch_size=args.search_batch_size, tenant_id=args.tenant))
+    print(f"Done: {counts['answered']} answered, {counts['failed']} failed, {counts['skipped']} already answered "
+          f"({counts['answers_per_second']:.2f} answers/s), answers in {args.output}")
@@ -0,0 +1,413 @@
+from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from tempfile import TemporaryDirectory
+from threading import Lock, local
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID, uuid4
+from sys import path, platform
+import resource
+import json
+import glob
+import time
+import os
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+path.append('../')
+
+from utils.document_processor import DocumentProcessor, UploadedPDF
+from utils.resources import resources
+from chatbot import Chatbot, _create_embedding
+from mock_openai_server import MockOpenAIServer
+
+# Questions used when no --queries file is given, generic enough to hit any corpus
+default_queries: List[str] = [
+    "What is this document about?",
+    "Summarize the main points of the document.",
+    "Which organizations are mentioned and what is their role?",
+    "What numbers or figures are reported in the tables?",
+    "What does the document say about human rights?",
+    "What are the conclusions or recommendations?",
+]
+
+
+class StageRecorder:
+    """
+    Collects durations per pipeline stage.
+
+    Stages are measured as self time: when a measured stage runs inside another one on the same thread (embedding
+    inside the Milvus insert, splitting inside the PDF parsing) the inner time is subtracted from the outer stage, so
+    every second is attributed to exactly one stage. Stages marked inclusive (totals) keep their full duration.
+    """
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock: Lock = Lock()
+        self._local: local = local()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def begin(self, stage: str, inclusive: bool = False) -> list:
+        frame = [stage, time.perf_counter(), 0.0, inclusive]
+        self._stack().append(frame)
+        return frame
+
+    def end(self, frame: list) -> None:
+        stage, start, children, inclusive = frame
+        elapsed = time.perf_counter() - start
+        stack = self._stack()
+
+        if frame in stack:
+            stack.remove(frame)
+            if stack:
+                stack[-1][2] += elapsed
+        else:
+            # Ended on another thread than it began, nothing nested can be attributed
+            children = 0.0
+
+        self.add(stage, elapsed if inclusive else elapsed - children)
+
+    @contextmanager
+    def measure(self, stage: str, inclusive: bool = False):
+        frame = self.begin(stage, inclusive=inclusive)
+        try:
+            yield
+        finally:
+            self.end(frame)
+
+    def wrap(self, stage: str, function: Callable) -> Callable:
+        @wraps(function)
+        def timed(*args, **kwargs):
+            with self.measure(stage):
+                return function(*args, **kwargs)
+
+        return timed
+
+    def summary(self, stages: List[str]) -> Dict[str, Dict[str, float]]:
+        result = {}
+
+        for stage in stages:
+            if not self.samples.get(stage):
+                continue
+
+            samples = np.asarray(self.samples[stage], dtype=np.float64) * 1000
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            result[stage] = {"count": int(samples.size), "total_ms": float(samples.sum()),
+                             "mean_ms": float(samples.mean()), "p50_ms": float(p50), "p95_ms": float(p95),
+                             "p99_ms": float(p99)}
+
+        return result
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+
+class TimedEmbeddings(Embeddings):
+    def __init__(self, embedding: Embeddings, recorder: StageRecorder):
+        self.embedding = embedding
+        self.recorder = recorder
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.recorder.measure("embed"):
+            return self.embedding.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self.recorder.measure("embed_query"):
+            return self.embedding.embed_query(text)
+
+
+class StageTimingHandler(BaseCallbackHandler):
+    """
+    Times the query path of the RAG chain from LangChain callbacks: retrieval (as self time, the query embedding is
+    recorded by TimedEmbeddings), context formatting, prompt building, time to first token and generation.
+    """
+
+    def __init__(self, recorder: StageRecorder):
+        self.recorder = recorder
+        self._frames: Dict[UUID, list] = {}
+        self._starts: Dict[UUID, tuple] = {}
+        self._first_token: Dict[UUID, bool] = {}
+
+    def on_retriever_start(self, serialized, query, *, run_id: UUID, **kwargs: Any) -> None:
+        self._frames[run_id] = self.recorder.begin("search")
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs: Any) -> None:
+        if (frame := self._frames.pop(run_id, None)) is not None:
+            self.recorder.end(frame)
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, **kwargs: Any) -> None:
+        stage = {"PromptTemplate": "prompt_build", "_format_doc": "format"}.get(kwargs.get("name"))
+        if stage:
+            self._starts[run_id] = (stage, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any) -> None:
+        if (start := self._starts.pop(run_id, None)) is not None:
+            self.recorder.add(start[0], time.perf_counter() - start[1])
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any) -> None:
+        self._starts[run_id] = ("generate", time.perf_counter())
+        self._first_token[run_id] = False
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if self._first_token.get(run_id) is False:
+            self._first_token[run_id] = True
+            self.recorder.add("ttft", time.perf_counter() - self._starts[run_id][1])
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        self._first_token.pop(run_id, None)
+        self.on_chain_end(response, run_id=run_id)
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 1024 ** 2 if platform == "darwin" else peak / 1024
+
+
+def expand_corpus(patterns: List[str]) -> List[str]:
+    files = []
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.extend(sorted(glob.glob(os.path.join(pattern, "*.pdf"))))
+        else:
+            files.extend(sorted(glob.glob(pattern)))
+
+    return files
+
+
+def run_benchmark(corpus: List[str], queries: List[str], repeat: int, concurrency: int, embedding: str,
+                  server: MockOpenAIServer, milvus_uri: str) -> Dict[str, Any]:
+    """
+    Ingest the corpus and answer the queries with the real Chatbot, pointed at the mock OpenAI server.
+
+    Parameters:
+    -----------
+    corpus : List[str]
+        Paths of the PDFs to ingest.
+    queries : List[str]
+        Questions asked once the corpus is ingested.
+    repeat : int
+        How many times the whole query list is asked.
+    concurrency : int
+        Number of questions in flight at the same time.
+    embedding : str
+        'hf' for the real embedding model of the Chatbot, 'mock' for the hashed embeddings of the mock server.
+    server : MockOpenAIServer
+        The running stand-in for LM Studio.
+    milvus_uri : str
+        Milvus to benchmark against, a local file path uses milvus-lite.
+
+    Returns:
+    --------
+    Dict[str, Any]
+        Per-stage latency percentiles, throughput and peak RSS of the ingestion and query phases.
+    """
+    recorder = StageRecorder()
+
+    # Point every Chatbot resource at the benchmark services before anything is loaded
+    Chatbot._env_values.update({
+        "openAI_base_url": server.base_url,
+        "openAI_api_key": "mock",
+        "LLM_model_name": "mock-model",
+        "milvus_uri": milvus_uri,
+        "collection_name": "rag_benchmark",
+    })
+
+    start = time.perf_counter()
+    if embedding == "mock":
+        inner_embedding = OpenAIEmbeddings(model="mock-model", base_url=server.base_url, api_key="mock",
+                                           check_embedding_ctx_length=False)
+    else:
+        inner_embedding = _create_embedding()
+    resources.override("embedding", TimedEmbeddings(inner_embedding, recorder))
+    load_times = {"embedding": time.perf_counter() - start, **resources.warm_up()}
+
+    chatbot = Chatbot()
+
+    # Wrap the components save_pdf goes through, the code path itself is untouched
+    processor: DocumentProcessor = Chatbot._documentProcessor
+    processor.load_pdf = recorder.wrap("parse", processor.load_pdf)
+    processor.text_splitter.split_text = recorder.wrap("chunk", processor.text_splitter.split_text)
+    milvus = resources.get("milvus")
+    milvus.add_documents = recorder.wrap("insert", milvus.add_documents)
+    chatbot.analyze_image = recorder.wrap("analyze_image", chatbot.analyze_image)
+    chatbot.analyze_table = recorder.wrap("analyze_table", chatbot.analyze_table)
+
+    chunks_count = 0
+    original_add_documents = milvus.add_documents
+
+    def count_chunks(documents, **kwargs):
+        nonlocal chunks_count
+        chunks_count += len(documents)
+        return original_add_documents(documents, **kwargs)
+
+    milvus.add_documents = count_chunks
+
+    file_ids = []
+    ingestion_start = time.perf_counter()
+    for file_path in corpus:
+        with open(file_path, "rb") as file:
+            pdf = UploadedPDF(data=file.read(), name=os.path.basename(file_path), file_id=str(uuid4()))
+
+        with recorder.measure("ingest_total", inclusive=True):
+            chatbot.save_pdf(pdf)
+        file_ids.append(pdf.file_id)
+    ingestion_seconds = time.perf_counter() - ingestion_start
+
+    handler = StageTimingHandler(recorder)
+
+    def ask(question: str) -> None:
+        with recorder.measure("query_total", inclusive=True):
+            for _ in chatbot.get_response(query=question, history=[], stream=True, config={"callbacks": [handler]}):
+                pass
+
+    questions = queries * repeat
+    query_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(ask, questions))
+    query_seconds = time.perf_counter() - query_start
+
+    # Only what the benchmark saved, the image store may be shared with a running chat app
+    chatbot.delete_pdfs(file_ids)
+
+    return {
+        "cold_start": load_times,
+        "ingestion": {
+            "documents": len(corpus),
+            "chunks": chunks_count,
+            "seconds": ingestion_seconds,
+            "documents_per_second": len(corpus) / ingestion_seconds if ingestion_seconds else 0.0,
+            "chunks_per_second": chunks_count / ingestion_seconds if ingestion_seconds else 0.0,
+            "stages": recorder.summary(["parse", "chunk", "analyze_image", "analyze_table", "embed", "insert",
+                                        "ingest_total"]),
+        },
+        "query": {
+            "queries": len(questions),
+            "concurrency": concurrency,
+            "seconds": query_seconds,
+            "queries_per_second": len(questions) / query_seconds if query_seconds else 0.0,
+            "stages": recorder.summary(["embed_query", "search", "format", "prompt_build", "ttft", "generate",
+                                        "query_total"]),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare_results(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compare the p50 and p95 of every stage with a previous run.
+
+    Parameters:
+    -----------
+    results : Dict[str, Any]
+        Output of `run_benchmark`.
+    baseline : Dict[str, Any]
+        Output of a previous run, loaded from its JSON file.
+    threshold : float
+        Relative slowdown above which a stage is reported as a regression (0.1 is 10%).
+
+    Returns:
+    --------
+    List[str]
+        One line per regressed stage, empty when nothing got slower than the threshold.
+    """
+    regressions = []
+
+    for phase in ("ingestion", "query"):
+        for stage, stats in results[phase]["stages"].items():
+            previous = baseline.get(phase, {}).get("stages", {}).get(stage)
+            if not previous:
+                continue
+
+            for percentile in ("p50_ms", "p95_ms"):
+                if previous[percentile] <= 0:
+                    continue
+
+                change = stats[percentile] / previous[percentile] - 1
+                print(f"{phase:<10}{stage:<15}{percentile:<8}{previous[percentile]:>10.1f} -> "
+                      f"{stats[percentile]:>10.1f} ms ({change:+.1%})")
+
+                if change > threshold:
+                    regressions.append(f"{phase}/{stage} {percentile} is {change:+.1%} slower than the baseline")
+
+    return regressions
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    for phase in ("ingestion", "query"):
+        print(f"\n{phase.capitalize()}:")
+        print(f"{'stage':<15}{'count':>7}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+        for stage, stats in results[phase]["stages"].items():
+            print(f"{stage:<15}{stats['count']:>7}{stats['p50_ms']:>12.1f}{stats['p95_ms']:>12.1f}"
+                  f"{stats['p99_ms']:>12.1f}")
+
+    ingestion, query = results["ingestion"], results["query"]
+    print(f"\n{ingestion['documents_per_second']:.2f} documents/s, {ingestion['chunks_per_second']:.1f} chunks/s, "
+          f"{query['queries_per_second']:.2f} queries/s, peak RSS {results['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark ingestion and query latency of the RAG pipeline per stage.")
+    parser.add_argument("--corpus", nargs="+", default=["un.pdf"], help="PDF files, globs or directories")
+    parser.add_argument("--queries", help="text file with one question per line")
+    parser.add_argument("--repeat", type=int, default=3, help="times the query list is asked")
+    parser.add_argument("--concurrency", type=int, default=1, help="questions in flight at the same time")
+    parser.add_argument("--embedding", choices=["hf", "mock"], default="hf",
+                        help="real embedding model of the Chatbot or hashed embeddings from the mock server")
+    parser.add_argument("--milvus-uri", help="Milvus to use, defaults to a temporary milvus-lite database")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock LLM seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="mock LLM tokens per second")
+    parser.add_argument("--max-tokens", type=int, default=64, help="mock LLM tokens per answer")
+    parser.add_argument("--port", type=int, default=1235, help="port of the mock OpenAI server")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to save the results")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    corpus = expand_corpus(args.corpus)
+    if not corpus:
+        parser.error("the corpus doesn't contain any PDF")
+
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as file:
+            queries = [line.strip() for line in file if line.strip()]
+    else:
+        queries = default_queries
+
+    server = MockOpenAIServer(port=args.port, latency=args.latency, token_rate=args.token_rate,
+                              max_tokens=args.max_tokens).start()
+
+    try:
+        with TemporaryDirectory() as directory:
+            results = run_benchmark(corpus=corpus, queries=queries, repeat=args.repeat, concurrency=args.concurrency,
+                                    embedding=args.embedding, server=server,
+                                    milvus_uri=args.milvus_uri or os.path.join(directory, "benchmark.db"))
+    finally:
+        server.stop()
+
+    results["config"] = {**vars(args), "corpus": corpus, "date": datetime.now(timezone.utc).isoformat()}
+    print_results(results)
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare_results(results, json.load(file), threshold=args.threshold)
+
+        if regressions:
+            print("\n".join(["", "Regressions:"] + regressions))
+            raise SystemExit(1)
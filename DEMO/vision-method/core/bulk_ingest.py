@@ -0,0 +1,296 @@
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+from pathlib import Path
+from uuid import uuid4
+from sys import path
+import hashlib
+import sqlite3
+import time
+import os
+
+path.append('../')
+
+from utils.document_processor import DocumentProcessor, UploadedPDF
+from utils.filters import check_id
+
+# Set in every worker process by _init_worker
+_worker_processor: Optional[DocumentProcessor] = None
+
+
+def list_pdfs(source: str) -> List[str]:
+    """
+    List the PDFs to ingest.
+
+    Parameters:
+    -----------
+    source : str
+        A directory, searched recursively, or a manifest file with one PDF path per line.
+
+    Returns:
+    --------
+    List[str]
+        The PDF paths, sorted so that runs visit the files in the same order.
+    """
+    if os.path.isdir(source):
+        return sorted(str(pdf) for pdf in Path(source).rglob("*") if pdf.suffix.lower() == ".pdf")
+
+    with open(source, encoding="utf-8") as manifest:
+        return [line.strip() for line in manifest if line.strip() and not line.startswith("#")]
+
+
+class ProgressStore:
+    """
+    SQLite record of every PDF of a bulk ingestion: its content hash, the file_id its vectors were inserted with and
+    whether the insert completed. It is what makes a run resumable and lets unchanged files be skipped.
+
+    Records are kept per tenant, so ingesting the same files for another tenant with the same database does not skip
+    them.
+    """
+
+    def __init__(self, db_path: str, tenant_id: str = "default"):
+        self.tenant_id = tenant_id
+        self.connection = sqlite3.connect(db_path)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(files)")]
+
+        if columns and "tenant_id" not in columns:
+            # Databases of the single tenant version, their files were ingested for the default tenant
+            self.connection.execute("ALTER TABLE files RENAME TO files_without_tenant")
+
+        self.connection.execute("CREATE TABLE IF NOT EXISTS files (tenant_id TEXT, path TEXT, sha256 TEXT, "
+                                "file_id TEXT, status TEXT, chunks INTEGER, error TEXT, updated_at REAL, "
+                                "PRIMARY KEY (tenant_id, path))")
+
+        if columns and "tenant_id" not in columns:
+            self.connection.execute("INSERT INTO files SELECT 'default', * FROM files_without_tenant")
+            self.connection.execute("DROP TABLE files_without_tenant")
+
+        self.connection.commit()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(tenant_id={self.tenant_id!r}, files={self.count()})"
+
+    def get(self, pdf_path: str) -> Optional[Tuple[str, str, str]]:
+        return self.connection.execute("SELECT sha256, file_id, status FROM files WHERE tenant_id = ? AND path = ?",
+                                       (self.tenant_id, pdf_path)).fetchone()
+
+    def set(self, pdf_path: str, sha256: Optional[str], file_id: Optional[str], status: str, chunks: int = 0,
+            error: Optional[str] = None) -> None:
+        self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                (self.tenant_id, pdf_path, sha256, file_id, status, chunks, error, time.time()))
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def count(self, status: Optional[str] = None) -> int:
+        if status is None:
+            return self.connection.execute("SELECT COUNT(*) FROM files WHERE tenant_id = ?",
+                                           (self.tenant_id,)).fetchone()[0]
+        return self.connection.execute("SELECT COUNT(*) FROM files WHERE tenant_id = ? AND status = ?",
+                                       (self.tenant_id, status)).fetchone()[0]
+
+
+def _init_worker(processor: DocumentProcessor) -> None:
+    global _worker_processor
+    _worker_processor = processor
+
+
+def parse_pdf(task: Tuple[str, Optional[str]]) -> Dict[str, object]:
+    # Runs in a worker process: hash the file, and parse it only when its content changed since the last run
+    pdf_path, known_sha256 = task
+
+    try:
+        with open(pdf_path, "rb") as file:
+            data = file.read()
+
+        sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 == known_sha256:
+            return {"path": pdf_path, "sha256": sha256, "skipped": True}
+
+        pdf = UploadedPDF(data=data, name=os.path.basename(pdf_path), file_id="")
+        chunks = _worker_processor.load_pdf(pdf, stages=("text",))["chunks"]
+        return {"path": pdf_path, "sha256": sha256, "chunks": chunks}
+    except Exception as error:
+        return {"path": pdf_path, "error": f"{type(error).__name__}: {error}"}
+
+
+def bounded_map(executor: ProcessPoolExecutor, function, items: Iterator, window: int) -> Iterator:
+    # executor.map submits every item at once and parsed files would pile up in memory while the embedding, the
+    # slower stage, catches up. Keep at most `window` files in flight and yield the results in order.
+    futures = deque()
+
+    for item in items:
+        futures.append(executor.submit(function, item))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+
+    while futures:
+        yield futures.popleft().result()
+
+
+def text_documents(chunks: List[Tuple[str, Dict]], file_id: str, file_name: str, tenant_id: str) -> list:
+    from langchain_core.documents import Document
+
+    # Same metadata as the text chunks of Chatbot.save_pdf, so the chat app can search and reference them
+    return [Document(page_content=chunk,
+                     metadata={"tenant_id": tenant_id, "file_id": file_id, "file_name": file_name,
+                               "chunk_number": number, "data_type": "text", "file_path": "",
+                               "page_num": str(chunk_info["page_num"]), "image_num": "", "table_num": "",
+                               "table_markdown": "",
+                               "bbox": ",".join(map(str, chunk_info["bbox"]))})
+            for number, (chunk, chunk_info) in enumerate(chunks, start=1)]
+
+
+def bulk_ingest(pdf_paths: List[str], store: ProgressStore, milvus, workers: int = os.cpu_count() or 1,
+                embed_batch_size: int = 512, processor: Optional[DocumentProcessor] = None,
+                report_every: int = 100, tenant_id: str = "default") -> Dict[str, float]:
+    """
+    Parse PDFs in a process pool and insert their text chunks into Milvus, embedding the chunks of several files in
+    shared batches.
+
+    A file is marked done in the progress store only once all of its chunks are inserted. A file that was being
+    inserted when a previous run stopped has its partial vectors deleted and is ingested again, and a file whose
+    hash did not change since it was ingested is skipped.
+
+    Parameters:
+    -----------
+    pdf_paths : List[str]
+        The PDFs to ingest.
+    store : ProgressStore
+        Progress of this and the previous runs, for `tenant_id`.
+    milvus : Milvus
+        LangChain Milvus store of the chat app collection, its embedding function embeds every batch.
+    workers : int
+        Parsing processes.
+    embed_batch_size : int
+        Chunks gathered, from any number of files, before they are embedded and inserted together.
+    processor : DocumentProcessor, optional
+        Splits the text of every PDF, sent to each worker process. A default DocumentProcessor when not given.
+    report_every : int
+        Print the throughput every this many files.
+    tenant_id : str
+        Tenant the PDFs are ingested for.
+
+    Returns:
+    --------
+    Dict[str, float]
+        Counts of ingested, skipped and failed files, chunks and the documents per second.
+    """
+    # The tenant goes into the metadata, the partition key and the cleanup filter
+    check_id(tenant_id, kind="tenant id")
+    if store.tenant_id != tenant_id:
+        raise ValueError(f"The progress store records tenant {store.tenant_id!r}, not {tenant_id!r}")
+
+    counts = {"ingested": 0, "skipped": 0, "failed": 0, "chunks": 0}
+    pending_documents, pending_files = [], []
+    start = time.perf_counter()
+
+    def flush() -> None:
+        if not pending_files:
+            return
+
+        # Recorded first: if the run stops during the insert, the next run knows which vectors to clean up
+        for pdf_path, sha256, file_id, chunks in pending_files:
+            store.set(pdf_path, sha256, file_id, "inserting", chunks)
+        store.commit()
+
+        if pending_documents:
+            milvus.add_documents(documents=pending_documents, ids=[str(uuid4()) for _ in pending_documents],
+                                 batch_size=len(pending_documents))
+
+        for pdf_path, sha256, file_id, chunks in pending_files:
+            store.set(pdf_path, sha256, file_id, "done", chunks)
+        store.commit()
+
+        counts["ingested"] += len(pending_files)
+        counts["chunks"] += len(pending_documents)
+        pending_documents.clear()
+        pending_files.clear()
+
+    def tasks() -> Iterator[Tuple[str, Optional[str]]]:
+        for pdf_path in pdf_paths:
+            record = store.get(pdf_path)
+            yield pdf_path, record[0] if record and record[2] == "done" else None
+
+    # Spawned, not forked: the parent already holds the embedding model and its threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"), initializer=_init_worker,
+                             initargs=(processor or DocumentProcessor(),)) as executor:
+        for number, result in enumerate(bounded_map(executor, parse_pdf, tasks(), window=workers * 4), start=1):
+            pdf_path = result["path"]
+            record = store.get(pdf_path)
+
+            if result.get("skipped"):
+                counts["skipped"] += 1
+            elif "error" in result:
+                # The file_id of an earlier insert is kept, its vectors are deleted once the file parses again
+                store.set(pdf_path, record[0] if record else None, record[1] if record else None, "failed",
+                          error=result["error"])
+                counts["failed"] += 1
+            else:
+                if record and record[1]:
+                    # Changed since it was ingested, or interrupted while inserting: remove the old vectors
+                    milvus.delete(expr=f"tenant_id == '{tenant_id}' and file_id == '{check_id(record[1])}'")
+
+                file_id = str(uuid4())
+                pending_documents.extend(text_documents(result["chunks"], file_id, os.path.basename(pdf_path),
+                                                        tenant_id))
+                pending_files.append((pdf_path, result["sha256"], file_id, len(result["chunks"])))
+
+                if len(pending_documents) >= embed_batch_size:
+                    flush()
+
+            if number % report_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{number}/{len(pdf_paths)} files, {counts['ingested']} ingested, {counts['skipped']} skipped, "
+                      f"{counts['failed']} failed, {counts['ingested'] / elapsed:.2f} docs/s, "
+                      f"{counts['chunks'] / elapsed:.1f} chunks/s")
+
+        flush()
+
+    store.commit()
+    elapsed = time.perf_counter() - start
+    counts["seconds"] = elapsed
+    counts["docs_per_second"] = counts["ingested"] / max(elapsed, 1e-9)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Ingest a directory or manifest of PDFs into the chat app collection.")
+    parser.add_argument("source", help="directory searched recursively for PDFs, or a file with one path per line")
+    parser.add_argument("--progress-db", default="ingest_progress.sqlite", help="progress database, to resume runs")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parsing processes")
+    parser.add_argument("--embed-batch-size", type=int, default=512, help="chunks embedded and inserted together")
+    parser.add_argument("--report-every", type=int, default=100, help="files between throughput reports")
+    parser.add_argument("--tenant", default="default", help="tenant the PDFs are ingested for")
+    args = parser.parse_args()
+
+    try:
+        check_id(args.tenant, kind="tenant id")
+    except ValueError as e:
+        parser.error(str(e))
+
+    from langchain_milvus import Milvus
+
+    from chatbot import Chatbot
+    from utils.resources import resources
+    from utils.tracing import tracer, TracedEmbeddings
+
+    # Insert into the existing collection instead of recreating it, set drop_old_collection=false in .env so the
+    # chat app keeps it as well
+    resources.override("milvus", Milvus(embedding_function=TracedEmbeddings(resources.get("embedding"), tracer),
+                                        connection_args={"uri": Chatbot._env_values["milvus_uri"]},
+                                        collection_name=Chatbot._env_values["collection_name"],
+                                        drop_old=False, partition_key_field="tenant_id",
+                                        vector_field=Chatbot._vector_field, text_field=Chatbot._text_field))
+
+    pdfs = list_pdfs(args.source)
+    print(f"{len(pdfs)} PDFs to check")
+
+    counts = bulk_ingest(pdfs, ProgressStore(args.progress_db, tenant_id=args.tenant), resources.get("milvus"),
+                         workers=args.workers, embed_batch_size=args.embed_batch_size,
+                         processor=Chatbot._documentProcessor, report_every=args.report_every,
+                         tenant_id=args.tenant)
+    print(f"Done in {counts['seconds']:.0f}s: {counts['ingested']} ingested ({counts['docs_per_second']:.2f} docs/s, "
+          f"{counts['chunks']} chunks), {counts['skipped']} unchanged, {counts['failed']} failed")
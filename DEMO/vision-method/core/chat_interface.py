@@ -1,15 +1,134 @@
 from typing import Dict, List
+from dotenv import dotenv_values
+from sys import path
+from uuid import uuid4
 
 import streamlit as st
 from chatbot import Chatbot
 import re
 
+path.append('../')
+
+from utils.ingestion_queue import IngestionQueue, IngestionJob
+from utils.session_reaper import SessionReaper
+from utils.resources import resources
+from utils.metrics import start_metrics_server, track_queue
+
 dotenv_path = ".env"
 
 
+@st.cache_resource
+def warm_up_resources() -> None:
+    # Runs once per process: load the embedding model, Milvus and the LLM client in the background so the page
+    # renders right away and the first question doesn't pay the whole cold start
+    env_values = dotenv_values(dotenv_path)
+    budget = float(env_values.get("cold_start_budget", "120"))
+    resources.warm_up_in_background(budget=budget)
+
+    if env_values.get("metrics_port"):
+        start_metrics_server(port=int(env_values["metrics_port"]), pipeline="vision",
+                             version=env_values.get("app_version") or "demo",
+                             image_store=Chatbot._documentProcessor.image_store)
+
+
+@st.cache_resource
+def get_chatbot() -> Chatbot:
+    # A Chatbot keeps no per-request state, so every session shares one instance
+    return Chatbot()
+
+
+@st.cache_resource
+def get_ingestion_queue() -> IngestionQueue:
+    # Uploads are ingested in background threads so the script (and the chat) never waits for save_pdf
+    chatbot = get_chatbot()
+    env_values = dotenv_values(dotenv_path)
+    workers = int(env_values.get("ingestion_workers", "1"))
+    queue = IngestionQueue(ingest=chatbot.save_pdf, cleanup=chatbot.delete_pdf, max_workers=workers)
+    track_queue("ingestion", lambda: len(queue.active_jobs()), pipeline="vision",
+                version=env_values.get("app_version") or "demo")
+    return queue
+
+
+@st.cache_resource
+def get_session_reaper() -> SessionReaper:
+    # Deletes the PDFs of the sessions whose tab was closed, the app process may run for weeks
+    chatbot = get_chatbot()
+    ingestion_queue = get_ingestion_queue()
+    env_values = dotenv_values(dotenv_path)
+
+    def cleanup(file_ids: List[str], tenant_id: str) -> None:
+        # Files still being ingested are cancelled, the ingestion queue deletes what they already stored
+        chatbot.delete_pdfs(file_ids=[file_id for file_id in file_ids if not ingestion_queue.cancel(file_id=file_id)],
+                            tenant_id=tenant_id)
+
+    reaper = SessionReaper(cleanup=cleanup, ttl=float(env_values.get("session_ttl", "3600")),
+                           interval=float(env_values.get("session_reap_interval", "60")))
+    reaper.start()
+    track_queue("sessions", lambda: len(reaper), pipeline="vision", version=env_values.get("app_version") or "demo")
+    return reaper
+
+
 class ChatInterface:
     def __init__(self):
-        self.chatbot = Chatbot()
+        warm_up_resources()
+        self.chatbot = get_chatbot()
+        self.ingestion_queue = get_ingestion_queue()
+        self.session_reaper = get_session_reaper()
+
+    def remove_pdf(self, file_id: str) -> None:
+        """
+        Remove a PDF that was taken out of the uploader.
+
+        If the PDF is still being ingested its job is cancelled and the ingestion queue deletes whatever was
+        already stored once the job stops, otherwise its vectors and images are deleted right away.
+
+        Parameters:
+        file_id (str): The file_id that streamlit gave to the uploaded file.
+        """
+        if not self.ingestion_queue.cancel(file_id=file_id):
+            self.chatbot.delete_pdf(file_id=file_id, tenant_id=st.session_state.tenant_id)
+
+        self.session_reaper.release(session_id=st.session_state.tenant_id, file_id=file_id)
+
+    def send_heartbeat(self) -> None:
+        """
+        Tell the session reaper that this session is still open.
+
+        Runs as a fragment on a timer, so an idle but open tab keeps its PDFs while a closed one stops sending
+        heartbeats and has its PDFs deleted after `session_ttl` seconds.
+        """
+        self.session_reaper.heartbeat(session_id=st.session_state.tenant_id, tenant_id=st.session_state.tenant_id)
+
+    def has_active_jobs(self, files_id: List[str]) -> bool:
+        return any((job := self.ingestion_queue.get(file_id)) is not None and job.is_active for file_id in files_id)
+
+    def display_ingestion_status(self, files_id: List[str], polling: bool = False) -> None:
+        """
+        Shows the progress of the background ingestion jobs of this session in the sidebar.
+
+        A job that is done is forgotten by the ingestion queue once this session has seen it. When the last job of
+        the session finishes, the whole app reruns once, so the fragment is rendered again without a timer.
+
+        Parameters:
+        files_id (List[str]): file_ids uploaded in this session.
+        polling (bool): Whether the fragment is refreshed on a timer.
+        """
+        for file_id in files_id:
+            job = self.ingestion_queue.get(file_id)
+
+            if job is None:
+                continue
+
+            if job.status == IngestionJob.DONE:
+                self.ingestion_queue.forget(file_id)
+            elif job.status == IngestionJob.FAILED:
+                # Kept until the queue's finished_ttl, so the error stays visible for a while
+                st.error(f"{job.file_name}: {job.message}")
+            else:
+                st.progress(job.progress, text=f"{job.file_name}: {job.message}")
+
+        if polling and not self.has_active_jobs(files_id):
+            st.rerun()
 
     def display_chat(self, messages: List[Dict[str, str]]) -> None:
         """
@@ -52,6 +171,10 @@ class ChatInterface:
         if "file_names" not in st.session_state:
             st.session_state.file_names = []
 
+        # Each session is its own tenant: it only searches the PDFs it uploaded
+        if "tenant_id" not in st.session_state:
+            st.session_state.tenant_id = str(uuid4())
+
         # Custom CSS for hover effect
         st.markdown(
             """
@@ -110,25 +233,34 @@ class ChatInterface:
                 for file_id in st.session_state.files_id:
                     if file_id not in uploaded_ids:
                         # This file has deleted
-                        self.chatbot.delete_pdf(file_id=file_id)
+                        self.remove_pdf(file_id=file_id)
                         st.session_state.files_id.remove(file_id)
 
                 for file in uploaded_files:
                     current_files.append(file.name)
                     if file.file_id not in st.session_state.files_id:
-                        # New file uploaded
-                        self.chatbot.save_pdf(file)
+                        # New file uploaded, it is searchable once its ingestion job is done
+                        self.ingestion_queue.submit(file, tenant_id=st.session_state.tenant_id)
+                        self.session_reaper.track(session_id=st.session_state.tenant_id, file_id=file.file_id)
                         st.session_state.files_id.append(file.file_id)
                         st.session_state.file_names.append(file.name)
 
-                        st.success("PDF files uploaded successfully!")
+                        st.success(f"{file.name} queued for processing!")
             else:
                 # Delete last remaining id
                 for file_id in st.session_state.files_id:
-                    self.chatbot.delete_pdf(file_id=file_id)
+                    self.remove_pdf(file_id=file_id)
 
                 st.session_state.files_id = []
 
+            # Refresh only this part of the sidebar while files of this session are being processed
+            polling = self.has_active_jobs(st.session_state.files_id)
+            st.fragment(self.display_ingestion_status, run_every=1 if polling else None)(
+                list(st.session_state.files_id), polling=polling)
+
+            # Several heartbeats per TTL, so a session is not reaped because one of them was late
+            st.fragment(self.send_heartbeat, run_every=self.session_reaper.ttl / 4)()
+
             st.write("File status:")
             for file_name in st.session_state.file_names:
                 if uploaded_files and file_name in current_files:
@@ -147,15 +279,21 @@ class ChatInterface:
             with st.chat_message("assistant"):
                 message_placeholder = st.empty()
                 full_response = ""
-                completion = self.chatbot.get_response(query=user_input, history=st.session_state.messages, stream=False)
+                documents = []
+                completion = self.chatbot.get_response(query=user_input, history=st.session_state.messages, stream=True,
+                                                       tenant_id=st.session_state.tenant_id)
 
                 for response in completion:
-                    full_response += response
-                    message_placeholder.markdown(full_response + "▌", unsafe_allow_html=True)
+                    if "documents" in response:
+                        documents = response["documents"]
+
+                    if "answer" in response:
+                        full_response += response["answer"]
+                        message_placeholder.markdown(full_response + "▌", unsafe_allow_html=True)
 
                 message_placeholder.markdown(full_response, unsafe_allow_html=True)
 
-                references = self.chatbot.get_formatted_references()
+                references = self.chatbot.get_formatted_references(documents)
 
                 response_with_references = full_response
 
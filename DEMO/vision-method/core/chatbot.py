@@ -1,7 +1,10 @@
 from sys import path
 from dotenv import dotenv_values
 from collections import OrderedDict
-from typing import List, Iterator, Dict, Tuple
+from typing import List, Iterator, AsyncIterator, Dict, Tuple, Any, Callable, Optional
+from operator import itemgetter
+from threading import Event
+from functools import cached_property
 from uuid import uuid4, UUID
 from pymilvus import MilvusClient
 from openai import OpenAI as lm_studio
@@ -15,16 +18,56 @@ from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
 from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnableConfig, ConfigurableField
 
 path.append('../')
 
 from utils.document_processor import DocumentProcessor
+from utils.image_store import ImageStore
+from utils.token_chunker import TokenChunker
 from utils.tokenizer import encode_history
+from utils.resources import resources
+from utils.tracing import tracer, TracedEmbeddings
+from utils.filters import check_id
 
 dotenv_path = '.env'
 
 
+# Factories of the heavy Chatbot resources. They run the first time a resource is used (or when the registry is
+# warmed up), not when this module is imported.
+def _create_embedding() -> HuggingFaceEmbeddings:
+    return HuggingFaceEmbeddings(model_name=Chatbot._embedding_model_name,
+                                 model_kwargs=Chatbot._embedding_model_kwargs)
+
+
+def _create_llm() -> OpenAI:
+    return OpenAI(base_url=Chatbot._env_values["openAI_base_url"],
+                  api_key=Chatbot._env_values["openAI_api_key"],
+                  model=Chatbot._env_values["LLM_model_name"])
+
+
+def _create_milvus() -> Milvus:
+    return Milvus(
+        embedding_function=TracedEmbeddings(resources.get("embedding"), tracer),
+        connection_args={"uri": Chatbot._env_values["milvus_uri"]},
+        collection_name=Chatbot._env_values["collection_name"],
+        # Keep the collection when it was filled ahead of time (e.g. by the bulk ingestion CLI)
+        drop_old=Chatbot._env_values.get("drop_old_collection", "true").lower() == "true",
+        # Records are hashed into partitions by tenant, a search filtered on one tenant only scans its partition
+        partition_key_field="tenant_id",
+        vector_field=Chatbot._vector_field,
+        text_field=Chatbot._text_field,
+    )
+
+
+def _create_pymilvus_client() -> MilvusClient:
+    return MilvusClient(uri=Chatbot._env_values["milvus_uri"])
+
+
+def _create_vision_client() -> lm_studio:
+    return lm_studio(base_url=Chatbot._env_values["openAI_base_url"], api_key=Chatbot._env_values["openAI_api_key"])
+
+
 class Chatbot:
     # User and assistant header tags for conversation context
     _user_header_tag: str = "<|eot_id|><|start_header_id|>user<|end_header_id|>"
@@ -61,56 +104,90 @@ class Chatbot:
     # Load environment variables from a .env file
     _env_values: OrderedDict = dotenv_values(dotenv_path)
 
-    # Initialize DocumentProcessor with a specified chunk size
-    _documentProcessor: DocumentProcessor = DocumentProcessor(chunk_size=int(_env_values["chunk_size"]))
-
     # Specify the embedding model and its parameters
     _embedding_model_name = "Alibaba-NLP/gte-multilingual-base"
     _embedding_model_kwargs = {"trust_remote_code": True}
-    _embedding: HuggingFaceEmbeddings = HuggingFaceEmbeddings(model_name=_embedding_model_name,
-                                                              model_kwargs=_embedding_model_kwargs)
+
+    # Initialize DocumentProcessor with a specified chunk size, in characters or (chunk_unit=tokens) in tokens of the
+    # embedding model. Images repeated across PDFs are stored once with content_addressed_images=true.
+    _documentProcessor: DocumentProcessor = DocumentProcessor(
+        chunk_size=int(_env_values.get("chunk_size", "400")),
+        chunker=TokenChunker(model_name=_embedding_model_name, max_tokens=int(_env_values.get("chunk_size", "400")),
+                             overlap_tokens=int(_env_values.get("chunk_overlap", "64")))
+        if _env_values.get("chunk_unit", "characters") == "tokens" else None,
+        image_store=ImageStore(base_directory=DocumentProcessor.base_directory,
+                               content_addressed=_env_values.get("content_addressed_images", "false").lower() == "true"))
+    _embedding: HuggingFaceEmbeddings = resources.lazy("embedding", _create_embedding)
+
+    # Fields of the Milvus collection holding the embedding and the chunk text
+    _vector_field: str = _env_values.get("vector_field", "vector")
+    _text_field: str = _env_values.get("text_field", "text")
 
     # Initialize the OpenAI model for generating responses
-    _llm: OpenAI = OpenAI(base_url=_env_values["openAI_base_url"],
-                          api_key=_env_values["openAI_api_key"],
-                          model=_env_values["LLM_model_name"])
-
-    # Configure the Milvus database connection for storing embeddings
-    _milvus: Milvus = Milvus(
-        embedding_function=_embedding,
-        connection_args={"uri": _env_values["milvus_uri"]},
-        collection_name=_env_values["collection_name"],
-        drop_old=True,
-    )
+    _llm: OpenAI = resources.lazy("llm", _create_llm)
+
+    # Configure the Milvus database connection for storing embeddings (drops the old collection when first loaded,
+    # unless drop_old_collection is false)
+    _milvus: Milvus = resources.lazy("milvus", _create_milvus)
 
     # Initialize a Milvus client for managing the database
-    _pymilvus_client: MilvusClient = MilvusClient(
-        uri=_env_values["milvus_uri"]
-    )
+    _pymilvus_client: MilvusClient = resources.lazy("pymilvus_client", _create_pymilvus_client)
+
+    # OpenAI client of the vision model used to analyze images (served by the same LM Studio as the LLM)
+    _vision_model_name: str = _env_values.get("vision_model_name", "xtuner/llava-llama-3-8b-v1_1-gguf")
+    _vision_client: lm_studio = resources.lazy("vision_client", _create_vision_client)
+
+    # Tenant of the records saved and searched without an explicit tenant_id
+    _default_tenant: str = "default"
 
     def __init__(self, prompt_template: str = _prompt_template, limit: int = 3):
-        self._history = None  # Stores the history of the conversation
-        self._used_contexts = []  # Keeps track of latest contexts used in the conversation
         self.prompt_template = prompt_template  # Sets the prompt template
         self.limit = limit  # Sets the maximum number of results to retrieve
         self._rag_prompt: PromptTemplate = PromptTemplate.from_template(prompt_template)  # Creates a prompt template for RAG
         self._table_analyze_prompt: PromptTemplate = PromptTemplate.from_template(
             self.__class__._table_analyzation_prompt_template)  # Creates a prompt template for table analysis
-        self._retriever = self.__class__._milvus.as_retriever(search_type="similarity", search_kwargs={"k": limit})  # Configures the retriever
-
-        # Define the RAG chain combining context retrieval, formatting, and response generation
-        self._rag_chain = {"context": self._retriever | self._format_doc, "history": RunnableLambda(self.get_history),
-                           "question": RunnablePassthrough()} | self._rag_prompt | self.__class__._llm | StrOutputParser()
 
+    # The retriever and chains need the embedding model, Milvus and the LLM, so they are built on first use and a
+    # Chatbot can be created before the shared resources have finished loading.
+    @cached_property
+    def _retriever(self):
+        # The search kwargs are configurable so each request filters on its own tenant, see `_run_config`
+        return self.__class__._milvus.as_retriever(search_type="similarity", search_kwargs={"k": self.limit}) \
+            .configurable_fields(search_kwargs=ConfigurableField(id="search_kwargs"))
+
+    @cached_property
+    def _rag_chain(self):
+        # Define the RAG chain combining context retrieval, formatting, and response generation.
+        # The chain input is {"question": str, "history": List[Dict[str, str]]}, so retrieval and history encoding
+        # are independent branches of one RunnableParallel and run concurrently (ainvoke/astream gather them).
+        # Retrieved documents are returned next to the answer instead of being stored on the instance, so a single
+        # Chatbot can serve concurrent requests.
+        retrieval = RunnableParallel(documents=itemgetter("question") | self._retriever,
+                                     history=itemgetter("history") | RunnableLambda(self._encode_history),
+                                     question=itemgetter("question"))
+        generation = {"context": itemgetter("documents") | RunnableLambda(self._format_doc),
+                      "history": itemgetter("history"),
+                      "question": itemgetter("question")} | self._generation_chain
+        return retrieval.assign(answer=generation).pick(["answer", "documents"])
+
+    @cached_property
+    def _generation_chain(self):
+        # The generation half of the RAG chain, for callers that retrieved the documents themselves
+        return self._rag_prompt | self.__class__._llm | StrOutputParser()
+
+    @cached_property
+    def _table_analyze_chain(self):
         # Define the table analysis chain for summarizing table data
-        self._table_analyze_chain = self._table_analyze_prompt | self.__class__._llm | StrOutputParser()
+        return self._table_analyze_prompt | self.__class__._llm | StrOutputParser()
 
     def __repr__(self):
         return (f"{self.__class__.__name__}("
                 f"prompt_template={self.prompt_template}, "
                 f"limit={self.limit})")
 
-    def get_response(self, query: str, history: List[Dict[str, str]], stream: bool = False) -> Iterator[str] | str:
+    def get_response(self, query: str, history: List[Dict[str, str]], stream: bool = False,
+                     config: Optional[RunnableConfig] = None,
+                     tenant_id: Optional[str] = None) -> Iterator[Dict[str, Any]] | Dict[str, Any]:
         """
         Retrieve a response from the LLM model based on the user's query.
 
@@ -125,27 +202,186 @@ class Chatbot:
             The chat history containing previous exchanges between the user and the model.
         stream : bool, optional
             If set to True, the method returns a streamed version of the response; otherwise, it returns the complete response (default is False).
+        config : RunnableConfig, optional
+            LangChain run config passed to the chain (callbacks, tags, metadata).
+        tenant_id : str, optional
+            Only the documents of this tenant are retrieved, the default tenant when not given.
 
         Returns:
         --------
-        Iterator[str] | str
-            The output of the chain invocation, which can either be a streamed response or a single complete response.
+        Iterator[Dict[str, Any]] | Dict[str, Any]
+            A dictionary with the 'answer' string and the retrieved 'documents' used as its context.
+            When streamed, partial dictionaries are yielded: 'documents' once retrieval is done, then 'answer' chunks.
         """
 
-        self._history = encode_history(
-            user_header_tag=self.__class__._user_header_tag,
-            assistant_header_tag=self.__class__._assistant_header_tag,
-            histories=history,
-        )
-
-        chain = self._rag_chain
+        chain_input = {"question": query, "history": history}
 
         if stream:
-            return chain.stream(query)
+            return self._rag_chain.stream(chain_input, config=self._run_config(config, tenant_id))
+
+        return self._rag_chain.invoke(chain_input, config=self._run_config(config, tenant_id))
+
+    async def aget_response(self, query: str, history: List[Dict[str, str]],
+                            config: Optional[RunnableConfig] = None, tenant_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Asynchronously retrieve a response from the LLM model based on the user's query.
+
+        This is the async counterpart of `get_response`. The query embedding and Milvus search run in the default
+        executor (pymilvus has no asyncio client), history encoding runs alongside them, and the LLM call goes through
+        the async OpenAI client, so the event loop stays free while waiting on the model.
+
+        Parameters:
+        -----------
+        query : str
+            The question posed by the user, without any embeddings.
+        history : List[Dict[str, str]]
+            The chat history containing previous exchanges between the user and the model.
+        config : RunnableConfig, optional
+            LangChain run config passed to the chain (callbacks, tags, metadata).
+        tenant_id : str, optional
+            Only the documents of this tenant are retrieved, the default tenant when not given.
+
+        Returns:
+        --------
+        Dict[str, Any]
+            A dictionary with the 'answer' string and the retrieved 'documents' used as its context.
+        """
+        return await self._rag_chain.ainvoke({"question": query, "history": history},
+                                             config=self._run_config(config, tenant_id))
+
+    async def astream(self, query: str, history: List[Dict[str, str]], config: Optional[RunnableConfig] = None,
+                      tenant_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Asynchronously stream a response from the LLM model based on the user's query.
+
+        Works like `aget_response` but yields partial dictionaries: 'documents' once retrieval is done, then the
+        'answer' token by token as the async OpenAI client receives them.
+
+        Parameters:
+        -----------
+        query : str
+            The question posed by the user, without any embeddings.
+        history : List[Dict[str, str]]
+            The chat history containing previous exchanges between the user and the model.
+        config : RunnableConfig, optional
+            LangChain run config passed to the chain (callbacks, tags, metadata).
+        tenant_id : str, optional
+            Only the documents of this tenant are retrieved, the default tenant when not given.
+
+        Returns:
+        --------
+        AsyncIterator[Dict[str, Any]]
+            Partial outputs of the chain in the order they are generated.
+        """
+        async for chunk in self._rag_chain.astream({"question": query, "history": history},
+                                                   config=self._run_config(config, tenant_id)):
+            yield chunk
+
+    def _run_config(self, config: Optional[RunnableConfig], tenant_id: Optional[str]) -> RunnableConfig:
+        # Tracing callbacks plus the tenant filter of the retriever
+        config = dict(tracer.config(config) or {})
+        config["configurable"] = {**config.get("configurable", {}),
+                                  "search_kwargs": {"k": self.limit, "expr": self._tenant_filter(tenant_id)}}
+        return config
+
+    @classmethod
+    def _tenant_filter(cls, tenant_id: Optional[str]) -> str:
+        return f"tenant_id == '{check_id(tenant_id or cls._default_tenant, kind='tenant id')}'"
+
+    async def agenerate(self, query: str, documents: List[Document], history: Optional[List[Dict[str, str]]] = None,
+                        config: Optional[RunnableConfig] = None) -> str:
+        """
+        Asynchronously answer a question from documents that were already retrieved.
+
+        Used with `search_many` by batch jobs: the questions are searched in bulk, then only the generation is sent
+        to the LLM for each of them.
+
+        Parameters:
+        -----------
+        query : str
+            The question posed by the user.
+        documents : List[Document]
+            The context documents of the question.
+        history : List[Dict[str, str]], optional
+            The chat history, none by default.
+        config : RunnableConfig, optional
+            LangChain run config passed to the chain (callbacks, tags, metadata).
 
-        return chain.invoke(query)
+        Returns:
+        --------
+        str
+            The answer of the LLM.
+        """
+        return await self._generation_chain.ainvoke({"context": self._format_doc(documents),
+                                                     "history": self._encode_history(history or []),
+                                                     "question": query}, config=tracer.config(config))
+
+    def search_many(self, queries: List[str], limit: Optional[int] = None, batch_size: int = 256,
+                    tenant_id: Optional[str] = None) -> List[List[Tuple[Document, float]]]:
+        """
+        Retrieve the documents of many queries at once.
+
+        The retriever embeds and searches one query per call. Here every batch of queries is embedded in one model
+        call and searched with one multi-vector Milvus request, which is what evaluation runs, bulk question answering
+        and multi-query strategies need.
+
+        Parameters:
+        -----------
+        queries : List[str]
+            The questions to search for.
+        limit : int, optional
+            Documents returned per query, the `limit` of the Chatbot when not given.
+        batch_size : int
+            Queries embedded and searched per request.
+        tenant_id : str, optional
+            Only the documents of this tenant are searched, the default tenant when not given.
+
+        Returns:
+        --------
+        List[List[Tuple[Document, float]]]
+            For every query its documents, most similar first, with the distance Milvus scored them with (the same
+            documents and scores as `similarity_search_with_score`).
+        """
+        collection_name = self.__class__._env_values['collection_name']
+        vector_field, text_field = self.__class__._vector_field, self.__class__._text_field
+        tenant_filter = self._tenant_filter(tenant_id)
+
+        # Nothing was saved yet: the collection is created by the first insert
+        if not self.__class__._pymilvus_client.has_collection(collection_name=collection_name):
+            return [[] for _ in queries]
+
+        milvus = self.__class__._milvus
+        results = []
+
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            vectors = milvus.embedding_func.embed_queries(batch)
+
+            with tracer.span("milvus.search", queries=len(batch)):
+                hits = self.__class__._pymilvus_client.search(
+                    collection_name=collection_name,
+                    data=vectors,
+                    anns_field=vector_field,
+                    filter=tenant_filter,
+                    limit=limit or self.limit,
+                    output_fields=["*"],
+                    search_params=milvus.search_params,
+                )
 
-    def save_pdf(self, file) -> None:
+            for query_hits in hits:
+                documents = []
+                for hit in query_hits:
+                    metadata = dict(hit["entity"])
+                    metadata.pop(vector_field, None)
+                    documents.append((Document(page_content=metadata.pop(text_field), metadata=metadata),
+                                      hit["distance"]))
+                results.append(documents)
+
+        return results
+
+    @tracer.traced("save_pdf")
+    def save_pdf(self, file, progress_callback: Optional[Callable[[float, str], None]] = None,
+                 cancel_event: Optional[Event] = None, tenant_id: Optional[str] = None) -> None:
         """
         Save a PDF file and its content into the Milvus database.
 
@@ -158,39 +394,76 @@ class Chatbot:
         -----------
         file : file or streamlit file_uploader-like object
             A file object returned by streamlit's file_uploader or similar objects, representing the PDF to be processed.
+        progress_callback : Callable[[float, str], None], optional
+            Called with the progress (0 to 1) and a short description each time a step of the ingestion finishes.
+        cancel_event : threading.Event, optional
+            When set, the ingestion stops before the next image/table analysis and nothing is inserted into Milvus.
+        tenant_id : str, optional
+            Tenant owning the PDF, only its searches will see it. The default tenant when not given.
 
         Returns:
         --------
         None
             The function doesn't return any value; it stores the extracted and processed data directly into the Milvus database.
         """
-
-        pdf_data = self.__class__._documentProcessor.load_pdf(file=file)
-        chunks = pdf_data['chunks']
-        images = pdf_data['images']
-        tables = pdf_data['tables']
-
-        images_analyzation = [(self.analyze_image(image), file_path, image_info) for file_path, image, image_info in
-                              images]
-        tables_analyzation = [(self.analyze_table(full_table_data), full_table_data, page_num, table_num) for
-                              full_table_data, page_num, table_num in tables]
+        report = progress_callback or (lambda progress, message: None)
+
+        def cancelled() -> bool:
+            return cancel_event is not None and cancel_event.is_set()
+
+        tenant_id = tenant_id or self.__class__._default_tenant
+        self._tenant_filter(tenant_id)  # Rejects an invalid tenant id before any work is done
+        check_id(file.file_id)  # The file id is used in the filters of the references and of delete_pdf
+        tracer.current_span().set_attributes(file_id=file.file_id, file_name=file.name, tenant_id=tenant_id)
+
+        report(0.0, "Extracting text, images and tables")
+        with tracer.span("load_pdf") as load_span:
+            pdf_data = self.__class__._documentProcessor.load_pdf(file=file, tenant_id=tenant_id)
+            chunks = pdf_data['chunks']
+            images = pdf_data['images']
+            tables = pdf_data['tables']
+            load_span.set_attributes(chunks=len(chunks), images=len(images), tables=len(tables),
+                                     bytes=len(file.getvalue()) if hasattr(file, "getvalue") else -1)
+
+        # Analyzing images and tables calls the LLM once per item, it is what dominates the ingestion time
+        analyzes_count = max(len(images) + len(tables), 1)
+        images_analyzation = []
+        tables_analyzation = []
+
+        for file_path, image, image_info in images:
+            if cancelled():
+                return
+
+            images_analyzation.append((self.analyze_image(image), file_path, image_info))
+            report(0.1 + 0.7 * len(images_analyzation) / analyzes_count,
+                   f"Analyzed image {len(images_analyzation)}/{len(images)}")
+
+        for full_table_data, page_num, table_num in tables:
+            if cancelled():
+                return
+
+            tables_analyzation.append((self.analyze_table(full_table_data), full_table_data, page_num, table_num))
+            report(0.1 + 0.7 * (len(images_analyzation) + len(tables_analyzation)) / analyzes_count,
+                   f"Analyzed table {len(tables_analyzation)}/{len(tables)}")
 
         documents = []
 
-        for idx, chunk in enumerate(chunks):
+        for idx, (chunk, chunk_info) in enumerate(chunks):
             documents.append(
                 Document(
-                    page_content=chunk[0],
+                    page_content=chunk,
                     metadata={
+                        "tenant_id": tenant_id,
                         "file_id": file.file_id,
                         "file_name": file.name,
                         "chunk_number": idx + 1,
                         "data_type": "text",
                         "file_path": "",
-                        "page_num": "",
+                        "page_num": str(chunk_info['page_num']),
                         "image_num": "",
                         "table_num": "",
                         "table_markdown": "",
+                        "bbox": ",".join(map(str, chunk_info['bbox'])),
                     }
                 )
             )
@@ -200,6 +473,7 @@ class Chatbot:
                 Document(
                     page_content=analyze,
                     metadata={
+                        "tenant_id": tenant_id,
                         "file_id": file.file_id,
                         "file_name": file.name,
                         "chunk_number": idx + 1,
@@ -209,6 +483,7 @@ class Chatbot:
                         "image_num": str(image_info['image_num']),
                         "table_num": "",
                         "table_markdown": "",
+                        "bbox": "",
                     }
                 )
             )
@@ -219,6 +494,7 @@ class Chatbot:
                 Document(
                     page_content=analyze,
                     metadata={
+                        "tenant_id": tenant_id,
                         "file_id": file.file_id,
                         "file_name": file.name,
                         "chunk_number": idx + 1,
@@ -228,14 +504,21 @@ class Chatbot:
                         "image_num": "",
                         "table_num": str(table_num),
                         "table_markdown": full_table_data,
+                        "bbox": "",
                     }
                 )
             )
 
+        if cancelled():
+            return
+
+        report(0.8, f"Embedding and saving {len(documents)} chunks")
         document_ids: List[str] = [str(uuid4()) for _ in documents]
-        self.__class__._milvus.add_documents(documents=documents, ids=document_ids)
+        with tracer.span("milvus.insert", documents=len(documents)):
+            self.__class__._milvus.add_documents(documents=documents, ids=document_ids)
+        report(1.0, "Done")
 
-    def delete_pdf(self, file_id: str):
+    def delete_pdf(self, file_id: str, tenant_id: Optional[str] = None):
         """
         Delete vectors associated with a PDF file from the Milvus database.
 
@@ -247,27 +530,66 @@ class Chatbot:
         -----------
         file_id : str
             The unique identifier assigned to each uploaded file, used to locate and delete its corresponding vectors in the database.
+        tenant_id : str, optional
+            Tenant owning the PDF, only its records and images are deleted. The default tenant when not given.
 
         Returns:
         --------
         None
             The function doesn't return any value; it removes the relevant data from the Milvus database.
         """
-        documents_id: List[str] = self.__class__._milvus.get_pks(expr=f"file_id == '{file_id}'")
-        deleted_images: List[str] = self.__class__._documentProcessor.delete_images(file_id=file_id)
-        self.__class__._milvus.delete(ids=documents_id)
+        self.delete_pdfs(file_ids=[file_id], tenant_id=tenant_id)
 
-    def get_formatted_references(self) -> List[str]:
+    def delete_pdfs(self, file_ids: List[str], tenant_id: Optional[str] = None) -> None:
+        """
+        Delete the vectors and images of several PDFs at once.
+
+        The vectors of all the files are removed with a single delete by expression, instead of looking up their
+        primary keys file by file. It is what the session reaper calls for the PDFs of an expired session.
+
+        Parameters:
+        -----------
+        file_ids : List[str]
+            The file_ids of the PDFs to delete.
+        tenant_id : str, optional
+            Tenant owning the PDFs, only its records and images are deleted. The default tenant when not given, the
+            same file_id in other tenants is never touched.
+
+        Returns:
+        --------
+        None
+        """
+        if not file_ids:
+            return
+
+        tenant_id = tenant_id or self.__class__._default_tenant
+        expr = f"{self._tenant_filter(tenant_id)} and file_id in [" + \
+               ", ".join(f"'{check_id(file_id)}'" for file_id in file_ids) + "]"
+
+        for file_id in file_ids:
+            self.__class__._documentProcessor.delete_images(file_id=file_id, tenant_id=tenant_id)
+
+        # Nothing was saved yet: the collection is created by the first insert
+        if not self.__class__._pymilvus_client.has_collection(
+                collection_name=self.__class__._env_values['collection_name']):
+            return
+
+        with tracer.span("milvus.delete", files=len(file_ids)):
+            self.__class__._milvus.delete(expr=expr)
+
+    @tracer.traced("get_formatted_references")
+    def get_formatted_references(self, documents: List[Document]) -> List[str]:
         """
         Retrieve and format reference texts or data near a specified chunk number.
 
         This method filters and sorts text, image, and table chunks based on their proximity to a provided chunk number, returning them in a formatted way.
         It highlights text chunks near the reference and provides base64-encoded image and table data.
-        The references are fetched from `_used_contexts` and queried from the Milvus database.
+        The references are the documents returned with an answer and their neighbours are queried from the Milvus database.
 
         Parameters:
         -----------
-        None
+        documents : List[Document]
+            The 'documents' returned by `get_response` for the answer that is being referenced.
 
         Returns:
         --------
@@ -275,21 +597,25 @@ class Chatbot:
             A sorted list of formatted references (texts, images, or tables) around the specified chunk number. Each reference is provided with the necessary context, such as chunk number, file name, and page number.
         """
 
-        documents = self._used_contexts
-
         references = []
         if not documents:
             return []
 
         for document in documents:
             if document.metadata['data_type'] == 'text':
-                file_datas = self.__class__._pymilvus_client.query(
-                    collection_name=self.__class__._env_values['collection_name'],
-                    filter=f"file_id == '{document.metadata['file_id']}'"
-                )
-
                 chunk_number = document.metadata['chunk_number']
 
+                # Only the neighbouring chunks are read, not every chunk of the file
+                with tracer.span("milvus.query", file_id=document.metadata['file_id']) as query_span:
+                    file_datas = self.__class__._pymilvus_client.query(
+                        collection_name=self.__class__._env_values['collection_name'],
+                        filter=f"{self._tenant_filter(document.metadata.get('tenant_id'))} and "
+                               f"file_id == '{check_id(document.metadata['file_id'])}' and data_type == 'text' and "
+                               f"chunk_number >= {chunk_number - 1} and chunk_number <= {chunk_number + 1}",
+                        output_fields=["chunk_number", "data_type", "text"],
+                    )
+                    query_span.set_attribute("rows", len(file_datas))
+
                 near_references = sorted(
                     filter(lambda file_data:
                            chunk_number - 1 <= int(file_data['chunk_number']) <= chunk_number + 1, file_datas),
@@ -308,7 +634,12 @@ class Chatbot:
                     chunk_texts[reference_index] = "<mark style='background-color: yellow'>" + chunk_texts[
                         reference_index] + "</mark>"
 
-                references.append(" ".join(chunk_texts))
+                reference = " ".join(chunk_texts)
+                if document.metadata.get('page_num'):
+                    reference += f"<p>This text located in <b>{document.metadata['file_name']}</b> at page number " \
+                                 f"<b>{document.metadata['page_num']}</b> </p>"
+
+                references.append(reference)
 
             elif document.metadata['data_type'] == 'image-analyze':
                 try:
@@ -339,6 +670,7 @@ class Chatbot:
 
         return references
 
+    @tracer.traced("analyze_image")
     def analyze_image(self, image_base64: str) -> str:
         """
         Analyze an image and provide a detailed description.
@@ -356,15 +688,14 @@ class Chatbot:
         str
             A detailed description of the image, including any text or table content, generated by the Vision model.
         """
-        llava_model_name = "xtuner/llava-llama-3-8b-v1_1-gguf"
-        client: lm_studio = lm_studio(base_url="http://localhost:1234/v1", api_key="lm-studio")
+        client: lm_studio = self.__class__._vision_client
 
         analyze_prompt = "Instructions:\n" \
                          "- **List** all features in the image.\n" \
                          "- If there is any text or table in the image describe a summary of it."
 
         completion = client.chat.completions.create(
-            model=llava_model_name,
+            model=self.__class__._vision_model_name,
             messages=[
                 {
                     "role": "system",
@@ -387,8 +718,14 @@ class Chatbot:
             stream=False
         )
 
+        if completion.usage is not None:
+            tracer.current_span().set_attributes(image_bytes=len(image_base64) * 3 // 4,
+                                                 prompt_tokens=completion.usage.prompt_tokens,
+                                                 completion_tokens=completion.usage.completion_tokens)
+
         return completion.choices[0].message.content
 
+    @tracer.traced("analyze_table")
     def analyze_table(self, table_markdown: str) -> str:
         """
         Analyze a table provided in Markdown format.
@@ -406,14 +743,15 @@ class Chatbot:
         str
             The result of the table analysis as generated by the table analysis chain.
         """
-        return self._table_analyze_chain.invoke(table_markdown)
+        tracer.current_span().set_attribute("table_chars", len(table_markdown))
+        return self._table_analyze_chain.invoke(table_markdown, config=tracer.config())
 
-    def _format_doc(self, docs: List[Document]) -> str:
+    @staticmethod
+    def _format_doc(docs: List[Document]) -> str:
         """
         Format a list of documents by joining their content.
 
         This method takes a list of `Document` objects and joins the `page_content` of each document into a single string, separated by double newlines.
-        It also updates the `_used_contexts` attribute with the provided documents for potential future reference.
 
         Parameters:
         -----------
@@ -425,44 +763,34 @@ class Chatbot:
         str
             A single string containing the combined page contents of the documents, separated by double newlines.
         """
-        self._used_contexts = list(docs)
-
         formated_documents = "\n".join(doc.page_content for doc in docs)
 
         return formated_documents
 
-    def get_history(self, _):
+    def _encode_history(self, history: List[Dict[str, str]]) -> str:
         """
-        Retrieve the history of interactions.
+        Encode the chat history of a single request.
 
-        This method returns the stored history of interactions that have taken place, which may include previous questions and answers.
+        This method is used as a branch of the RAG chain, so the history of each request travels with the chain input
+        instead of being stored on the instance.
 
         Parameters:
         -----------
-        _ : Any
-            An unused parameter, kept for consistency in method signatures.
+        history : List[Dict[str, str]]
+            The chat history containing previous exchanges between the user and the model.
 
         Returns:
         --------
-        Any
-            The stored history of interactions.
-        """
-        return self._history
-
-    def get_latest_context(self):
+        str
+            The history formatted with the Llama 3 header tags.
         """
-        Get the most recent contexts used for processing.
-
-        This method returns the latest set of contexts (documents) that have been used for processing within the system.
-        These contexts can be utilized for further interactions or analyses.
+        return encode_history(
+            user_header_tag=self.__class__._user_header_tag,
+            assistant_header_tag=self.__class__._assistant_header_tag,
+            histories=history,
+        )
 
-        Parameters:
-        -----------
-        None
 
-        Returns:
-        --------
-        List[Document]
-            A list of the most recently used document contexts.
-        """
-        return self._used_contexts
+# Spans are exported to the file and/or OpenTelemetry collector set in the .env, tracing is off when neither is set
+tracer.configure(file_path=Chatbot._env_values.get("trace_file"),
+                 otlp_endpoint=Chatbot._env_values.get("otlp_endpoint"))
@@ -0,0 +1,134 @@
+from argparse import ArgumentParser
+from typing import Dict, List
+from sys import path
+import json
+import time
+import re
+
+import fitz
+import numpy as np
+
+path.append('../')
+
+from utils.document_processor import DocumentProcessor
+from utils.token_chunker import TokenChunker
+
+
+def pdf_pages(pdf_path: str) -> List[str]:
+    # The texts load_pdf splits: one per page, built from the text blocks like chunk_page does
+    with fitz.open(pdf_path) as pdf_document:
+        return [DocumentProcessor.page_text(page)[0] for page in pdf_document]
+
+
+def split_pages(split, pages: List[str]) -> List[str]:
+    # Chunks never cross pages, every page is split on its own
+    return [chunk for page in pages for chunk in split(page)]
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def throughput(split, pages: List[str], repeat: int) -> Dict[str, float]:
+    """
+    Measure how fast a splitter chunks the pages of a document.
+
+    Parameters:
+    -----------
+    split : Callable[[str], List[str]]
+        The `split_text` of the splitter.
+    pages : List[str]
+        The page texts to split, several MB in total to see the difference.
+    repeat : int
+        Number of runs, the fastest one is reported.
+
+    Returns:
+    --------
+    Dict[str, float]
+        Best time in seconds, MB per second and the chunks of the last run.
+    """
+    best, chunks = float("inf"), []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = split_pages(split, pages)
+        best = min(best, time.perf_counter() - start)
+
+    size = sum(len(page.encode()) for page in pages)
+    return {"seconds": best, "mb_per_second": size / 1024 ** 2 / best, "chunks": chunks}
+
+
+def recall_at_k(chunks: List[str], questions: List[Dict[str, str]], model, k: int) -> float:
+    """
+    Share of the questions whose answer is found in one of the top k chunks retrieved for them.
+
+    Parameters:
+    -----------
+    chunks : List[str]
+        The chunks of the splitter.
+    questions : List[Dict[str, str]]
+        `question` and `answer`, the answer being a span of the document text.
+    model : SentenceTransformer
+        The embedding model of the chat app.
+    k : int
+        Number of chunks retrieved per question.
+
+    Returns:
+    --------
+    float
+        Recall@k.
+    """
+    chunk_vectors = model.encode(chunks, batch_size=32, normalize_embeddings=True, convert_to_numpy=True)
+    query_vectors = model.encode([item["question"] for item in questions], batch_size=32, normalize_embeddings=True,
+                                 convert_to_numpy=True)
+    top_k = np.argsort(-(query_vectors @ chunk_vectors.T), axis=1)[:, :k]
+    normalized_chunks = [normalize(chunk) for chunk in chunks]
+
+    found = [any(normalize(item["answer"]) in normalized_chunks[index] for index in indexes)
+             for item, indexes in zip(questions, top_k)]
+    return float(np.mean(found))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare the character splitter with the token chunker.")
+    parser.add_argument("pdf", nargs="?", default="un.pdf")
+    parser.add_argument("--chunk-size", type=int, default=400, help="characters of the character splitter")
+    parser.add_argument("--max-tokens", type=int, default=128, help="tokens of the token chunker")
+    parser.add_argument("--overlap-tokens", type=int, default=16)
+    parser.add_argument("--model", default="Alibaba-NLP/gte-multilingual-base")
+    parser.add_argument("--model-max-tokens", type=int, default=8192, help="input limit of the embedding model")
+    parser.add_argument("--copies", type=int, default=20, help="the PDF text is repeated to time multi-MB inputs")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--questions", help="JSON lines of {question, answer} to measure recall, answers being "
+                                            "spans of the PDF text")
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = pdf_pages(args.pdf)
+    splitters = {"characters": DocumentProcessor(chunk_size=args.chunk_size).text_splitter,
+                 "tokens": TokenChunker(model_name=args.model, max_tokens=args.max_tokens,
+                                        overlap_tokens=args.overlap_tokens)}
+    counter = splitters["tokens"]
+
+    questions, model = [], None
+    if args.questions:
+        from sentence_transformers import SentenceTransformer
+
+        with open(args.questions, encoding="utf-8") as file:
+            questions = [json.loads(line) for line in file if line.strip()]
+        model = SentenceTransformer(args.model, trust_remote_code=True)
+
+    large_pages = pages * args.copies
+    print(f"{args.pdf}: {sum(map(len, pages)):,} characters in {len(pages)} pages, timed on "
+          f"{sum(len(page.encode()) for page in large_pages) / 1024 ** 2:.1f} MB")
+    print(f"\n{'splitter':<12}{'MB/s':>8}{'chunks':>8}{'mean tok':>10}{'max tok':>9}{'> limit':>9}"
+          f"{f'recall@{args.k}':>11}")
+
+    for name, splitter in splitters.items():
+        speed = throughput(splitter.split_text, large_pages, args.repeat)
+        chunks = split_pages(splitter.split_text, pages)
+        tokens = np.asarray(counter.count_tokens(chunks))
+        recall = recall_at_k(chunks, questions, model, args.k) if questions else float("nan")
+
+        print(f"{name:<12}{speed['mb_per_second']:>8.2f}{len(chunks):>8}{tokens.mean():>10.1f}{tokens.max():>9}"
+              f"{int((tokens > args.model_max_tokens).sum()):>9}{recall:>11.3f}")
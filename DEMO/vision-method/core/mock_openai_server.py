@@ -0,0 +1,228 @@
+from argparse import ArgumentParser
+from asyncio import sleep, new_event_loop, run_coroutine_threadsafe, AbstractEventLoop
+from threading import Thread, Event
+from typing import Any, Dict, List, Optional
+from hashlib import blake2b
+import json
+import time
+import re
+
+from aiohttp import web
+import numpy as np
+
+
+class MockOpenAIServer:
+    """
+    Local stand-in for the OpenAI compatible API of LM Studio.
+
+    It answers /v1/models, /v1/completions, /v1/chat/completions (both streamed and not) and /v1/embeddings with
+    a configurable time to first token and token rate, so the RAG pipeline can be benchmarked without a GPU and with
+    repeatable latencies. Embeddings are deterministic hashed bag-of-words vectors: texts sharing words end up close
+    to each other, which is enough for retrieval to behave like retrieval.
+    """
+
+    _filler: List[str] = ("the answer is based on the provided context and covers the main points of the "
+                          "document in a short and helpful way").split()
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 1235, latency: float = 0.2, token_rate: float = 50.0,
+                 max_tokens: int = 64, dimensions: int = 768):
+        self.host = host
+        self.port = port
+        self.latency = latency  # Seconds before the first token (and before an embeddings response)
+        self.token_rate = token_rate  # Generated tokens per second after the first one
+        self.max_tokens = max_tokens  # Tokens per completion when the request doesn't ask for fewer
+        self.dimensions = dimensions  # Size of the embedding vectors
+
+        self._loop: Optional[AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[Thread] = None
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}("
+                f"port={self.port}, "
+                f"latency={self.latency}, "
+                f"token_rate={self.token_rate}, "
+                f"max_tokens={self.max_tokens}, "
+                f"dimensions={self.dimensions})")
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_post("/v1/completions", self.completions)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/embeddings", self.embeddings)
+        return app
+
+    def start(self) -> "MockOpenAIServer":
+        """
+        Serve in a background thread with its own event loop, returns once the port is bound.
+
+        Raises whatever stopped the server from starting (a port already in use), instead of waiting forever.
+        """
+        started = Event()
+        errors = []
+        self._loop = new_event_loop()
+
+        async def serve():
+            self._runner = web.AppRunner(self.create_app())
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+
+        def run():
+            try:
+                self._loop.run_until_complete(serve())
+            except BaseException as error:
+                errors.append(error)
+                return
+            finally:
+                started.set()
+
+            self._loop.run_forever()
+
+        self._thread = Thread(target=run, name="mock-openai-server", daemon=True)
+        self._thread.start()
+        started.wait()
+
+        if errors:
+            self._thread.join()
+            if self._runner is not None:
+                self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+            self._loop = None
+            raise errors[0]
+
+        return self
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+
+        run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": "mock-model", "object": "model",
+                                                              "owned_by": "mock"}]})
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        prompts = body.get("prompt", "")
+        prompts = prompts if isinstance(prompts, list) else [prompts]
+        max_tokens = min(body.get("max_tokens") or self.max_tokens, self.max_tokens)
+
+        def choice(index: int, text: str, finish_reason: Optional[str]) -> Dict[str, Any]:
+            return {"text": text, "index": index, "logprobs": None, "finish_reason": finish_reason}
+
+        if body.get("stream"):
+            return await self._stream(request, body, "text_completion", len(prompts), max_tokens, choice)
+
+        await sleep(self.latency + max(max_tokens - 1, 0) / self.token_rate)
+        text = " ".join(self._tokens(max_tokens))
+        return web.json_response({
+            **self._header(body, "text_completion"),
+            "choices": [choice(index, text, "stop") for index in range(len(prompts))],
+            "usage": self._usage(" ".join(map(str, prompts)), max_tokens * len(prompts)),
+        })
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        max_tokens = min(body.get("max_tokens") or self.max_tokens, self.max_tokens)
+
+        def chunk_choice(index: int, text: str, finish_reason: Optional[str]) -> Dict[str, Any]:
+            return {"index": index, "delta": {"role": "assistant", "content": text}, "finish_reason": finish_reason}
+
+        if body.get("stream"):
+            return await self._stream(request, body, "chat.completion.chunk", 1, max_tokens, chunk_choice)
+
+        await sleep(self.latency + max(max_tokens - 1, 0) / self.token_rate)
+        return web.json_response({
+            **self._header(body, "chat.completion"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": " ".join(self._tokens(max_tokens))}}],
+            "usage": self._usage(json.dumps(body.get("messages", [])), max_tokens),
+        })
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        inputs = body.get("input", [])
+        inputs = inputs if isinstance(inputs, list) and inputs and not isinstance(inputs[0], int) else [inputs]
+
+        await sleep(self.latency)
+        vectors = self.embed([" ".join(map(str, text)) if isinstance(text, list) else text for text in inputs])
+
+        return web.json_response({
+            "object": "list",
+            "model": body.get("model", "mock-model"),
+            "data": [{"object": "embedding", "index": index, "embedding": vector.tolist()}
+                     for index, vector in enumerate(vectors)],
+            "usage": self._usage(" ".join(map(str, inputs)), 0),
+        })
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                bucket = int.from_bytes(blake2b(word.encode(), digest_size=8).digest(), "little")
+                vectors[row, bucket % self.dimensions] += 1.0 if bucket & (1 << 63) else -1.0
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    async def _stream(self, request: web.Request, body: Dict[str, Any], object_name: str, choices: int,
+                      max_tokens: int, make_choice) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        header = self._header(body, object_name)
+
+        await sleep(self.latency)
+        for position, token in enumerate(self._tokens(max_tokens)):
+            if position:
+                await sleep(1 / self.token_rate)
+
+            text = token if position == 0 else " " + token
+            payload = {**header, "choices": [make_choice(index, text, None) for index in range(choices)]}
+            await response.write(f"data: {json.dumps(payload)}\n\n".encode())
+
+        payload = {**header, "choices": [make_choice(index, "", "stop") for index in range(choices)]}
+        await response.write(f"data: {json.dumps(payload)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def _tokens(self, count: int) -> List[str]:
+        return [self._filler[position % len(self._filler)] for position in range(count)]
+
+    @staticmethod
+    def _header(body: Dict[str, Any], object_name: str) -> Dict[str, Any]:
+        return {"id": f"mock-{time.time_ns()}", "object": object_name, "created": int(time.time()),
+                "model": body.get("model", "mock-model")}
+
+    @staticmethod
+    def _usage(prompt: str, completion_tokens: int) -> Dict[str, int]:
+        # Whitespace tokens are close enough for a mock
+        prompt_tokens = len(prompt.split())
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Serve a mock OpenAI compatible API with configurable latency.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1235)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="generated tokens per second")
+    parser.add_argument("--max-tokens", type=int, default=64, help="tokens per completion")
+    parser.add_argument("--dimensions", type=int, default=768, help="size of the embedding vectors")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(host=args.host, port=args.port, latency=args.latency, token_rate=args.token_rate,
+                              max_tokens=args.max_tokens, dimensions=args.dimensions)
+    print(f"Mock OpenAI API listening on {server.base_url}")
+    web.run_app(server.create_app(), host=args.host, port=args.port, print=None)
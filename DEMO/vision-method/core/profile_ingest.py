@@ -0,0 +1,237 @@
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from threading import Event, Thread, get_ident
+from typing import Dict, List, Optional
+from uuid import uuid4
+from sys import path, _current_frames
+import tracemalloc
+import linecache
+import time
+import os
+
+path.append('../')
+
+from utils.document_processor import DocumentProcessor, UploadedPDF
+from utils.tracing import Span, tracer
+
+
+class StackSampler:
+    """
+    Sampling profiler for one thread.
+
+    Every `interval` seconds the current stack of the thread is recorded. The stacks are written in the collapsed
+    format ("frame;frame;frame count" per line) read by flamegraph.pl, speedscope and most flame graph viewers.
+    Sampling keeps the overhead low and, unlike cProfile, shows time spent waiting on the LLM or Milvus as well.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop: Event = Event()
+        self._thread: Optional[Thread] = None
+
+    def __enter__(self) -> "StackSampler":
+        self._thread = Thread(target=self._sample, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = _current_frames().get(self.thread_id)
+            stack = []
+
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def save(self, file_path: str) -> None:
+        with open(file_path, "w", encoding="utf-8") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+    def top_functions(self, limit: int = 15) -> List[tuple]:
+        # Self time: the frame at the top of each sampled stack
+        counts = Counter()
+        for stack, count in self.stacks.items():
+            counts[stack.rsplit(";", 1)[-1]] += count
+        return counts.most_common(limit)
+
+
+class SpanCollector:
+    def __init__(self):
+        self.spans: List[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+
+def page_table(spans: List[Span]) -> List[Dict[str, float]]:
+    """
+    Build the per-page timing rows from the spans of `DocumentProcessor.load_pdf`.
+
+    Parameters:
+    -----------
+    spans : List[Span]
+        Every span collected during the run.
+
+    Returns:
+    --------
+    List[Dict[str, float]]
+        One row per page with the milliseconds spent on tables, text and images and what was found.
+    """
+    children = defaultdict(list)
+    for span in spans:
+        children[span.parent_id].append(span)
+
+    rows = []
+    for page in sorted((span for span in spans if span.name == "pdf.page"), key=lambda span: span.start):
+        row = {"page": page.attributes["page_num"] + 1, "total_ms": page.duration * 1000, "tables_ms": 0.0,
+               "text_ms": 0.0, "images_ms": 0.0, "tables": 0, "images": 0, "image_kb": 0.0}
+
+        for child in children[page.span_id]:
+            stage = child.name.removeprefix("pdf.")
+            row[f"{stage}_ms"] = child.duration * 1000
+            if stage == "tables":
+                row["tables"] = child.attributes.get("tables", 0)
+            elif stage == "images":
+                row["images"] = child.attributes.get("images", 0)
+                row["image_kb"] = child.attributes.get("bytes", 0) / 1024
+
+        rows.append(row)
+
+    return rows
+
+
+def print_page_table(rows: List[Dict[str, float]]) -> None:
+    print(f"\n{'page':>5}{'total ms':>11}{'tables ms':>11}{'text ms':>10}{'images ms':>11}"
+          f"{'tables':>8}{'images':>8}{'image KB':>10}")
+
+    for row in rows:
+        print(f"{row['page']:>5}{row['total_ms']:>11.1f}{row['tables_ms']:>11.1f}{row['text_ms']:>10.1f}"
+              f"{row['images_ms']:>11.1f}{row['tables']:>8}{row['images']:>8}{row['image_kb']:>10.1f}")
+
+    if rows:
+        total = sum(row["total_ms"] for row in rows)
+        print(f"{'all':>5}{total:>11.1f}{sum(row['tables_ms'] for row in rows):>11.1f}"
+              f"{sum(row['text_ms'] for row in rows):>10.1f}{sum(row['images_ms'] for row in rows):>11.1f}"
+              f"{sum(row['tables'] for row in rows):>8}{sum(row['images'] for row in rows):>8}"
+              f"{sum(row['image_kb'] for row in rows):>10.1f}")
+
+
+def print_stage_totals(spans: List[Span]) -> None:
+    # Where the whole ingestion went, summed over every span of a stage
+    totals, counts = defaultdict(float), Counter()
+    for span in spans:
+        if span.name != "pdf.page":
+            totals[span.name] += span.duration
+            counts[span.name] += 1
+
+    print(f"\n{'stage':<24}{'calls':>7}{'total s':>10}")
+    for name, seconds in sorted(totals.items(), key=lambda item: item[1], reverse=True):
+        print(f"{name:<24}{counts[name]:>7}{seconds:>10.3f}")
+
+
+def print_allocations(snapshot: tracemalloc.Snapshot, limit: int) -> None:
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                                       tracemalloc.Filter(False, "<unknown>")])
+
+    print(f"\nTop {limit} allocation sites (memory still held at the end of the run):")
+    for statistic in snapshot.statistics("lineno")[:limit]:
+        frame = statistic.traceback[0]
+        line = linecache.getline(frame.filename, frame.lineno).strip()
+        print(f"{statistic.size / 1024:>10.1f} KB {statistic.count:>7} blocks  "
+              f"{os.path.basename(frame.filename)}:{frame.lineno}  {line}")
+
+
+def profile_ingest(pdf_path: str, load_only: bool, interval: float, output: str, top: int) -> None:
+    """
+    Ingest one PDF under the sampling profiler and tracemalloc and print where the time and memory went.
+
+    Parameters:
+    -----------
+    pdf_path : str
+        The PDF to profile.
+    load_only : bool
+        Profile `DocumentProcessor.load_pdf` alone (parsing, tables, images, chunking), without the LLM analyses,
+        the embedding and the Milvus insert of `Chatbot.save_pdf`.
+    interval : float
+        Seconds between two stack samples.
+    output : str
+        Path of the collapsed stacks file.
+    top : int
+        Number of functions and allocation sites to print.
+
+    Returns:
+    --------
+    None
+    """
+    with open(pdf_path, "rb") as file:
+        pdf = UploadedPDF(data=file.read(), name=os.path.basename(pdf_path), file_id=str(uuid4()))
+
+    collector = SpanCollector()
+    tracer.exporters.append(collector)
+
+    if load_only:
+        processor = DocumentProcessor()
+        ingest, cleanup = processor.load_pdf, processor.delete_images
+    else:
+        from chatbot import Chatbot
+        from utils.resources import resources
+
+        chatbot = Chatbot()
+        # Model loading is not what is being profiled
+        resources.warm_up()
+        ingest, cleanup = chatbot.save_pdf, chatbot.delete_pdf
+
+    tracemalloc.start(25)
+    start = time.perf_counter()
+
+    with StackSampler(thread_id=get_ident(), interval=interval) as sampler:
+        ingest(pdf)
+
+    elapsed = time.perf_counter() - start
+    snapshot = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    cleanup(pdf.file_id)
+
+    print(f"Ingested {pdf.name} in {elapsed:.2f}s, peak traced memory {peak / 1024 ** 2:.1f} MB, "
+          f"{sum(sampler.stacks.values())} samples")
+
+    print_page_table(page_table(collector.spans))
+    print_stage_totals(collector.spans)
+
+    print(f"\nTop {top} functions by samples (self time):")
+    total_samples = max(sum(sampler.stacks.values()), 1)
+    for function, count in sampler.top_functions(top):
+        print(f"{count / total_samples:>7.1%}  {function}")
+
+    print_allocations(snapshot, top)
+
+    sampler.save(output)
+    print(f"\nCollapsed stacks saved to {output} (open it with speedscope or flamegraph.pl)")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Profile the ingestion of a single PDF.")
+    parser.add_argument("pdf", help="the PDF that ingests slowly")
+    parser.add_argument("--load-only", action="store_true",
+                        help="profile only the PDF parsing (no LLM analyses, embedding or Milvus insert)")
+    parser.add_argument("--interval", type=float, default=0.005, help="seconds between stack samples")
+    parser.add_argument("--output", help="collapsed stacks file, <pdf name>.folded by default")
+    parser.add_argument("--top", type=int, default=15, help="functions and allocation sites to print")
+    args = parser.parse_args()
+
+    profile_ingest(args.pdf, load_only=args.load_only, interval=args.interval,
+                   output=args.output or f"{os.path.splitext(os.path.basename(args.pdf))[0]}.folded", top=args.top)
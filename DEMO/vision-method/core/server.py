@@ -0,0 +1,293 @@
+from argparse import ArgumentParser
+from asyncio import Semaphore, TimeoutError, get_running_loop, wait_for
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from dotenv import dotenv_values
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+from sys import path
+import json
+
+from aiohttp import web
+from langchain_core.documents import Document
+
+path.append('../')
+
+from utils.document_processor import UploadedPDF
+from utils.filters import check_id
+from utils.resources import resources
+from utils.metrics import start_metrics_server, track_queue
+from chatbot import Chatbot
+
+dotenv_path = ".env"
+
+
+class RagServer:
+    def __init__(self, workers: int = 4, max_queue: int = 16, queue_timeout: float = 30.0,
+                 cold_start_budget: Optional[float] = None, metrics_port: Optional[int] = None,
+                 version: str = "demo"):
+        self.workers = workers  # Number of requests that run the pipeline at the same time
+        self.max_queue = max_queue  # Number of requests allowed to wait for a free worker
+        self.queue_timeout = queue_timeout  # Seconds a request may wait in the queue before it is rejected
+        self.cold_start_budget = cold_start_budget  # Seconds the resources warm-up is expected to take at most
+        self.metrics_port = metrics_port  # Port of the Prometheus metrics endpoint, no metrics when None
+        self.version = version  # Version label of the metrics
+
+        # Creating the Chatbot is cheap, its models and clients are shared resources warmed up at startup
+        self.chatbot: Chatbot = Chatbot()
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-worker")
+        self._slots: Optional[Semaphore] = None
+        self._queued: int = 0
+        self._in_flight: int = 0
+        self._warm_up_error: Optional[BaseException] = None  # Why the resources failed to load, reported by /ready
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}("
+                f"workers={self.workers}, "
+                f"max_queue={self.max_queue}, "
+                f"queue_timeout={self.queue_timeout}, "
+                f"cold_start_budget={self.cold_start_budget}, "
+                f"metrics_port={self.metrics_port})")
+
+    def create_app(self) -> web.Application:
+        """
+        Build the aiohttp application exposing the RAG pipeline.
+
+        Routes:
+        -------
+        GET    /health               liveness probe, answers as soon as the process is up
+        GET    /ready                readiness probe, 503 until the shared resources (embedding model, Milvus, LLM) are loaded
+        POST   /documents            multipart upload of a PDF in the `file` field (optional `file_id` field)
+        DELETE /documents/{file_id}  delete every vector and image of a PDF
+        POST   /query                JSON {"question": str, "history": [...]} -> {"answer": str, "documents": [...]}
+        POST   /query/stream         same body, answered as newline delimited JSON chunks
+
+        Every route except the probes is scoped to the tenant of the `X-Tenant-ID` header (the default tenant
+        without it): documents are saved for that tenant and queries only search its documents.
+
+        Returns:
+        --------
+        web.Application
+            The application, ready to be passed to `web.run_app` or any aiohttp runner.
+        """
+        app = web.Application(client_max_size=256 * 1024 ** 2)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+
+        app.router.add_get("/health", self.health)
+        app.router.add_get("/ready", self.ready)
+        app.router.add_post("/documents", self.ingest)
+        app.router.add_delete("/documents/{file_id}", self.delete)
+        app.router.add_post("/query", self.query)
+        app.router.add_post("/query/stream", self.stream_query)
+
+        return app
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def ready(self, request: web.Request) -> web.Response:
+        status = 200 if resources.is_warm() else 503
+        return web.json_response({
+            "status": "ready" if status == 200 else "failed" if self._warm_up_error else "loading",
+            "error": repr(self._warm_up_error) if self._warm_up_error else None,
+            "workers": self.workers,
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "cold_start": resources.load_times(),
+            "cold_start_budget": self.cold_start_budget,
+        }, status=status)
+
+    async def ingest(self, request: web.Request) -> web.Response:
+        fields = await self._read_multipart(request)
+
+        if "file" not in fields:
+            raise web.HTTPBadRequest(text="multipart field 'file' is required")
+
+        file_name, data = fields["file"]
+        file_id = self._file_id(fields.get("file_id", (None, b""))[1].decode() or str(uuid4()))
+        file = UploadedPDF(data=data, name=file_name or f"{file_id}.pdf", file_id=file_id)
+
+        tenant_id = self._tenant_id(request)
+
+        async with self._admission():
+            await get_running_loop().run_in_executor(
+                self._executor, partial(self.chatbot.save_pdf, file, tenant_id=tenant_id))
+
+        return web.json_response({"file_id": file.file_id, "file_name": file.name}, status=201)
+
+    async def delete(self, request: web.Request) -> web.Response:
+        file_id = self._file_id(request.match_info["file_id"])
+
+        tenant_id = self._tenant_id(request)
+
+        async with self._admission():
+            await get_running_loop().run_in_executor(
+                self._executor, partial(self.chatbot.delete_pdf, file_id, tenant_id=tenant_id))
+
+        return web.json_response({"file_id": file_id})
+
+    async def query(self, request: web.Request) -> web.Response:
+        question, history = await self._read_query(request)
+        tenant_id = self._tenant_id(request)
+
+        async with self._admission():
+            response = await self.chatbot.aget_response(query=question, history=history, tenant_id=tenant_id)
+
+        return web.json_response(self._serialize(response))
+
+    async def stream_query(self, request: web.Request) -> web.StreamResponse:
+        # Everything is validated before the response is prepared, a stream that already sent 200 cannot become a 400
+        question, history = await self._read_query(request)
+        tenant_id = self._tenant_id(request)
+
+        async with self._admission():
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+
+            async for chunk in self.chatbot.astream(query=question, history=history, tenant_id=tenant_id):
+                await response.write((json.dumps(self._serialize(chunk), ensure_ascii=False) + "\n").encode())
+
+            await response.write_eof()
+
+        return response
+
+    @asynccontextmanager
+    async def _admission(self):
+        """
+        Admission control in front of the worker pool.
+
+        At most `workers` requests run at once, at most `max_queue` wait for a slot and none waits longer than
+        `queue_timeout`. Anything above that is rejected with 503 and a Retry-After header, so a load balancer can send
+        it to another replica instead of letting the latency of every request grow.
+        """
+        if not resources.is_warm():
+            raise web.HTTPServiceUnavailable(text="model is still loading", headers={"Retry-After": "5"})
+
+        if self._queued >= self.max_queue:
+            raise web.HTTPServiceUnavailable(text="request queue is full", headers={"Retry-After": "1"})
+
+        self._queued += 1
+        try:
+            await wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except TimeoutError:
+            raise web.HTTPServiceUnavailable(text="timed out waiting for a worker", headers={"Retry-After": "1"})
+        finally:
+            self._queued -= 1
+
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    async def _on_startup(self, app: web.Application) -> None:
+        self._slots = Semaphore(self.workers)
+
+        if self.metrics_port:
+            start_metrics_server(port=self.metrics_port, pipeline="vision", version=self.version,
+                                 image_store=Chatbot._documentProcessor.image_store)
+            track_queue("server", lambda: self._queued, pipeline="vision", version=self.version)
+            track_queue("server_in_flight", lambda: self._in_flight, pipeline="vision", version=self.version)
+        # Load the embedding model, Milvus and the LLM client off the event loop, so /health answers right away
+        # and /ready flips once loading is done.
+        warm_up = get_running_loop().run_in_executor(self._executor, resources.warm_up, None, self.cold_start_budget)
+        warm_up.add_done_callback(self._on_warm_up_done)
+
+    def _on_warm_up_done(self, future) -> None:
+        # A failed load would otherwise be lost with the future and /ready would answer "loading" forever
+        if future.cancelled() or future.exception() is None:
+            return
+
+        self._warm_up_error = future.exception()
+        print(f"Error: loading the resources failed, the server will not become ready : {self._warm_up_error!r}")
+
+    async def _on_cleanup(self, app: web.Application) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    async def _read_multipart(request: web.Request) -> Dict[str, tuple]:
+        fields = {}
+        reader = await request.multipart()
+
+        while (part := await reader.next()) is not None:
+            fields[part.name] = (part.filename, await part.read())
+
+        return fields
+
+    @staticmethod
+    def _file_id(file_id: str) -> str:
+        # File ids are written into Milvus filter expressions (deletes, references)
+        try:
+            return check_id(file_id)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+    @staticmethod
+    def _tenant_id(request: web.Request) -> Optional[str]:
+        tenant_id = request.headers.get("X-Tenant-ID")
+
+        try:
+            Chatbot._tenant_filter(tenant_id)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+        return tenant_id
+
+    @staticmethod
+    async def _read_query(request: web.Request) -> tuple:
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="request body must be JSON")
+
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="request body must be a JSON object")
+
+        if not isinstance(body.get("question"), str) or not body["question"]:
+            raise web.HTTPBadRequest(text="'question' is required")
+
+        history: List[Dict[str, str]] = body.get("history", [])
+        if not isinstance(history, list) or not all(
+                isinstance(message, dict) and isinstance(message.get("role"), str)
+                and isinstance(message.get("content"), str) for message in history):
+            raise web.HTTPBadRequest(text="'history' must be a list of {\"role\": str, \"content\": str} objects")
+
+        return body["question"], history
+
+    @staticmethod
+    def _serialize(response: Dict[str, Any]) -> Dict[str, Any]:
+        if "documents" in response:
+            documents: List[Document] = response["documents"]
+            response = {**response, "documents": [{"page_content": document.page_content,
+                                                   "metadata": document.metadata} for document in documents]}
+        return response
+
+
+if __name__ == "__main__":
+    env_values: OrderedDict = dotenv_values(dotenv_path)
+
+    parser = ArgumentParser(description="Serve the RAG pipeline over HTTP without the Streamlit interface.")
+    parser.add_argument("--host", default=env_values.get("server_host", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(env_values.get("server_port", "8000")))
+    parser.add_argument("--workers", type=int, default=int(env_values.get("server_workers", "4")),
+                        help="requests running the pipeline at the same time")
+    parser.add_argument("--max-queue", type=int, default=int(env_values.get("server_max_queue", "16")),
+                        help="requests allowed to wait for a worker before new ones are rejected")
+    parser.add_argument("--queue-timeout", type=float, default=float(env_values.get("server_queue_timeout", "30")),
+                        help="seconds a request may wait for a worker")
+    parser.add_argument("--cold-start-budget", type=float,
+                        default=float(env_values.get("cold_start_budget", "120")),
+                        help="seconds the models and clients may take to load before a warning is printed")
+    # Its own port, so the server and the chat app can run side by side from the same .env
+    parser.add_argument("--metrics-port", type=int, default=int(env_values.get("server_metrics_port") or "0"),
+                        help="port of the Prometheus metrics endpoint, 0 disables it")
+    args = parser.parse_args()
+
+    server = RagServer(workers=args.workers, max_queue=args.max_queue, queue_timeout=args.queue_timeout,
+                       cold_start_budget=args.cold_start_budget, metrics_port=args.metrics_port or None,
+                       version=env_values.get("app_version") or "demo")
+    web.run_app(server.create_app(), host=args.host, port=args.port)
@@ -1,12 +1,26 @@
 import fitz
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from typing import List, Dict, Any
+from typing import Iterable, List, Dict, Any, Optional, Tuple
 from PIL import Image
 import io
 import base64
-import os
-import glob
+
+from utils.tracing import tracer
+from utils.token_chunker import TokenChunker
+from utils.image_store import ImageStore
+
+
+class UploadedPDF(io.BytesIO):
+    """
+    In-memory PDF with the `name` and `file_id` attributes of streamlit's UploadedFile, so files that do not come
+    from the sidebar uploader (API uploads, background jobs) go through `load_pdf` the same way.
+    """
+
+    def __init__(self, data: bytes, name: str, file_id: str):
+        super().__init__(data)
+        self.name = name
+        self.file_id = file_id
 
 
 class DocumentProcessor:
@@ -16,11 +30,13 @@ class DocumentProcessor:
     # Set the base directory for data storage
     base_directory = ".data/"
 
-    def __init__(self, chunk_size: int = 400):
+    def __init__(self, chunk_size: int = 400, chunker: Optional[TokenChunker] = None,
+                 image_store: Optional[ImageStore] = None):
         self.chunk_size = chunk_size
+        self.image_store: ImageStore = image_store or ImageStore(base_directory=self.base_directory)
 
-        # Create a text splitter using recursive character-based splitting
-        self.text_splitter: RecursiveCharacterTextSplitter = RecursiveCharacterTextSplitter(
+        # Create a text splitter using recursive character-based splitting, unless chunks are measured in tokens
+        self.text_splitter: RecursiveCharacterTextSplitter | TokenChunker = chunker or RecursiveCharacterTextSplitter(
             separators=self._separators,  # Use defined separators for splitting
             chunk_size=chunk_size,  # Set the maximum size of each chunk
             length_function=len,  # Function to determine the length of the text
@@ -28,108 +44,187 @@ class DocumentProcessor:
         )
 
     def __repr__(self):
-        return f"{self.__class__.__name__}(chunk_size={self.chunk_size!r})"
+        return (f"{self.__class__.__name__}(chunk_size={self.chunk_size!r}, text_splitter={self.text_splitter!r}, "
+                f"image_store={self.image_store!r})")
 
-    def load_pdf(self, file) -> Dict[str, List[Any]]:
+    def load_pdf(self, file, stages: Iterable[str] = ("text", "tables", "images"),
+                 tenant_id: Optional[str] = None) -> Dict[str, List[Any]]:
         """
         Extract text and images from a PDF file and split the text into chunks.
 
         This method opens a PDF file, extracts its text and images, and processes them. It uses the `RecursiveCharacterTextSplitter` from LangChain to divide the text into manageable chunks.
-        The images are converted to base64 format and saved to a specified directory, while the extracted tables are also organized for further use.
+        The images are converted to base64 format and saved to the image store, while the extracted tables are also organized for further use.
 
         Parameters:
         -----------
         file : file or streamlit file_uploader-like object
             A file object returned by streamlit's file_uploader or similar objects, representing the PDF to be processed.
+        stages : Iterable[str]
+            Extraction stages to run, any of "text", "tables" and "images". The lists of the skipped stages stay empty
+            and, without "images", no image is decoded or written to disk.
+        tenant_id : str, optional
+            Tenant owning the PDF, its images are stored apart from the same file_id in other tenants.
 
         Returns:
         --------
         Dict[str, List[Any]]
             A dictionary containing:
-                - 'chunks': A list of text chunks obtained by splitting the PDF text.
+                - 'chunks': A list of tuples with each text chunk and its location, see `chunk_page`.
                 - 'images': A list of tuples containing the file path, base64-encoded image data, and metadata for each extracted image.
                 - 'tables': A list of tuples with extracted table data and their associated page and table numbers.
         """
+        stages = set(stages)
         pdf_document = fitz.open(stream=file.read(), filetype="pdf")
-        text = ""
         pdf = {"chunks": [], "images": [], "tables": []}
+        extracted_images = []
 
+        # Per-page spans let the profiling CLI split the time between tables, text and images (no-ops otherwise)
         for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
+            with tracer.span("pdf.page", page_num=page_num):
+                page = pdf_document.load_page(page_num)
 
-            tables_datas = self.extract_tables(page)
+                with tracer.span("pdf.tables") as tables_span:
+                    tables_datas = self.extract_tables(page) if "tables" in stages else []
 
-            for table_num, table in enumerate(tables_datas):
-                table_markdown = self.convert_table_to_markdown(table['table'].extract())
-                full_tabel_data = '\n' + table['above_text'] + '\n' + table_markdown + '\n' + table['below_text']
-                pdf['tables'].append((full_tabel_data, page_num, table_num))
+                    for table_num, table in enumerate(tables_datas):
+                        table_markdown = self.convert_table_to_markdown(table['table'].extract())
+                        full_tabel_data = '\n' + table['above_text'] + '\n' + table_markdown + '\n' + table['below_text']
+                        pdf['tables'].append((full_tabel_data, page_num, table_num))
 
-            text += page.get_text()
+                    tables_span.set_attribute("tables", len(tables_datas))
 
-            images = page.get_images(full=True)
+                with tracer.span("pdf.text"):
+                    if "text" in stages:
+                        pdf['chunks'].extend(self.chunk_page(page, page_num))
 
-            for image_index in range(len(images)):
-                image = images[image_index]
+                with tracer.span("pdf.images") as images_span:
+                    images = page.get_images(full=True) if "images" in stages else []
+                    images_bytes = 0
 
-                xref = image[0]
-                image_data = pdf_document.extract_image(xref)
-                image_bytes = image_data["image"]
-                image_b64 = base64.b64encode(image_bytes).decode('utf-8')
-                image = Image.open(io.BytesIO(image_bytes))
-                image_format = image.format
+                    for image_index in range(len(images)):
+                        image = images[image_index]
 
-                file_path = f"{self.base_directory}{file.file_id}_{page_num}_{image_index}.{image_format.lower()}"
+                        xref = image[0]
+                        image_data = pdf_document.extract_image(xref)
+                        image_bytes = image_data["image"]
+                        image_b64 = base64.b64encode(image_bytes).decode('utf-8')
+                        image_format = Image.open(io.BytesIO(image_bytes)).format
+                        images_bytes += len(image_bytes)
 
-                image_info = {
-                    "page_num": page_num,
-                    "image_num": image_index
-                }
+                        # The extracted bytes are stored as they are, decoding and encoding them again with PIL
+                        # only cost time
+                        extracted_images.append({"data": image_bytes, "extension": image_format.lower(),
+                                                 "page_num": page_num, "image_num": image_index, "b64": image_b64})
 
-                directory = os.path.dirname(file_path)
+                    images_span.set_attributes(images=len(images), bytes=images_bytes)
 
-                if not os.path.exists(directory):
-                    os.makedirs(directory)
+        pdf_document.close()
 
-                image.save(file_path)
+        if extracted_images:
+            with tracer.span("pdf.images_save", images=len(extracted_images)):
+                paths = self.image_store.save_images(file.file_id, extracted_images, tenant_id=tenant_id)
 
-                pdf['images'].append((file_path, image_b64, image_info))
+            pdf['images'] = [(file_path, image["b64"], {"page_num": image["page_num"], "image_num": image["image_num"]})
+                             for file_path, image in zip(paths, extracted_images)]
 
-        pdf_document.close()
+        return pdf
 
-        text = text.replace("\n", " ")
+    def chunk_page(self, page, page_num: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Split the text of one page into chunks that know where they are on the page.
 
-        chunks = list(map(lambda chunk: (chunk, "None"), self.text_splitter.split_text(text)))
-        pdf['chunks'] = chunks
-        return pdf
+        The text comes from PyMuPDF's block output. Each block records its character range in the page text. A
+        chunk is mapped back to the blocks it overlaps, and its bounding box is the union of theirs. Chunks do not
+        cross pages, so a reference can open the right page directly.
+
+        Parameters:
+        -----------
+        page : fitz.Page
+            The page to split.
+        page_num : int
+            Index of the page in the document (starting from 0, like the images and tables).
+
+        Returns:
+        --------
+        List[Tuple[str, Dict[str, Any]]]
+            Each chunk with its 'page_num', its 'bbox' (x0, y0, x1, y1 in PDF points) and the 'blocks' it spans.
+        """
+        page_text, blocks = self.page_text(page)
+        chunks = []
+        cursor = 0
+
+        with tracer.span("pdf.chunk", chars=len(page_text)):
+            for chunk in self.text_splitter.split_text(page_text):
+                start = page_text.find(chunk, cursor)
+                if start == -1:
+                    # The splitter rewrote some whitespace, the chunk still comes right after the previous one
+                    start = cursor
+                end = start + len(chunk)
+                cursor = start + 1
+
+                covered = [block for block in blocks if block[0] < end and block[1] > start] or blocks
+                bbox = (min(block[3][0] for block in covered), min(block[3][1] for block in covered),
+                        max(block[3][2] for block in covered), max(block[3][3] for block in covered))
+
+                chunks.append((chunk, {"page_num": page_num, "bbox": tuple(round(value, 1) for value in bbox),
+                                       "blocks": [block[2] for block in covered]}))
+
+        return chunks
+
+    @staticmethod
+    def page_text(page) -> Tuple[str, List[Tuple[int, int, int, Tuple[float, float, float, float]]]]:
+        """
+        Build the text of a page that `chunk_page` splits, from PyMuPDF's block output.
 
-    def delete_images(self, file_id: str) -> List[str]:
+        The whitespace of every text block is collapsed and the blocks are joined with a space.
+
+        Parameters:
+        -----------
+        page : fitz.Page
+            The page to read.
+
+        Returns:
+        --------
+        Tuple[str, List[Tuple[int, int, int, Tuple[float, float, float, float]]]]
+            The page text, and the start and end offsets in it, number and bounding box of each text block.
+        """
+        page_text = ""
+        blocks = []
+
+        for x0, y0, x1, y1, block_text, block_num, block_type in page.get_text("blocks"):
+            block_text = " ".join(block_text.split())
+
+            # Image blocks (type 1) have no text
+            if block_type != 0 or not block_text:
+                continue
+
+            if page_text:
+                page_text += " "
+            blocks.append((len(page_text), len(page_text) + len(block_text), block_num, (x0, y0, x1, y1)))
+            page_text += block_text
+
+        return page_text, blocks
+
+    def delete_images(self, file_id: str, tenant_id: Optional[str] = None) -> List[str]:
         """
         Delete images associated with a specific file ID.
 
-        This method searches for and removes image files from the filesystem that match the given file ID.
-        It uses a pattern to identify files and attempts to delete each one, reporting any errors encountered during the deletion process.
+        The images of a file live in their own directory of the image store, so this removes that directory instead
+        of scanning every stored image for the file ID.
 
         Parameters:
         -----------
         file_id : str
             The identifier associated with the images to be deleted. This ID is used to match files in the specified directory.
+        tenant_id : str, optional
+            Tenant owning the file, given to `load_pdf` when the images were saved.
 
         Returns:
         --------
         List[str]
-            A list of file paths for the images that were attempted to be deleted. This list may include files that could not be removed due to errors.
+            A list of file paths for the images that were deleted, read from the index of the file.
         """
-        pattern = os.path.join(self.__class__.base_directory, f'*{file_id}*')
-
-        files_to_delete = glob.glob(pattern)
-
-        for file_path in files_to_delete:
-            try:
-                os.remove(file_path)
-            except OSError as e:
-                print(f"Error: {file_path} : {e.strerror}")
-
-        return files_to_delete
+        return self.image_store.delete_images(file_id=file_id, tenant_id=tenant_id)
 
     def extract_tables(self, page) -> List[Dict[str, Any]]:
         """
@@ -220,10 +315,10 @@ class DocumentProcessor:
     @classmethod
     def data_clean_up(cls) -> None:
         """
-        Clean up the directory by deleting all files matching the specified pattern.
+        Clean up the directory by deleting every stored image.
 
-        This class method searches for and removes all files in the base directory.
-        It attempts to delete each file and reports any errors encountered during the deletion process.
+        This class method empties the image store in the base directory, the images of all files and the
+        content-addressed blobs.
 
         Parameters:
         -----------
@@ -233,12 +328,4 @@ class DocumentProcessor:
         --------
         None
         """
-        pattern = os.path.join(cls.base_directory, '*')
-
-        files_to_delete = glob.glob(pattern)
-
-        for file_path in files_to_delete:
-            try:
-                os.remove(file_path)
-            except OSError as e:
-                print(f"Error: {file_path} : {e.strerror}")
+        ImageStore(base_directory=cls.base_directory).clear()
@@ -9,12 +9,30 @@ class EnvManager:
         self._environment_items: Dict[Tuple[str, str], str] = {
             ("chunk_size", "chunk size for text splitting"): "256",
             ("chunk_overlap", "chunk overlap for text splitting"): "64",
+            ("chunk_unit", "unit of chunk size and overlap: characters, or tokens of the embedding model"): "characters",
             ("embedding_model_name", "name of the embedding model(needs to exist in hugginface)"): "sentence-transformers/all-MiniLM-L6-v2",
             ("collection_name", "collection name for Milvus db"): "Test",
             ("milvus_uri", "your milvus uri"): "http://localhost:19530",
             ("openAI_base_url", "your open ai base url for connection"): "http://localhost:1234/v1",
             ("openAI_api_key", "your open ai api key"): "lm-studio",
             ("LLM_model_name", "LLM model name"): "lmstudio-community/Meta-Llama-3.1-8B-Instruct-GGUF",
+            ("vision_model_name", "vision model name used to describe images"): "xtuner/llava-llama-3-8b-v1_1-gguf",
+            ("ingestion_workers", "PDFs ingested at the same time in the background"): "1",
+            ("cold_start_budget", "seconds the models and clients may take to load"): "120",
+            ("server_port", "port of the headless API server"): "8000",
+            ("server_workers", "requests the API server runs at the same time"): "4",
+            ("server_max_queue", "requests the API server lets wait for a worker"): "16",
+            ("trace_file", "JSON lines file for pipeline spans (empty to disable)"): "",
+            ("otlp_endpoint", "OpenTelemetry collector traces endpoint (empty to disable)"): "",
+            ("metrics_port", "port of the Prometheus metrics endpoint of the chat app (empty to disable)"): "9464",
+            ("server_metrics_port", "port of the Prometheus metrics endpoint of the API server (empty to disable)"): "9465",
+            ("app_version", "version label of the metrics"): "demo",
+            ("content_addressed_images", "store images repeated across PDFs once (true/false)"): "false",
+            ("session_ttl", "seconds without a heartbeat before the PDFs of a closed session are deleted"): "3600",
+            ("session_reap_interval", "seconds between two checks for expired sessions"): "60",
+            ("vector_field", "Milvus field of the embeddings"): "vector",
+            ("text_field", "Milvus field of the chunk text"): "text",
+            ("drop_old_collection", "recreate the Milvus collection at startup (false to keep bulk ingested PDFs)"): "true",
         }
         
         self.path = dotenv_path
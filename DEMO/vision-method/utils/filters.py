@@ -0,0 +1,32 @@
+import re
+
+# Ids that end up inside Milvus filter expressions (tenant ids, file ids). Quotes, brackets and spaces are rejected,
+# so an id can never close its string literal and add conditions to the expression.
+_id_pattern = re.compile(r"[\w\-.]+")
+
+
+def check_id(value: str, kind: str = "file id") -> str:
+    """
+    Validate an id before it is written into a Milvus filter expression.
+
+    Parameters:
+    -----------
+    value : str
+        The id to check.
+    kind : str
+        What the id is, used in the error message.
+
+    Returns:
+    --------
+    str
+        The id, unchanged.
+
+    Raises:
+    -------
+    ValueError
+        If the id is empty or has characters other than letters, digits, '_', '-' and '.'.
+    """
+    if not isinstance(value, str) or not _id_pattern.fullmatch(value):
+        raise ValueError(f"Invalid {kind} {value!r}, only letters, digits, '_', '-' and '.' are allowed")
+
+    return value
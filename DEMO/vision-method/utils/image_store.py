@@ -0,0 +1,169 @@
+from threading import Lock
+from typing import Any, Dict, List, Optional
+import hashlib
+import shutil
+import json
+import os
+
+# Guards the blobs of the content-addressed store between linking and unlinking. Module level, not an attribute, so
+# an ImageStore can be pickled to the worker processes of the bulk ingestion.
+_blob_lock = Lock()
+
+
+class ImageStore:
+    """
+    Stores the images extracted from PDFs, one directory per file_id.
+
+    Layout under `base_directory`:
+
+        files/<shard>/<file key>/<page>_<image>.<ext>   the images of a PDF, the paths saved in Milvus
+        files/<shard>/<file key>/index.json            page, image number, path and hash of each image
+        blobs/<shard>/<sha256>.<ext>                   content-addressed copies, only with `content_addressed`
+
+    The file key is the SHA-256 of the tenant_id and the file_id, so any file_id gives a safe directory name and two
+    tenants using the same file_id never share a directory. Its first characters are the shard, so no directory grows
+    with the number of PDFs. Deleting the images of a PDF removes its directory instead of scanning every image of
+    every PDF, and it can never match the images of another file.
+
+    With `content_addressed`, the image bytes are written once to `blobs/` and the per-file paths are hard links to
+    them, so an image repeated across documents (logos, headers) takes its space once. A blob is deleted when the last
+    file linking it is. Where hard links are not supported the image is copied instead.
+    """
+
+    def __init__(self, base_directory: str = ".data/", content_addressed: bool = False, shard_width: int = 2):
+        self.base_directory = base_directory
+        self.content_addressed = content_addressed
+        self.shard_width = shard_width
+        self.blob_hits: int = 0  # Images whose bytes were already stored, by this process or an earlier one
+        self.blob_misses: int = 0  # Images written as a new blob
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(base_directory={self.base_directory!r}, "
+                f"content_addressed={self.content_addressed!r}, shard_width={self.shard_width!r})")
+
+    def file_directory(self, file_id: str, tenant_id: Optional[str] = None) -> str:
+        # Without a tenant the key is the file_id alone, as for the PDFs of the single tenant tools
+        key = hashlib.sha256((file_id if tenant_id is None else f"{tenant_id}\0{file_id}").encode("utf-8")).hexdigest()
+        return os.path.join(self.base_directory, "files", key[:self.shard_width], key)
+
+    def blob_path(self, sha256: str, extension: str) -> str:
+        return os.path.join(self.base_directory, "blobs", sha256[:self.shard_width], f"{sha256}.{extension}")
+
+    def save_images(self, file_id: str, images: List[Dict[str, Any]], tenant_id: Optional[str] = None) -> List[str]:
+        """
+        Write the images of a PDF and its index.
+
+        Parameters:
+        -----------
+        file_id : str
+            The identifier of the PDF the images come from.
+        images : List[Dict[str, Any]]
+            The encoded `data`, `extension`, `page_num` and `image_num` of each image.
+        tenant_id : str, optional
+            Tenant owning the PDF.
+
+        Returns:
+        --------
+        List[str]
+            The path of each image, in the order of `images`.
+        """
+        directory = self.file_directory(file_id, tenant_id)
+        os.makedirs(directory, exist_ok=True)
+        index, paths = [], []
+
+        for image in images:
+            file_path = os.path.join(directory, f"{image['page_num']}_{image['image_num']}.{image['extension']}")
+            sha256 = hashlib.sha256(image["data"]).hexdigest()
+
+            if self.content_addressed:
+                self._link_blob(image["data"], sha256, image["extension"], file_path)
+            else:
+                with open(file_path, "wb") as file:
+                    file.write(image["data"])
+
+            index.append({"path": file_path, "sha256": sha256, "extension": image["extension"],
+                          "page_num": image["page_num"], "image_num": image["image_num"]})
+            paths.append(file_path)
+
+        # Merged with the index of an earlier call, load_pdf may save the images of a PDF in several calls
+        index = {entry["path"]: entry for entry in self.index(file_id, tenant_id) + index}
+        with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as file:
+            json.dump(list(index.values()), file)
+
+        return paths
+
+    def index(self, file_id: str, tenant_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.file_directory(file_id, tenant_id), "index.json"), encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return []
+
+    def delete_images(self, file_id: str, tenant_id: Optional[str] = None) -> List[str]:
+        """
+        Delete the images of a PDF.
+
+        Parameters:
+        -----------
+        file_id : str
+            The identifier of the PDF whose images are deleted.
+        tenant_id : str, optional
+            Tenant owning the PDF, the images of the same file_id in other tenants are kept.
+
+        Returns:
+        --------
+        List[str]
+            The paths of the deleted images, from the index of the file.
+        """
+        index = self.index(file_id, tenant_id)
+        directory = self.file_directory(file_id, tenant_id)
+
+        if not os.path.isdir(directory):
+            return []
+
+        shutil.rmtree(directory, ignore_errors=True)
+
+        if self.content_addressed:
+            for entry in index:
+                self._release_blob(self.blob_path(entry["sha256"], entry["extension"]))
+
+        return [entry["path"] for entry in index]
+
+    def clear(self) -> None:
+        for name in ("files", "blobs"):
+            shutil.rmtree(os.path.join(self.base_directory, name), ignore_errors=True)
+
+    def _link_blob(self, data: bytes, sha256: str, extension: str, file_path: str) -> None:
+        blob_path = self.blob_path(sha256, extension)
+
+        with _blob_lock:
+            if os.path.exists(blob_path):
+                self.blob_hits += 1
+            else:
+                self.blob_misses += 1
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                temporary_path = f"{blob_path}.{os.getpid()}.tmp"
+                with open(temporary_path, "wb") as file:
+                    file.write(data)
+                os.replace(temporary_path, blob_path)
+
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+            try:
+                os.link(blob_path, file_path)
+            except OSError:
+                shutil.copyfile(blob_path, file_path)
+
+    @staticmethod
+    def _release_blob(blob_path: str) -> Optional[str]:
+        # The blob itself is one link, so a single link left means no file uses it anymore
+        with _blob_lock:
+            try:
+                if os.stat(blob_path).st_nlink <= 1:
+                    os.remove(blob_path)
+                    return blob_path
+            except FileNotFoundError:
+                pass
+
+        return None
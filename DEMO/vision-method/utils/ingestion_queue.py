@@ -0,0 +1,200 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Event, Lock
+from typing import Callable, Dict, List, Optional
+from uuid import uuid4
+import time
+
+from utils.document_processor import UploadedPDF
+
+
+class IngestionJob:
+    # Possible values of `status`
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, file_id: str, file_name: str, tenant_id: Optional[str] = None):
+        self.job_id: str = str(uuid4())
+        self.file_id = file_id
+        self.file_name = file_name
+        self.tenant_id = tenant_id
+        self.status: str = self.QUEUED
+        self.progress: float = 0.0  # From 0 to 1, reported by Chatbot.save_pdf
+        self.message: str = "Waiting for a worker"
+        self.error: Optional[str] = None
+        self.submitted_at: float = time.time()
+        self.finished_at: Optional[float] = None
+        self.cancel_event: Event = Event()
+        self.future: Optional[Future] = None
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}("
+                f"file_name={self.file_name!r}, "
+                f"status={self.status!r}, "
+                f"progress={self.progress:.2f})")
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (self.QUEUED, self.RUNNING)
+
+
+class IngestionQueue:
+    def __init__(self, ingest: Callable, cleanup: Callable[[str, Optional[str]], None], max_workers: int = 1,
+                 finished_ttl: float = 600.0):
+        """
+        Run PDF ingestion in background threads.
+
+        Parameters:
+        -----------
+        ingest : Callable
+            The ingestion function, called as `ingest(file, progress_callback=..., cancel_event=..., tenant_id=...)`
+            (`Chatbot.save_pdf`).
+        cleanup : Callable[[str, Optional[str]], None]
+            Called as `cleanup(file_id, tenant_id)` for a job cancelled while it was running, to remove whatever it
+            already stored for its tenant (`Chatbot.delete_pdf`).
+        max_workers : int
+            Number of files ingested at the same time.
+        finished_ttl : float
+            Seconds a finished job is kept when nobody calls `forget` for it, so the jobs of closed sessions do not
+            pile up for the life of the process.
+        """
+        self.max_workers = max_workers
+        self.finished_ttl = finished_ttl
+        self._ingest = ingest
+        self._cleanup = cleanup
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max_workers,
+                                                                thread_name_prefix="ingestion-worker")
+        self._jobs: Dict[str, IngestionJob] = {}  # Keyed by file_id, one job per uploaded file
+        self._lock: Lock = Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(max_workers={self.max_workers!r})"
+
+    def submit(self, file, tenant_id: Optional[str] = None) -> IngestionJob:
+        """
+        Queue a file for ingestion.
+
+        The content of the file is copied before the call returns, so the uploader object can go away while the
+        job waits. Submitting a file_id that already has an active or finished job returns that job instead of
+        ingesting the file twice (streamlit reruns the script while an upload is being processed).
+
+        Parameters:
+        -----------
+        file : file or streamlit file_uploader-like object
+            The PDF to ingest, it needs `read()`, `name` and `file_id`.
+        tenant_id : str, optional
+            Tenant the PDF is saved for.
+
+        Returns:
+        --------
+        IngestionJob
+            The job tracking the ingestion of this file.
+        """
+        self._evict_finished()
+
+        with self._lock:
+            job = self._jobs.get(file.file_id)
+            if job is not None and job.status not in (IngestionJob.FAILED, IngestionJob.CANCELLED):
+                return job
+
+            job = IngestionJob(file_id=file.file_id, file_name=file.name, tenant_id=tenant_id)
+            pdf = UploadedPDF(data=file.getvalue() if hasattr(file, "getvalue") else file.read(),
+                              name=file.name, file_id=file.file_id)
+            self._jobs[file.file_id] = job
+            job.future = self._executor.submit(self._run, job, pdf)
+
+        return job
+
+    def cancel(self, file_id: str) -> bool:
+        """
+        Cancel the job of a file.
+
+        A queued job never starts. A running job stops at its next checkpoint and the queue removes what it already
+        stored. Finished jobs are left alone, the caller deletes their vectors itself.
+
+        Parameters:
+        -----------
+        file_id : str
+            The file_id of the file whose ingestion should stop.
+
+        Returns:
+        --------
+        bool
+            True if the job was still active and the queue takes care of cleaning it up.
+        """
+        with self._lock:
+            job = self._jobs.get(file_id)
+
+            if job is None or not job.is_active:
+                self._jobs.pop(file_id, None)
+                return False
+
+            job.cancel_event.set()
+            if job.future.cancel():
+                # Never started, there is nothing to clean up or to report
+                job.status = IngestionJob.CANCELLED
+                job.finished_at = time.time()
+                del self._jobs[file_id]
+
+            return True
+
+    def get(self, file_id: str) -> Optional[IngestionJob]:
+        return self._jobs.get(file_id)
+
+    def forget(self, file_id: str) -> None:
+        # Called once the final state of a job was shown, an active job is kept
+        with self._lock:
+            job = self._jobs.get(file_id)
+            if job is not None and not job.is_active:
+                del self._jobs[file_id]
+
+    def jobs(self) -> List[IngestionJob]:
+        self._evict_finished()
+        return sorted(list(self._jobs.values()), key=lambda job: job.submitted_at)
+
+    def active_jobs(self) -> List[IngestionJob]:
+        return [job for job in self.jobs() if job.is_active]
+
+    def shutdown(self) -> None:
+        for job in self.active_jobs():
+            job.cancel_event.set()
+
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _evict_finished(self) -> None:
+        deadline = time.time() - self.finished_ttl
+
+        with self._lock:
+            for file_id, job in list(self._jobs.items()):
+                if not job.is_active and job.finished_at is not None and job.finished_at < deadline:
+                    del self._jobs[file_id]
+
+    def _run(self, job: IngestionJob, pdf: UploadedPDF) -> None:
+        job.status = IngestionJob.RUNNING
+
+        def report(progress: float, message: str) -> None:
+            job.progress = progress
+            job.message = message
+
+        try:
+            self._ingest(pdf, progress_callback=report, cancel_event=job.cancel_event, tenant_id=job.tenant_id)
+        except Exception as e:
+            job.status = IngestionJob.FAILED
+            job.error = str(e)
+            job.message = f"Failed: {e}"
+        else:
+            job.status = IngestionJob.DONE
+        finally:
+            job.finished_at = time.time()
+
+        if job.cancel_event.is_set():
+            # Cancelled while running: vectors may have been inserted and images saved before the checkpoint
+            self._cleanup(job.file_id, job.tenant_id)
+            job.status = IngestionJob.CANCELLED
+            job.message = "Cancelled"
+
+            with self._lock:
+                if self._jobs.get(job.file_id) is job:
+                    del self._jobs[job.file_id]
@@ -0,0 +1,149 @@
+from typing import Callable, Optional
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, start_http_server
+from prometheus_client.core import CounterMetricFamily
+
+from utils.image_store import ImageStore
+from utils.tracing import Span, tracer
+
+# Every metric carries the pipeline (text, vision, clip) and the version of the app that produced it, so the DEMOs
+# and the versions can be scraped by the same Prometheus and compared on one dashboard.
+_labels = ["pipeline", "version"]
+
+# Latency buckets in seconds, from a cached embedding lookup to a long vision model analysis
+_fast_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_slow_buckets = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+documents_ingested = Counter("rag_documents_ingested", "PDFs ingested, by outcome", _labels + ["status"])
+chunks_ingested = Counter("rag_chunks_ingested", "Chunks inserted into Milvus (rate() gives chunks/sec)", _labels)
+ingestion_seconds = Histogram("rag_ingestion_seconds", "Time to ingest one PDF", _labels, buckets=_slow_buckets)
+analysis_seconds = Histogram("rag_analysis_seconds", "Time of one image or table analysis by the LLM",
+                             _labels + ["kind"], buckets=_slow_buckets)
+embedding_batch_seconds = Histogram("rag_embedding_batch_seconds", "Time to embed one batch",
+                                    _labels + ["kind"], buckets=_fast_buckets)
+embedding_batch_size = Histogram("rag_embedding_batch_size", "Texts per embedding batch", _labels,
+                                 buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+milvus_seconds = Histogram("rag_milvus_seconds", "Milvus operation latency (embedding excluded for inserts)",
+                           _labels + ["operation"], buckets=_fast_buckets)
+queries = Counter("rag_queries", "Questions answered, by outcome", _labels + ["status"])
+query_seconds = Histogram("rag_query_seconds", "Time to answer a question, retrieval included", _labels,
+                          buckets=_slow_buckets)
+llm_ttft_seconds = Histogram("rag_llm_ttft_seconds", "Time to the first streamed token of the LLM", _labels,
+                             buckets=_fast_buckets + (10.0, 30.0))
+llm_seconds = Histogram("rag_llm_seconds", "Total time of an LLM generation", _labels, buckets=_slow_buckets)
+llm_tokens = Counter("rag_llm_tokens", "Tokens generated by the LLM", _labels)
+queue_depth = Gauge("rag_queue_depth", "Requests or jobs waiting to be processed", _labels + ["queue"])
+
+
+class ImageBlobCollector:
+    # Exposes the lookups of the content-addressed image store: a hit is an image whose bytes were already stored,
+    # so their ratio is the share of images deduplicated across PDFs
+    def __init__(self, image_store: ImageStore, pipeline: str, version: str):
+        self.image_store = image_store
+        self.pipeline = pipeline
+        self.version = version
+
+    def collect(self):
+        family = CounterMetricFamily("rag_image_blob_lookups", "Images saved to the content-addressed store",
+                                     labels=_labels + ["result"])
+        family.add_metric([self.pipeline, self.version, "hit"], self.image_store.blob_hits)
+        family.add_metric([self.pipeline, self.version, "miss"], self.image_store.blob_misses)
+        yield family
+
+
+class PrometheusExporter:
+    """
+    Span exporter feeding the Prometheus metrics.
+
+    The pipeline stages are already timed by the tracer spans, so metrics are derived from finished spans instead of
+    instrumenting the same code twice.
+    """
+
+    def __init__(self, pipeline: str, version: str):
+        self.pipeline = pipeline
+        self.version = version
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(pipeline={self.pipeline!r}, version={self.version!r})"
+
+    def export(self, span: Span) -> None:
+        labels = {"pipeline": self.pipeline, "version": self.version}
+        attributes = span.attributes
+        status = "failed" if span.error else "ok"
+
+        if span.name == "save_pdf":
+            documents_ingested.labels(status=status, **labels).inc()
+            ingestion_seconds.labels(**labels).observe(span.duration)
+        elif span.name in ("analyze_image", "analyze_table"):
+            analysis_seconds.labels(kind=span.name.removeprefix("analyze_"), **labels).observe(span.duration)
+        elif span.name == "milvus.insert":
+            if not span.error:
+                chunks_ingested.labels(**labels).inc(attributes.get("documents", 0))
+            milvus_seconds.labels(operation="insert", **labels).observe(
+                max(span.duration - attributes.get("embedding_seconds", 0.0), 0.0))
+        elif span.name == "milvus.search":
+            milvus_seconds.labels(operation="search", **labels).observe(span.duration)
+        elif span.name == "milvus.query":
+            milvus_seconds.labels(operation="query", **labels).observe(span.duration)
+        elif span.name == "milvus.delete":
+            milvus_seconds.labels(operation="delete", **labels).observe(span.duration)
+        elif span.name in ("embedding.documents", "embedding.query"):
+            embedding_batch_seconds.labels(kind=span.name.removeprefix("embedding."), **labels).observe(span.duration)
+            embedding_batch_size.labels(**labels).observe(attributes.get("texts", 1))
+        elif span.name == "llm.generate":
+            llm_seconds.labels(**labels).observe(span.duration)
+            if "ttft_ms" in attributes:
+                llm_ttft_seconds.labels(**labels).observe(attributes["ttft_ms"] / 1000)
+            llm_tokens.labels(**labels).inc(attributes.get("tokens") or attributes.get("completion_tokens", 0))
+        elif span.name == "chain" and span.parent_id is None:
+            # A chain without a parent span is a question (table analyses run inside their analyze_table span)
+            queries.labels(status=status, **labels).inc()
+            query_seconds.labels(**labels).observe(span.duration)
+
+
+_server_started: bool = False
+
+
+def start_metrics_server(port: int, pipeline: str, version: str, image_store: Optional[ImageStore] = None) -> None:
+    """
+    Expose the metrics on http://0.0.0.0:<port>/metrics from the app process.
+
+    Safe to call more than once (streamlit reruns, several entry points in one process), only the first call starts
+    the server. A port already in use (another process of the app) disables the metrics of this process instead of
+    stopping it.
+
+    Parameters:
+    -----------
+    port : int
+        Port of the metrics endpoint.
+    pipeline : str
+        Pipeline label, e.g. "vision".
+    version : str
+        Version label of the app.
+    image_store : ImageStore, optional
+        Image store whose content-addressed blob hits and misses are reported.
+
+    Returns:
+    --------
+    None
+    """
+    global _server_started
+
+    if _server_started:
+        return
+
+    try:
+        start_http_server(port)
+    except OSError as e:
+        print(f"Warning: metrics disabled, port {port} is not available : {e}")
+        return
+
+    tracer.exporters.append(PrometheusExporter(pipeline=pipeline, version=version))
+    if image_store is not None and image_store.content_addressed:
+        REGISTRY.register(ImageBlobCollector(image_store, pipeline=pipeline, version=version))
+    _server_started = True
+
+
+def track_queue(name: str, depth: Callable[[], float], pipeline: str, version: str) -> None:
+    # The depth is read at scrape time, nothing has to update the gauge
+    queue_depth.labels(pipeline=pipeline, version=version, queue=name).set_function(depth)
@@ -0,0 +1,126 @@
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional
+import time
+
+
+class ResourceRegistry:
+    """
+    Process-wide registry of expensive objects (embedding model, LLM client, Milvus connections).
+
+    Resources are registered with a factory and created on first use, once per process, no matter how many threads
+    ask for them at the same time. Load times are recorded so the cold start can be checked against a budget.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._locks: Dict[str, Lock] = {}
+        self._load_times: Dict[str, float] = {}
+        self._lock: Lock = Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(registered={list(self._factories)!r}, loaded={list(self._instances)!r})"
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        with self._lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, Lock())
+
+    def lazy(self, name: str, factory: Callable[[], Any]) -> "LazyResource":
+        """
+        Register a resource and return a descriptor that loads it on attribute access.
+
+        Parameters:
+        -----------
+        name : str
+            Unique name of the resource in the registry.
+        factory : Callable[[], Any]
+            Called without arguments the first time the resource is needed.
+
+        Returns:
+        --------
+        LazyResource
+            A descriptor to be used as a class attribute, e.g. `_llm = resources.lazy("llm", create_llm)`.
+        """
+        self.register(name, factory)
+        return LazyResource(registry=self, name=name)
+
+    def get(self, name: str) -> Any:
+        if name in self._instances:
+            return self._instances[name]
+
+        with self._locks[name]:
+            # Another thread may have loaded it while this one was waiting for the lock
+            if name not in self._instances:
+                start = time.perf_counter()
+                self._instances[name] = self._factories[name]()
+                self._load_times[name] = time.perf_counter() - start
+
+        return self._instances[name]
+
+    def override(self, name: str, instance: Any) -> None:
+        # Replace a resource with an already built object (benchmarks, stand-in servers)
+        with self._lock:
+            self._locks.setdefault(name, Lock())
+            self._instances[name] = instance
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def is_warm(self) -> bool:
+        return all(name in self._instances for name in self._factories)
+
+    def load_times(self) -> Dict[str, float]:
+        return dict(self._load_times)
+
+    def warm_up(self, names: Optional[List[str]] = None, budget: Optional[float] = None) -> Dict[str, float]:
+        """
+        Load resources ahead of the first request and measure the cold start.
+
+        Parameters:
+        -----------
+        names : List[str], optional
+            Resources to load, in order. Defaults to every registered resource in registration order.
+        budget : float, optional
+            Cold start budget in seconds. A warning is printed when loading takes longer.
+
+        Returns:
+        --------
+        Dict[str, float]
+            Seconds spent loading each loaded resource, including those loaded before this call (`load_times`).
+        """
+        start = time.perf_counter()
+
+        for name in names or list(self._factories):
+            self.get(name)
+
+        elapsed = time.perf_counter() - start
+        details = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self._load_times.items())
+        print(f"Cold start took {elapsed:.2f}s ({details})")
+
+        if budget is not None and elapsed > budget:
+            print(f"Warning: cold start exceeded its budget of {budget:.2f}s by {elapsed - budget:.2f}s")
+
+        return self.load_times()
+
+    def warm_up_in_background(self, names: Optional[List[str]] = None, budget: Optional[float] = None) -> Thread:
+        thread = Thread(target=self.warm_up, kwargs={"names": names, "budget": budget},
+                        name="resources-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+class LazyResource:
+    def __init__(self, registry: ResourceRegistry, name: str):
+        self.registry = registry
+        self.name = name
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(name={self.name!r})"
+
+    def __get__(self, instance, owner) -> Any:
+        return self.registry.get(self.name)
+
+
+# Shared by every Chatbot, session and worker thread of the process
+resources: ResourceRegistry = ResourceRegistry()
@@ -0,0 +1,123 @@
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional, Set
+import time
+
+
+class SessionReaper:
+    def __init__(self, cleanup: Callable[[List[str], Optional[str]], None], ttl: float = 3600.0,
+                 interval: float = 60.0):
+        """
+        Delete the PDFs of abandoned sessions in a background thread.
+
+        The PDFs of a session are deleted when the user removes them from the uploader. A closed browser tab never
+        does, so its vectors and images would stay forever. Each live session sends a heartbeat, and the PDFs of a
+        session that has not sent one for `ttl` seconds are deleted, in one batch per session.
+
+        Parameters:
+        -----------
+        cleanup : Callable[[List[str], Optional[str]], None]
+            Called as `cleanup(file_ids, tenant_id)` with the PDFs of an expired session (`Chatbot.delete_pdfs`).
+        ttl : float
+            Seconds without a heartbeat after which a session is considered abandoned.
+        interval : float
+            Seconds between two checks for expired sessions.
+        """
+        self.ttl = ttl
+        self.interval = interval
+        self._cleanup = cleanup
+        self._last_seen: Dict[str, float] = {}  # Keyed by session_id
+        self._files: Dict[str, Set[str]] = {}  # file_ids owned by each session
+        self._tenants: Dict[str, Optional[str]] = {}  # Tenant the PDFs of each session were saved for
+        self._lock: Lock = Lock()
+        self._stop: Event = Event()
+        self._thread: Optional[Thread] = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(ttl={self.ttl!r}, interval={self.interval!r}, sessions={len(self)})"
+
+    def __len__(self):
+        return len(self._last_seen)
+
+    def heartbeat(self, session_id: str, tenant_id: Optional[str] = None) -> None:
+        with self._lock:
+            self._last_seen[session_id] = time.time()
+            self._tenants.setdefault(session_id, tenant_id)
+
+    def track(self, session_id: str, file_id: str) -> None:
+        # A file counts as a heartbeat too, the session uploading it is alive
+        with self._lock:
+            self._last_seen[session_id] = time.time()
+            self._files.setdefault(session_id, set()).add(file_id)
+
+    def release(self, session_id: str, file_id: str) -> None:
+        # The session deleted the file itself
+        with self._lock:
+            self._files.get(session_id, set()).discard(file_id)
+
+    def files(self, session_id: str) -> List[str]:
+        return sorted(self._files.get(session_id, ()))
+
+    def expired_sessions(self, now: Optional[float] = None) -> List[str]:
+        deadline = (now or time.time()) - self.ttl
+        return [session_id for session_id, last_seen in list(self._last_seen.items()) if last_seen < deadline]
+
+    def reap(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Forget the expired sessions and delete their PDFs.
+
+        A session is forgotten before its PDFs are deleted, so a heartbeat arriving during the cleanup starts it
+        over with no file. A failed cleanup is reported and its files are given back to the session, to be deleted at
+        the next check.
+
+        Parameters:
+        -----------
+        now : float, optional
+            Current time, `time.time()` when not given.
+
+        Returns:
+        --------
+        Dict[str, int]
+            Number of expired sessions and of PDFs deleted.
+        """
+        counts = {"sessions": 0, "files": 0}
+
+        for session_id in self.expired_sessions(now):
+            with self._lock:
+                last_seen = self._last_seen.pop(session_id, None)
+                file_ids = sorted(self._files.pop(session_id, ()))
+                tenant_id = self._tenants.pop(session_id, None)
+
+            counts["sessions"] += 1
+            if not file_ids:
+                continue
+
+            try:
+                self._cleanup(file_ids, tenant_id)
+            except Exception as e:
+                print(f"Error: cleanup of session {session_id} : {e}")
+
+                with self._lock:
+                    self._last_seen.setdefault(session_id, last_seen)
+                    self._files.setdefault(session_id, set()).update(file_ids)
+                    self._tenants.setdefault(session_id, tenant_id)
+            else:
+                counts["files"] += len(file_ids)
+
+        return counts
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="session-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            counts = self.reap()
+            if counts["files"]:
+                print(f"Session reaper: deleted {counts['files']} PDFs of {counts['sessions']} expired sessions")
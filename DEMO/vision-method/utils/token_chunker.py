@@ -0,0 +1,109 @@
+from typing import List, Optional
+import re
+
+from tokenizers import Tokenizer
+
+# Sentence ends: Latin and Persian/Arabic question marks (؟), semicolon (؛), Urdu full stop (۔), ellipsis, and
+# paragraph breaks. The punctuation stays with its sentence.
+_sentence_end = re.compile(r"(?<=[.!?؟؛۔…])\s+|\n\s*\n")
+
+
+class TokenChunker:
+    """
+    Splits text into chunks measured in tokens of the embedding model, cut at sentence boundaries.
+
+    Character based chunks do not match the token limit of the embedding model: Persian text takes more tokens per
+    character than English, so the same `chunk_size` gives chunks that are silently truncated for one language and
+    too short for the other. All sentences are tokenized with one batch call of the HuggingFace `tokenizers` library
+    (Rust, multi-threaded), and the chunks are packed from the token counts.
+    """
+
+    def __init__(self, model_name: str = "Alibaba-NLP/gte-multilingual-base", max_tokens: int = 256,
+                 overlap_tokens: int = 32, tokenizer: Optional[Tokenizer] = None):
+        if overlap_tokens >= max_tokens:
+            raise ValueError(f"overlap_tokens ({overlap_tokens}) must be smaller than max_tokens ({max_tokens})")
+
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self._tokenizer = tokenizer
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(model_name={self.model_name!r}, max_tokens={self.max_tokens!r}, "
+                f"overlap_tokens={self.overlap_tokens!r})")
+
+    @property
+    def tokenizer(self) -> Tokenizer:
+        # Loaded on first use, so creating a DocumentProcessor does not download anything
+        if self._tokenizer is None:
+            self._tokenizer = Tokenizer.from_pretrained(self.model_name)
+        return self._tokenizer
+
+    @staticmethod
+    def split_sentences(text: str) -> List[str]:
+        return [sentence.strip() for sentence in _sentence_end.split(text) if sentence.strip()]
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        return [len(encoding.ids) for encoding in self.tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+    def split_text(self, text: str) -> List[str]:
+        """
+        Split a text into chunks of at most `max_tokens` tokens.
+
+        Whole sentences are packed into each chunk, and the last sentences of a chunk (up to `overlap_tokens`) start
+        the next one. A sentence longer than `max_tokens` is cut into windows at token boundaries.
+
+        Parameters:
+        -----------
+        text : str
+            The text to split.
+
+        Returns:
+        --------
+        List[str]
+            The chunks, in the order of the text.
+        """
+        sentences = self.split_sentences(text)
+        if not sentences:
+            return []
+
+        encodings = self.tokenizer.encode_batch(sentences, add_special_tokens=False)
+        pieces, lengths = [], []
+
+        for sentence, encoding in zip(sentences, encodings):
+            if len(encoding.ids) <= self.max_tokens:
+                pieces.append(sentence)
+                lengths.append(len(encoding.ids))
+                continue
+
+            # Too long for one chunk: cut at token offsets, the windows do not overlap the neighbouring sentences
+            for start in range(0, len(encoding.ids), self.max_tokens - self.overlap_tokens):
+                window = encoding.offsets[start:start + self.max_tokens]
+                pieces.append(sentence[window[0][0]:window[-1][1]])
+                lengths.append(len(window))
+
+                if start + self.max_tokens >= len(encoding.ids):
+                    break
+
+        chunks, current, current_tokens = [], [], 0
+
+        for index, length in enumerate(lengths):
+            if current and current_tokens + length > self.max_tokens:
+                chunks.append(" ".join(pieces[position] for position in current))
+
+                # Carry the last sentences over as the overlap, as long as the new sentence still fits
+                overlap, overlap_tokens = [], 0
+                for position in reversed(current):
+                    if overlap_tokens + lengths[position] > self.overlap_tokens or \
+                            overlap_tokens + lengths[position] + length > self.max_tokens:
+                        break
+                    overlap.insert(0, position)
+                    overlap_tokens += lengths[position]
+
+                current, current_tokens = overlap, overlap_tokens
+
+            current.append(index)
+            current_tokens += length
+
+        chunks.append(" ".join(pieces[position] for position in current))
+        return chunks
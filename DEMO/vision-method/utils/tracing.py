@@ -0,0 +1,376 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID, uuid4
+import json
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import RunnableConfig
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id: str = uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start: float = time.time()
+        self.duration: Optional[float] = None  # Seconds, set when the span ends
+        self.error: Optional[str] = None
+        self._start_counter: float = time.perf_counter()
+        self._otel_span = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(name={self.name!r}, duration={self.duration!r})"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+        if self._otel_span is not None:
+            self._otel_span.set_attribute(key, value)
+
+    def set_attributes(self, **attributes: Any) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start": self.start, "duration_ms": None if self.duration is None else self.duration * 1000,
+                "attributes": self.attributes, "error": self.error}
+
+
+class _NoopSpan:
+    # Returned while tracing is off, so instrumented code costs nothing when nobody collects the spans
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, **attributes: Any) -> None:
+        pass
+
+
+class JsonLinesExporter:
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._lock: Lock = Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(file_path={self.file_path!r})"
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            with open(self.file_path, "a", encoding="utf-8") as file:
+                file.write(line)
+
+
+class Tracer:
+    """
+    Minimal span tracer for the RAG pipeline.
+
+    Spans nest through a context variable, so a span opened inside another one (in the same thread, task or
+    LangChain executor) becomes its child. Finished spans go to the configured exporters (JSON lines file) and, when
+    an OpenTelemetry collector is configured, are mirrored as OpenTelemetry spans. Without any exporter tracing is off
+    and spans are no-ops.
+    """
+
+    def __init__(self):
+        self.exporters: List[Any] = []  # Anything with an `export(span)` method, e.g. JsonLinesExporter
+        self._otel_tracer = None
+        self._current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+        self.callback_handler: TracingCallbackHandler = TracingCallbackHandler(self)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(exporters={self.exporters!r}, otel={self._otel_tracer is not None})"
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters) or self._otel_tracer is not None
+
+    def configure(self, file_path: Optional[str] = None, otlp_endpoint: Optional[str] = None,
+                  service_name: str = "rag-system") -> None:
+        """
+        Choose where spans are exported, both can be used at the same time.
+
+        Parameters:
+        -----------
+        file_path : str, optional
+            JSON lines file every finished span is appended to.
+        otlp_endpoint : str, optional
+            OTLP/HTTP traces endpoint of an OpenTelemetry collector, e.g. http://localhost:4318/v1/traces.
+            Needs the opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http packages.
+        service_name : str
+            Service name reported to the collector.
+
+        Returns:
+        --------
+        None
+        """
+        if file_path:
+            self.exporters.append(JsonLinesExporter(file_path))
+
+        if otlp_endpoint:
+            try:
+                from opentelemetry.sdk.resources import Resource
+                from opentelemetry.sdk.trace import TracerProvider
+                from opentelemetry.sdk.trace.export import BatchSpanProcessor
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            except ImportError as e:
+                raise ImportError("Exporting spans to an OpenTelemetry collector needs "
+                                  "`pip install opentelemetry-sdk opentelemetry-exporter-otlp-proto-http`") from e
+
+            provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=otlp_endpoint)))
+            self._otel_tracer = provider.get_tracer("rag-system")
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+        parent = parent if parent is not None else self._current.get()
+        span = Span(name=name, trace_id=parent.trace_id if parent else uuid4().hex,
+                    parent_id=parent.span_id if parent else None, attributes=attributes)
+
+        if self._otel_tracer is not None:
+            from opentelemetry import trace
+
+            context = trace.set_span_in_context(parent._otel_span) if parent and parent._otel_span else None
+            span._otel_span = self._otel_tracer.start_span(name, context=context, attributes=attributes)
+
+        return span
+
+    def end_span(self, span: Span, error: Optional[BaseException] = None) -> None:
+        span.duration = time.perf_counter() - span._start_counter
+
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+
+        if span._otel_span is not None:
+            if error is not None:
+                span._otel_span.record_exception(error)
+            span._otel_span.end()
+
+        for exporter in self.exporters:
+            exporter.export(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any):
+        """
+        Time a block of code as a child of the current span.
+
+        Parameters:
+        -----------
+        name : str
+            Name of the step, e.g. "milvus.insert".
+        **attributes : Any
+            Attributes known before the step runs, more can be added with `set_attribute` on the yielded span.
+
+        Returns:
+        --------
+        Span
+            The span of the block (a no-op span when tracing is off).
+        """
+        if not self.enabled:
+            yield _NoopSpan()
+            return
+
+        span = self.start_span(name, **attributes)
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, error=e)
+            raise
+        else:
+            self.end_span(span)
+        finally:
+            self._current.reset(token)
+
+    def traced(self, name: str) -> Callable:
+        """
+        Decorator running a function inside a span, the function can add attributes through `current_span()`.
+
+        Parameters:
+        -----------
+        name : str
+            Name of the span.
+
+        Returns:
+        --------
+        Callable
+            The decorator.
+        """
+        def decorator(function: Callable) -> Callable:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def current_span(self) -> Span | _NoopSpan:
+        span = self._current.get() if self.enabled else None
+        return span if span is not None else _NoopSpan()
+
+    def config(self, config: Optional[RunnableConfig] = None) -> Optional[RunnableConfig]:
+        """
+        Add the tracing callback handler to a LangChain run config, so every step of a chain gets its span.
+
+        Parameters:
+        -----------
+        config : RunnableConfig, optional
+            Config given by the caller, it is copied and not modified.
+
+        Returns:
+        --------
+        RunnableConfig, optional
+            The config with the handler, or the given config unchanged when tracing is off.
+        """
+        if not self.enabled:
+            return config
+
+        config = dict(config or {})
+        callbacks = config.get("callbacks")
+
+        if callbacks is None:
+            config["callbacks"] = [self.callback_handler]
+        elif isinstance(callbacks, list):
+            config["callbacks"] = [*callbacks, self.callback_handler]
+        else:
+            callbacks = callbacks.copy()
+            callbacks.add_handler(self.callback_handler, inherit=True)
+            config["callbacks"] = callbacks
+
+        return config
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Turns LangChain run events into spans: the whole chain, the Milvus search, the formatting and history encoding
+    steps, the prompt and the LLM generation (with its token counts and time to first token).
+    """
+
+    # Chain steps worth a span, by their run name
+    _chain_steps: Dict[str, str] = {
+        "_format_doc": "format_doc",
+        "_encode_history": "encode_history",
+        "PromptTemplate": "prompt",
+    }
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._spans: Dict[UUID, Span] = {}
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], name: str, **attributes: Any) -> None:
+        self._spans[run_id] = self.tracer.start_span(name, parent=self._spans.get(parent_run_id), **attributes)
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None, **attributes: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.set_attributes(**attributes)
+            self.tracer.end_span(span, error=error)
+
+    def _parent_or_self(self, run_id: UUID, parent_run_id: Optional[UUID]) -> None:
+        # Runs without their own span pass their parent on to their children
+        if parent_run_id in self._spans:
+            self._spans[run_id] = self._spans[parent_run_id]
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       **kwargs: Any) -> None:
+        name = kwargs.get("name")
+
+        if parent_run_id is None:
+            self._start(run_id, None, "chain", chain=name or "")
+        elif name in self._chain_steps:
+            self._start(run_id, parent_run_id, self._chain_steps[name])
+        else:
+            self._parent_or_self(run_id, parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        span = self._spans.get(run_id)
+        if span is None or (parent_run_id in self._spans and self._spans[parent_run_id] is span):
+            self._spans.pop(run_id, None)
+            return
+
+        attributes = {"output_chars": len(outputs)} if isinstance(outputs, str) else {}
+        self._end(run_id, **attributes)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       **kwargs: Any) -> None:
+        span = self._spans.get(run_id)
+        if span is None or (parent_run_id in self._spans and self._spans[parent_run_id] is span):
+            self._spans.pop(run_id, None)
+            return
+
+        self._end(run_id, error=error)
+
+    def on_retriever_start(self, serialized, query, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                           **kwargs: Any) -> None:
+        self._start(run_id, parent_run_id, "milvus.search", query_chars=len(query))
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, documents=len(documents),
+                  context_chars=sum(len(document.page_content) for document in documents))
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=error)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                     **kwargs: Any) -> None:
+        self._start(run_id, parent_run_id, "llm.generate", prompt_chars=sum(map(len, prompts)), tokens=0)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.get(run_id)
+        if span is not None:
+            if span.attributes["tokens"] == 0:
+                span.set_attribute("ttft_ms", (time.perf_counter() - span._start_counter) * 1000)
+            span.attributes["tokens"] += 1
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        attributes = {key: usage[key] for key in ("prompt_tokens", "completion_tokens") if key in usage}
+        if run_id in self._spans:
+            # Streamed tokens were counted on the span directly, send the final count to OpenTelemetry too
+            attributes["tokens"] = self._spans[run_id].attributes["tokens"]
+        self._end(run_id, **attributes)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=error)
+
+
+class TracedEmbeddings(Embeddings):
+    # Wraps the embedding model given to Milvus, so the embedding time is split out of inserts and searches
+    def __init__(self, embedding: Embeddings, tracer: Tracer):
+        self.embedding = embedding
+        self.tracer = tracer
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(embedding={self.embedding!r})"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        parent = self.tracer.current_span()
+
+        with self.tracer.span("embedding.documents", texts=len(texts), chars=sum(map(len, texts))) as span:
+            vectors = self.embedding.embed_documents(texts)
+
+        if isinstance(parent, Span) and isinstance(span, Span):
+            # Lets the Milvus insert span report its own time without the embedding it triggered
+            parent.set_attribute("embedding_seconds", parent.attributes.get("embedding_seconds", 0.0) + span.duration)
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        with self.tracer.span("embedding.query", chars=len(text)):
+            return self.embedding.embed_query(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        # embed_query for a batch of questions, in one model call. The pinned HuggingFaceEmbeddings embeds a query with
+        # embed_documents([text]) (no query prompt or settings), so embedding the batch as documents gives the same
+        # vectors
+        with self.tracer.span("embedding.query", texts=len(texts), chars=sum(map(len, texts))):
+            return self.embedding.embed_documents(texts)
+
+# Shared by every Chatbot of the process, configured from the .env (trace_file, otlp_endpoint)
+tracer: Tracer = Tracer()
@@ -0,0 +1,284 @@
+from argparse import ArgumentParser
+from asyncio import Queue, TimeoutError, gather, run
+from typing import Any, Dict, List, Optional
+from dotenv import dotenv_values
+from sys import path
+import json
+import time
+import os
+
+import aiohttp
+import numpy as np
+import pandas as pd
+
+# Same template and Persian QA set as Llama3_1_quantizations-vs-ChatGPT4o.ipynb
+prompt_template = """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+You are an intelligent assistant. You always provide well-reasoned answersthat are both correct and helpful. The above history is a conversation between you and a human(if there isn't anything that means a new start). you just need to answer as a assistant with the above instructions.
+Instructions:
+- Provide only the answer; avoid unnecessary talk or explanations.
+- Provide an accurate and thoughtful answer based on the context if the question is related.
+- If the question is unrelated or general (like greetings), respond appropriately but without referencing the context.
+- If you don't know the answer, simply say I don't know.
+Contexts:
+{contexts}
+<|eot_id|><|start_header_id|>user<|end_header_id|>
+{query}
+<|eot_id|><|start_header_id|>assistant<|end_header_id|>
+"""
+
+gpt_data: List[Dict[str, str]] = [
+    {
+        "context": " برج ایفل، یکی از معروف‌ترین نشانه‌های دنیا، در شهر پاریس فرانسه قرار دارد. این برج بین سال‌های ۱۸۸۷ تا ۱۸۸۹ به عنوان ورودی نمایشگاه جهانی ۱۸۸۹ ساخته شد.",
+        "question": " برج ایفل در کدام شهر واقع شده است؟",
+    },
+    {
+        "context": "آلبرت اینشتین، فیزیکدان نظری، نظریه نسبیت را توسعه داد که یکی از دو ستون فیزیک مدرن است (ستون دیگر مکانیک کوانتومی است). کار او همچنین تأثیر زیادی بر فلسفه علم داشت.",
+        "question": " چه کسی نظریه نسبیت را توسعه داد؟",
+    },
+    {
+        "context": " جنگل‌های آمازون، که اغلب به عنوان `ریه‌های زمین` شناخته می‌شوند، بزرگترین جنگل‌های استوایی در جهان هستند و بیشتر بخش‌های شمالی آمریکای جنوبی را پوشش می‌دهند. این جنگل‌ها محل زندگی گونه‌های متنوعی از گیاهان و جانوران هستند.",
+        "question": "جنگل‌های آمازون به چه نامی شناخته می‌شوند؟",
+    },
+    {
+        "context": "دیوار بزرگ چین که طی چندین سلسله ساخته شده است، ابتدا برای محافظت از ایالت‌ها و امپراتوری‌های چین در برابر تهاجمات و حملات گروه‌های کوچ‌نشین از شمال ساخته شد.",
+        "question": " چرا دیوار بزرگ چین در ابتدا ساخته شد؟",
+    },
+    {
+        "context": " قلب انسان چهار حفره دارد: دو دهلیز (حفره‌های بالایی) و دو بطن (حفره‌های پایینی). این قلب خون را در سراسر بدن پمپاژ می‌کند و به بافت‌ها اکسیژن و مواد مغذی می‌رساند و دی‌اکسید کربن و دیگر ضایعات را از بدن خارج می‌کند.",
+        "question": "قلب انسان چند حفره دارد؟",
+    },
+]
+
+vision_demo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "DEMO", "vision-method")
+
+
+def notebook_prompts() -> List[str]:
+    return [prompt_template.format(contexts=data["context"], query=data["question"]) for data in gpt_data]
+
+
+def load_prompts(file_path: str) -> List[str]:
+    # JSON lines with a "prompt" field, as written by --capture-rag-prompts
+    with open(file_path, encoding="utf-8") as file:
+        return [json.loads(line)["prompt"] for line in file if line.strip()]
+
+
+def capture_rag_prompts(questions: List[str], output: str) -> List[str]:
+    """
+    Run questions through the `_rag_chain` of the vision DEMO Chatbot and save the prompts it sends to the LLM, so the
+    load test replays real retrieved contexts instead of the notebook ones.
+
+    The Chatbot reads its .env from DEMO/vision-method/core, the LLM answers every question once during the capture.
+
+    Parameters:
+    -----------
+    questions : List[str]
+        Questions asked to the Chatbot.
+    output : str
+        JSON lines file the prompts are written to.
+
+    Returns:
+    --------
+    List[str]
+        The captured prompts.
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class PromptCollector(BaseCallbackHandler):
+        def __init__(self):
+            self.prompts: List[str] = []
+
+        def on_llm_start(self, serialized, prompts, **kwargs: Any) -> None:
+            self.prompts.extend(prompts)
+
+    working_directory = os.getcwd()
+    os.chdir(os.path.join(vision_demo_path, "core"))
+    path.extend([vision_demo_path, os.path.join(vision_demo_path, "core")])
+
+    try:
+        from chatbot import Chatbot
+
+        chatbot = Chatbot()
+        collector = PromptCollector()
+        for question in questions:
+            chatbot.get_response(query=question, history=[], config={"callbacks": [collector]})
+    finally:
+        os.chdir(working_directory)
+
+    with open(output, "w", encoding="utf-8") as file:
+        for prompt in collector.prompts:
+            file.write(json.dumps({"prompt": prompt}, ensure_ascii=False) + "\n")
+
+    return collector.prompts
+
+
+async def send_request(session: aiohttp.ClientSession, base_url: str, model: str, prompt: str, max_tokens: int,
+                       timeout: float) -> Dict[str, Any]:
+    """
+    Send one streamed completion and time every token as it arrives.
+
+    Returns:
+    --------
+    Dict[str, Any]
+        `ok`, `ttft` (seconds to the first token), `gaps` (seconds between consecutive tokens), `tokens`, `seconds`
+        and `error`.
+    """
+    body = {"model": model, "prompt": prompt, "max_tokens": max_tokens, "temperature": 0, "stream": True}
+    start = time.perf_counter()
+    arrivals: List[float] = []
+
+    try:
+        async with session.post(f"{base_url}/completions", json=body,
+                                timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status != 200:
+                return {"ok": False, "error": f"HTTP {response.status}", "seconds": time.perf_counter() - start}
+
+            async for line in response.content:
+                line = line.decode().strip()
+                if not line.startswith("data:") or line == "data: [DONE]":
+                    continue
+
+                choices = json.loads(line[len("data:"):]).get("choices") or [{}]
+                if choices[0].get("text"):
+                    arrivals.append(time.perf_counter())
+    except (aiohttp.ClientError, TimeoutError) as e:
+        return {"ok": False, "error": type(e).__name__, "seconds": time.perf_counter() - start}
+
+    if not arrivals:
+        return {"ok": False, "error": "empty response", "seconds": time.perf_counter() - start}
+
+    return {"ok": True, "ttft": arrivals[0] - start, "gaps": np.diff(arrivals).tolist(), "tokens": len(arrivals),
+            "seconds": time.perf_counter() - start, "error": None}
+
+
+async def run_level(base_url: str, model: str, prompts: List[str], concurrency: int, requests: int,
+                    max_tokens: int, timeout: float) -> Dict[str, Any]:
+    """
+    Keep `concurrency` requests in flight until `requests` have been sent (closed loop, like that many users).
+
+    Returns:
+    --------
+    Dict[str, Any]
+        Error rate, TTFT and inter-token latency percentiles, aggregate tokens/sec and requests/sec of the level.
+    """
+    queue: Queue = Queue()
+    for position in range(requests):
+        queue.put_nowait(prompts[position % len(prompts)])
+
+    results: List[Dict[str, Any]] = []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def worker():
+            while not queue.empty():
+                prompt = queue.get_nowait()
+                results.append(await send_request(session, base_url, model, prompt, max_tokens, timeout))
+
+        start = time.perf_counter()
+        await gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    succeeded = [result for result in results if result["ok"]]
+    ttft = np.asarray([result["ttft"] for result in succeeded]) * 1000
+    gaps = np.asarray([gap for result in succeeded for gap in result["gaps"]]) * 1000
+    tokens = sum(result["tokens"] for result in succeeded)
+    errors = [result["error"] for result in results if not result["ok"]]
+
+    def percentile(values: np.ndarray, q: float) -> float:
+        return float(np.percentile(values, q)) if values.size else float("nan")
+
+    return {
+        "model": model,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "error_rate": len(errors) / len(results) if results else 0.0,
+        "ttft_p50_ms": percentile(ttft, 50),
+        "ttft_p95_ms": percentile(ttft, 95),
+        "itl_p50_ms": percentile(gaps, 50),
+        "itl_p95_ms": percentile(gaps, 95),
+        "tokens_per_second": tokens / elapsed if elapsed else 0.0,
+        "tokens_per_second_per_request": float(np.mean([result["tokens"] / result["seconds"]
+                                                        for result in succeeded])) if succeeded else 0.0,
+        "requests_per_second": len(results) / elapsed if elapsed else 0.0,
+        "errors": ", ".join(sorted(set(errors))),
+    }
+
+
+async def sweep(base_url: str, models: List[str], prompts: List[str], levels: List[int], requests_per_level: int,
+                max_tokens: int, timeout: float, max_error_rate: float,
+                ttft_slo: Optional[float]) -> pd.DataFrame:
+    rows = []
+
+    for model in models:
+        for concurrency in levels:
+            row = await run_level(base_url, model, prompts, concurrency,
+                                  max(requests_per_level, concurrency), max_tokens, timeout)
+            rows.append(row)
+            print(f"{model} x{concurrency}: errors {row['error_rate']:.0%}, TTFT p95 {row['ttft_p95_ms']:.0f} ms, "
+                  f"ITL p95 {row['itl_p95_ms']:.1f} ms, {row['tokens_per_second']:.1f} tok/s")
+
+            too_slow = ttft_slo is not None and not row["ttft_p95_ms"] <= ttft_slo
+            if row["error_rate"] > max_error_rate or too_slow:
+                # Higher levels would only fail harder, move on to the next model
+                break
+
+    return pd.DataFrame(rows)
+
+
+def sustainable_concurrency(results: pd.DataFrame, max_error_rate: float, ttft_slo: Optional[float]) -> pd.Series:
+    healthy = results["error_rate"] <= max_error_rate
+    if ttft_slo is not None:
+        healthy &= results["ttft_p95_ms"] <= ttft_slo
+
+    return results[healthy].groupby("model")["concurrency"].max().reindex(results["model"].unique()).fillna(0)
+
+
+if __name__ == "__main__":
+    env_values = dotenv_values(os.path.join(vision_demo_path, "core", ".env"))
+
+    parser = ArgumentParser(description="Load test quantized LLMs behind an OpenAI compatible API "
+                                        "at increasing concurrency.")
+    parser.add_argument("--models", nargs="+", default=[env_values.get("LLM_model_name", "mock-model")],
+                        help="one model name per quantization level, as served by LM Studio")
+    parser.add_argument("--base-url", default=env_values.get("openAI_base_url", "http://localhost:1234/v1"))
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="concurrency levels")
+    parser.add_argument("--requests", type=int, default=20, help="requests per concurrency level")
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds before a request counts as an error")
+    parser.add_argument("--max-error-rate", type=float, default=0.05, help="error rate that stops the sweep")
+    parser.add_argument("--ttft-slo", type=float, help="p95 time to first token in ms that stops the sweep")
+    parser.add_argument("--prompts", help="JSON lines file of prompts, the notebook QA set when not given")
+    parser.add_argument("--capture-rag-prompts", metavar="QUESTIONS",
+                        help="text file of questions run through the vision DEMO Chatbot first, "
+                             "its prompts are saved to rag_prompts.jsonl and replayed")
+    parser.add_argument("--mock", action="store_true", help="run against a local mock server (CI)")
+    parser.add_argument("--output", default="load_test.csv")
+    args = parser.parse_args()
+
+    if args.capture_rag_prompts:
+        with open(args.capture_rag_prompts, encoding="utf-8") as file:
+            prompts = capture_rag_prompts([line.strip() for line in file if line.strip()], "rag_prompts.jsonl")
+    elif args.prompts:
+        prompts = load_prompts(args.prompts)
+    else:
+        prompts = notebook_prompts()
+
+    server = None
+    if args.mock:
+        path.append(os.path.join(vision_demo_path, "core"))
+        from mock_openai_server import MockOpenAIServer
+
+        server = MockOpenAIServer(port=1236, latency=0.05, token_rate=200.0, max_tokens=args.max_tokens).start()
+        args.base_url = server.base_url
+
+    try:
+        results = run(sweep(args.base_url, args.models, prompts, args.levels, args.requests, args.max_tokens,
+                            args.timeout, args.max_error_rate, args.ttft_slo))
+    finally:
+        if server is not None:
+            server.stop()
+
+    results.to_csv(args.output, index=False)
+    print(f"\n{results.drop(columns='errors').round(2).to_string(index=False)}")
+    print(f"\nHighest sustainable concurrency:\n"
+          f"{sustainable_concurrency(results, args.max_error_rate, args.ttft_slo).to_string()}")
+    print(f"\nResults saved to {args.output}")
@@ -0,0 +1,455 @@
+from argparse import ArgumentParser
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+# A search function takes a batch of queries and k and returns, for every query, the ids of the k best results in
+# rank order. Everything retriever specific (Milvus params, hybrid search, reranking) lives behind it.
+SearchFunction = Callable[[List[str], int], List[List[Hashable]]]
+
+
+def rankings_to_hits(retrieved: Sequence[Sequence[Hashable]], relevant: Sequence[Iterable[Hashable]],
+                     k: int) -> np.ndarray:
+    """
+    Mark which of the top k results of every query are relevant.
+
+    Ids are mapped to integers once, then the comparison is a single broadcast over a (queries, k, relevant) array,
+    instead of a Python loop per query and per rank.
+
+    Parameters:
+    -----------
+    retrieved : Sequence[Sequence[Hashable]]
+        Ranked result ids per query. Lists shorter than k are padded as misses.
+    relevant : Sequence[Iterable[Hashable]]
+        Relevant ids per query, in the same order as `retrieved`.
+    k : int
+        Cut-off rank.
+
+    Returns:
+    --------
+    np.ndarray
+        Boolean array of shape (queries, k), True where the result at that rank is relevant.
+    """
+    relevant = [list(dict.fromkeys(ids)) for ids in relevant]
+    vocabulary: Dict[Hashable, int] = {}
+
+    def encode(rows: Sequence[Sequence[Hashable]], width: int, padding: int) -> np.ndarray:
+        array = np.full((len(rows), max(width, 1)), padding, dtype=np.int64)
+        for row, ids in enumerate(rows):
+            ids = list(ids)[:width]
+            array[row, :len(ids)] = [vocabulary.setdefault(item, len(vocabulary)) for item in ids]
+        return array
+
+    # Different paddings so that padding never matches padding
+    relevant_ids = encode(relevant, max(map(len, relevant), default=0), padding=-2)
+    retrieved_ids = encode(retrieved, k, padding=-1)
+
+    return (retrieved_ids[:, :k, None] == relevant_ids[:, None, :]).any(axis=2)
+
+
+def mrr_at_k(hits: np.ndarray) -> float:
+    found = hits.any(axis=1)
+    first_rank = hits.argmax(axis=1) + 1
+    return float(np.where(found, 1 / first_rank, 0.0).mean()) if hits.size else 0.0
+
+
+def recall_at_k(hits: np.ndarray, relevant_counts: np.ndarray) -> float:
+    recall = hits.sum(axis=1) / np.maximum(relevant_counts, 1)
+    return float(np.where(relevant_counts > 0, recall, 0.0).mean()) if hits.size else 0.0
+
+
+def precision_at_k(hits: np.ndarray) -> float:
+    return float(hits.mean()) if hits.size else 0.0
+
+
+def ndcg_at_k(hits: np.ndarray, relevant_counts: np.ndarray) -> float:
+    k = hits.shape[1]
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    dcg = hits @ discounts
+
+    # The ideal ranking puts every relevant id first
+    ideal_discounts = np.concatenate([[0.0], np.cumsum(discounts)])
+    idcg = ideal_discounts[np.minimum(relevant_counts, k)]
+
+    return float(np.where(idcg > 0, dcg / np.where(idcg > 0, idcg, 1), 0.0).mean()) if hits.size else 0.0
+
+
+def score_rankings(retrieved: Sequence[Sequence[Hashable]], relevant: Sequence[Iterable[Hashable]],
+                   ks: Sequence[int]) -> Dict[str, float]:
+    """
+    Compute MRR, nDCG, recall and precision at every k.
+
+    Parameters:
+    -----------
+    retrieved : Sequence[Sequence[Hashable]]
+        Ranked result ids per query.
+    relevant : Sequence[Iterable[Hashable]]
+        Relevant ids per query.
+    ks : Sequence[int]
+        Cut-off ranks to report.
+
+    Returns:
+    --------
+    Dict[str, float]
+        Metrics keyed as `mrr@k`, `ndcg@k`, `recall@k` and `precision@k`.
+    """
+    relevant = [set(ids) for ids in relevant]
+    relevant_counts = np.fromiter(map(len, relevant), dtype=np.int64, count=len(relevant))
+    hits = rankings_to_hits(retrieved, relevant, max(ks))
+    scores = {}
+
+    for k in sorted(ks):
+        scores[f"mrr@{k}"] = mrr_at_k(hits[:, :k])
+        scores[f"ndcg@{k}"] = ndcg_at_k(hits[:, :k], relevant_counts)
+        scores[f"recall@{k}"] = recall_at_k(hits[:, :k], relevant_counts)
+        scores[f"precision@{k}"] = precision_at_k(hits[:, :k])
+
+    return scores
+
+
+def evaluate_retriever(search: SearchFunction, queries: List[str], relevant: Sequence[Iterable[Hashable]],
+                       ks: Sequence[int] = (1, 3, 5, 10), batch_size: int = 1,
+                       warm_up: int = 1) -> Dict[str, float]:
+    """
+    Run a labelled query set against a retriever and measure quality and speed in the same run.
+
+    Parameters:
+    -----------
+    search : SearchFunction
+        Called as `search(queries, k)` with batches of `batch_size` queries.
+    queries : List[str]
+        The questions of the labelled set.
+    relevant : Sequence[Iterable[Hashable]]
+        Relevant ids of every question.
+    ks : Sequence[int]
+        Cut-off ranks to report, the retriever is asked for `max(ks)` results.
+    batch_size : int
+        Queries sent per search call, 1 measures the latency a chat user sees.
+    warm_up : int
+        Batches searched before timing starts (index loading, connection set-up), not scored.
+
+    Returns:
+    --------
+    Dict[str, float]
+        The quality metrics of `score_rankings`, plus `qps` and per-call latency percentiles in milliseconds.
+    """
+    k = max(ks)
+    batches = [queries[start:start + batch_size] for start in range(0, len(queries), batch_size)]
+
+    for batch in batches[:warm_up]:
+        search(batch, k)
+
+    retrieved: List[List[Hashable]] = []
+    latencies = np.empty(len(batches), dtype=np.float64)
+
+    start = time.perf_counter()
+    for position, batch in enumerate(batches):
+        call_start = time.perf_counter()
+        retrieved.extend(search(batch, k))
+        latencies[position] = time.perf_counter() - call_start
+    elapsed = time.perf_counter() - start
+
+    scores = score_rankings(retrieved, relevant, ks)
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99]) if latencies.size else (0.0, 0.0, 0.0)
+    scores.update({"qps": len(queries) / elapsed if elapsed else 0.0, "latency_p50_ms": float(p50),
+                   "latency_p95_ms": float(p95), "latency_p99_ms": float(p99)})
+
+    return scores
+
+
+def compare_retrievers(searches: Dict[str, SearchFunction], queries: List[str],
+                       relevant: Sequence[Iterable[Hashable]], ks: Sequence[int] = (1, 3, 5, 10),
+                       batch_size: int = 1, memory_bytes: Optional[Dict[str, float]] = None) -> pd.DataFrame:
+    """
+    Evaluate several retriever configurations on the same query set.
+
+    The first configuration is the reference: every other row also reports how much recall it lost and how much
+    faster it is, so a speedup (smaller nprobe, quantized vectors, no reranker) is never accepted without seeing
+    what it costs.
+
+    Parameters:
+    -----------
+    searches : Dict[str, SearchFunction]
+        Search function per configuration name, reference first.
+    queries : List[str]
+        The questions of the labelled set.
+    relevant : Sequence[Iterable[Hashable]]
+        Relevant ids of every question.
+    ks : Sequence[int]
+        Cut-off ranks to report.
+    batch_size : int
+        Queries sent per search call.
+    memory_bytes : Dict[str, float], optional
+        Memory the index of each configuration takes, reported with the share saved against the reference.
+
+    Returns:
+    --------
+    pd.DataFrame
+        One row per configuration.
+    """
+    results = pd.DataFrame({name: evaluate_retriever(search, queries, relevant, ks=ks, batch_size=batch_size)
+                            for name, search in searches.items()}).T
+
+    reference = results.iloc[0]
+    recall_key = f"recall@{max(ks)}"
+    results[f"{recall_key}_loss"] = reference[recall_key] - results[recall_key]
+    results["speedup"] = results["qps"] / reference["qps"] if reference["qps"] else np.nan
+
+    if memory_bytes:
+        results["memory_mb"] = pd.Series(memory_bytes, dtype=np.float64) / 1024 ** 2
+        results["memory_saved"] = 1 - results["memory_mb"] / results["memory_mb"].iloc[0]
+
+    return results
+
+
+def vectorstore_search(vectorstore, id_key: Optional[str] = None, **search_kwargs: Any) -> SearchFunction:
+    """
+    Adapt a LangChain vector store (the Milvus store of the Chatbots) to a search function.
+
+    Parameters:
+    -----------
+    vectorstore : VectorStore
+        Any LangChain vector store.
+    id_key : str, optional
+        Metadata field used as the result id (e.g. `chunk_number`), the page content when not given.
+    **search_kwargs : Any
+        Passed to `similarity_search` (`param`, `expr`, ...), so index parameters can be compared.
+
+    Returns:
+    --------
+    SearchFunction
+        A function searching the queries one by one.
+    """
+    def search(queries: List[str], k: int) -> List[List[Hashable]]:
+        return [[document.metadata[id_key] if id_key else document.page_content
+                 for document in vectorstore.similarity_search(query, k=k, **search_kwargs)]
+                for query in queries]
+
+    return search
+
+
+def milvus_client_search(client, collection_name: str, embed: Callable[[List[str]], List[List[float]]],
+                         anns_field: str = "vector", id_field: str = "id",
+                         search_params: Optional[Dict[str, Any]] = None) -> SearchFunction:
+    """
+    Adapt a pymilvus MilvusClient collection to a search function.
+
+    A whole batch is embedded and sent as one multi-vector request, which is how batched retrieval should be
+    measured.
+
+    Parameters:
+    -----------
+    client : MilvusClient
+        Connected client.
+    collection_name : str
+        Collection to search.
+    embed : Callable[[List[str]], List[List[float]]]
+        Embeds a batch of queries, e.g. `embedding.embed_documents`.
+    anns_field : str
+        Vector field of the collection.
+    id_field : str
+        Field returned as the result id.
+    search_params : Dict[str, Any], optional
+        Index search parameters, e.g. `{"metric_type": "IP", "params": {"nprobe": 16}}`.
+
+    Returns:
+    --------
+    SearchFunction
+        A function searching each batch with a single request.
+    """
+    def search(queries: List[str], k: int) -> List[List[Hashable]]:
+        results = client.search(collection_name=collection_name, data=embed(queries), anns_field=anns_field,
+                                limit=k, output_fields=[id_field], search_params=search_params or {})
+        return [[hit["entity"].get(id_field, hit["id"]) for hit in hits] for hits in results]
+
+    return search
+
+
+def chatbot_search(chatbot, id_key: Optional[str] = "chunk_number") -> SearchFunction:
+    """
+    Adapt the batched `search_many` of the DEMO Chatbot to a search function.
+
+    Parameters:
+    -----------
+    chatbot : Chatbot
+        A Chatbot of the vision DEMO, or anything with `search_many(queries, limit)` returning (Document, score)
+        pairs per query.
+    id_key : str, optional
+        Metadata field used as the result id, the page content when None.
+
+    Returns:
+    --------
+    SearchFunction
+        A function embedding and searching each batch with one model call and one Milvus request.
+    """
+    def search(queries: List[str], k: int) -> List[List[Hashable]]:
+        return [[document.metadata[id_key] if id_key else document.page_content for document, _ in documents]
+                for documents in chatbot.search_many(queries, limit=k)]
+
+    return search
+
+
+def milvus_handler_search(milvus_handler, vectorizer, id_field: str = "id") -> SearchFunction:
+    """
+    Adapt the V-0.2 `MilvusHandler.search_batch` to a search function.
+
+    Parameters:
+    -----------
+    milvus_handler : MilvusHandler
+        Handler of the collection to search.
+    vectorizer : Vectorizer
+        Embeds the queries, `vectorize` takes the whole batch.
+    id_field : str
+        Field of the hits used as the result id (`id`, `text` or `file_id`).
+
+    Returns:
+    --------
+    SearchFunction
+        A function searching each batch with one model call and one Milvus request.
+    """
+    def search(queries: List[str], k: int) -> List[List[Hashable]]:
+        return [[hit[id_field] for hit in hits]
+                for hits in milvus_handler.search_batch(vectorizer.vectorize(queries), top_k=k)]
+
+    return search
+
+
+def compare_vector_precisions(make_handler: Callable[[str], Any], vectorizer, chunks: List[str], file_ids: List[str],
+                              queries: List[str], relevant: Sequence[Iterable[Hashable]],
+                              precisions: Sequence[str] = ("float32", "float16", "bfloat16", "int8", "binary"),
+                              ks: Sequence[int] = (1, 3, 5, 10), batch_size: int = 32,
+                              id_field: str = "text") -> pd.DataFrame:
+    """
+    Index the same corpus with every V-0.2 vector storage precision and report the index memory and the storage saved
+    against the recall lost, float32 being the reference.
+
+    The two savings differ: int8 only quantizes the index, its float32 vectors are stored at full size, while float16,
+    bfloat16 and binary shrink the stored vectors too (binary adds an int8 copy for re-scoring).
+
+    The corpus is embedded once, every precision gets its own collection so they are searched side by side.
+
+    Parameters:
+    -----------
+    make_handler : Callable[[str], MilvusHandler]
+        Creates the handler of a precision, e.g.
+        `lambda precision: MilvusHandler(f"eval_{precision}", vectorizer.dimension, uri, vector_precision=precision)`.
+        Its collection is recreated.
+    vectorizer : Vectorizer
+        Embeds the chunks and the queries.
+    chunks : List[str]
+        The chunks of the corpus.
+    file_ids : List[str]
+        The file_id of every chunk.
+    queries : List[str]
+        The questions of the labelled set.
+    relevant : Sequence[Iterable[Hashable]]
+        Relevant ids of every question, values of `id_field`.
+    precisions : Sequence[str]
+        Precisions to compare, the first is the reference.
+    ks : Sequence[int]
+        Cut-off ranks to report.
+    batch_size : int
+        Queries sent per search call.
+    id_field : str
+        Field of the hits used as the result id, the ids of the random primary keys differ between collections.
+
+    Returns:
+    --------
+    pd.DataFrame
+        One row per precision, with `memory_mb`, `memory_saved`, `storage_mb` and `storage_saved` next to the recall
+        loss.
+    """
+    vectors = np.asarray(vectorizer.vectorize(chunks), dtype=np.float32)
+    rows_per_file: Dict[str, List[int]] = {}
+    for row, file_id in enumerate(file_ids):
+        rows_per_file.setdefault(file_id, []).append(row)
+
+    searches, memory_bytes, storage_bytes = {}, {}, {}
+
+    for precision in precisions:
+        handler = make_handler(precision)
+        handler.reset_database(chunk_size=max((len(chunk.encode()) for chunk in chunks), default=1))
+
+        for file_id, rows in rows_per_file.items():
+            handler.bulk_insert(vectors[rows], [chunks[row] for row in rows], file_id)
+
+        handler.flush()
+        searches[precision] = milvus_handler_search(handler, vectorizer, id_field=id_field)
+        memory_bytes[precision] = handler.memory_vector_bytes() * len(chunks)
+        storage_bytes[precision] = handler.stored_vector_bytes() * len(chunks)
+
+    results = compare_retrievers(searches, queries, relevant, ks=ks, batch_size=batch_size, memory_bytes=memory_bytes)
+    results["storage_mb"] = pd.Series(storage_bytes, dtype=np.float64) / 1024 ** 2
+    results["storage_saved"] = 1 - results["storage_mb"] / results["storage_mb"].iloc[0]
+
+    return results
+
+
+def load_query_set(path: str) -> tuple:
+    """
+    Load a labelled query set.
+
+    Parameters:
+    -----------
+    path : str
+        JSON lines file, one `{"query": str, "relevant": [ids]}` object per line.
+
+    Returns:
+    --------
+    tuple
+        The queries and the relevant ids of every query.
+    """
+    queries, relevant = [], []
+
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                item = json.loads(line)
+                queries.append(item["query"])
+                relevant.append(item["relevant"])
+
+    return queries, relevant
+
+
+def compare_ranking_tables(base: pd.DataFrame, comparing: pd.DataFrame, ks: Sequence[int]) -> pd.DataFrame:
+    """
+    Score ranking tables like `base.csv` and `comparing.csv`, one column of ranked ids per query.
+
+    As in the notebook, the top k of the base ranking is taken as the relevant set at every k.
+
+    Parameters:
+    -----------
+    base : pd.DataFrame
+        Reference rankings.
+    comparing : pd.DataFrame
+        Rankings of the model being evaluated, same columns as `base`.
+    ks : Sequence[int]
+        Cut-off ranks to report.
+
+    Returns:
+    --------
+    pd.DataFrame
+        MRR, nDCG, recall and precision per k.
+    """
+    base_ids = base.to_numpy(dtype=np.int64).T
+    comparing_ids = comparing[base.columns].to_numpy(dtype=np.int64).T
+    rows = {}
+
+    for k in ks:
+        scores = score_rankings(comparing_ids[:, :k], base_ids[:, :k], [k])
+        rows[k] = {name.split("@")[0]: value for name, value in scores.items()}
+
+    return pd.DataFrame(rows).T.rename_axis("k")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare two ranking tables with MRR, nDCG, recall and precision.")
+    parser.add_argument("--base", default="base.csv", help="reference rankings, one column per query")
+    parser.add_argument("--comparing", default="comparing.csv", help="rankings to evaluate")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5, 10], help="cut-off ranks")
+    args = parser.parse_args()
+
+    print(compare_ranking_tables(pd.read_csv(args.base), pd.read_csv(args.comparing), args.k).round(4))
@@ -0,0 +1,300 @@
+from argparse import ArgumentParser
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.stats import kendalltau, pearsonr, spearmanr
+
+# Takes a batch of texts, returns one embedding per text
+EmbedFunction = Callable[[List[str]], List[List[float]]]
+
+
+def openai_embedder(model: str = "text-embedding-3-large", base_url: Optional[str] = None,
+                    api_key: Optional[str] = None) -> EmbedFunction:
+    """
+    Embed batches of texts with an OpenAI compatible embeddings API (OpenAI, LM Studio).
+
+    Parameters:
+    -----------
+    model : str
+        Name of the embedding model.
+    base_url : str, optional
+        API base url, OpenAI when not given.
+    api_key : str, optional
+        API key, read from OPENAI_API_KEY when not given.
+
+    Returns:
+    --------
+    EmbedFunction
+        A function sending a whole batch in one request.
+    """
+    from openai import OpenAI
+
+    client = OpenAI(base_url=base_url, api_key=api_key or os.environ.get("OPENAI_API_KEY"))
+
+    def embed(texts: List[str]) -> List[List[float]]:
+        response = client.embeddings.create(input=[text.replace("\n", " ") for text in texts], model=model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    return embed
+
+
+def sentence_transformer_embedder(model: str) -> EmbedFunction:
+    from sentence_transformers import SentenceTransformer
+
+    encoder = SentenceTransformer(model, trust_remote_code=True)
+    return lambda texts: encoder.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+
+def embed_vocabulary(words: Iterable[str], embed: EmbedFunction,
+                     batch_size: int = 256) -> Tuple[Dict[str, int], np.ndarray]:
+    """
+    Embed every distinct word once, in batches.
+
+    Parameters:
+    -----------
+    words : Iterable[str]
+        Words of the benchmark, duplicates are embedded once.
+    embed : EmbedFunction
+        Batch embedding function.
+    batch_size : int
+        Words per embedding call.
+
+    Returns:
+    --------
+    Tuple[Dict[str, int], np.ndarray]
+        Row of every word in the matrix, and the float32 embedding matrix of shape (words, dimensions).
+    """
+    vocabulary = list(dict.fromkeys(words))
+    rows = [np.asarray(embed(vocabulary[start:start + batch_size]), dtype=np.float32)
+            for start in range(0, len(vocabulary), batch_size)]
+
+    return {word: row for row, word in enumerate(vocabulary)}, np.vstack(rows)
+
+
+def _minkowski(p: float) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+    return lambda a, b: 1 / (1 + (np.abs(a - b) ** p).sum(axis=-1) ** (1 / p))
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1)
+    return np.einsum("...d,...d->...", a, b) / np.where(norms == 0, 1, norms)
+
+
+def _jaccard(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Same definition as scipy for non boolean vectors: unequal entries among the non zero ones
+    nonzero = (a != 0) | (b != 0)
+    count = nonzero.sum(axis=-1)
+    return 1 - ((a != b) & nonzero).sum(axis=-1) / np.where(count == 0, 1, count)
+
+
+def _bray_curtis(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    total = np.abs(a + b).sum(axis=-1)
+    return 1 - np.abs(a - b).sum(axis=-1) / np.where(total == 0, 1, total)
+
+
+def _canberra(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    denominator = np.abs(a) + np.abs(b)
+    terms = np.abs(a - b) / np.where(denominator == 0, 1, denominator)
+    return 1 / (1 + terms.sum(axis=-1))
+
+
+# Every metric maps two arrays of vectors (last axis) to a similarity, distances are turned into similarities the
+# same way the notebook did: 1 / (1 + d) for unbounded distances, 1 - d for distances in [0, 1].
+metrics: Dict[str, Callable[[np.ndarray, np.ndarray], np.ndarray]] = {
+    "Euclidean": lambda a, b: 1 / (1 + np.sqrt(((a - b) ** 2).sum(axis=-1))),
+    "Squared-Euclidean": lambda a, b: 1 / (1 + ((a - b) ** 2).sum(axis=-1)),
+    "Manhattan": lambda a, b: 1 / (1 + np.abs(a - b).sum(axis=-1)),
+    "Chebyshev": lambda a, b: 1 / (1 + np.abs(a - b).max(axis=-1)),
+    "Cosine": _cosine,
+    "Jaccard": _jaccard,
+    "Hamming": lambda a, b: 1 - (a != b).mean(axis=-1),
+    "Bray-Curtis": _bray_curtis,
+    "Canberra": _canberra,
+    **{f"Minkowski_{p:.1f}": _minkowski(p) for p in np.linspace(1.2, 10, 5)},
+}
+
+
+def paired_similarities(embeddings: np.ndarray, first: np.ndarray, second: np.ndarray,
+                        metric_names: Optional[Sequence[str]] = None,
+                        chunk_size: int = 4096) -> Dict[str, np.ndarray]:
+    """
+    Compute every metric for a list of word pairs.
+
+    The pairs are processed in chunks: the rows of both words are gathered into (chunk, dimensions) float32 arrays
+    and each metric is one array expression over the chunk, so memory stays bounded for 100k+ pairs.
+
+    Parameters:
+    -----------
+    embeddings : np.ndarray
+        Embedding matrix from `embed_vocabulary`.
+    first : np.ndarray
+        Row of the first word of every pair.
+    second : np.ndarray
+        Row of the second word of every pair.
+    metric_names : Sequence[str], optional
+        Metrics to compute, all of `metrics` when not given.
+    chunk_size : int
+        Pairs per chunk.
+
+    Returns:
+    --------
+    Dict[str, np.ndarray]
+        Similarity of every pair per metric.
+    """
+    metric_names = list(metric_names or metrics)
+    results = {name: np.empty(len(first), dtype=np.float32) for name in metric_names}
+
+    for start in range(0, len(first), chunk_size):
+        a = embeddings[first[start:start + chunk_size]]
+        b = embeddings[second[start:start + chunk_size]]
+
+        for name in metric_names:
+            results[name][start:start + chunk_size] = metrics[name](a, b)
+
+    return results
+
+
+def similarity_matrix(x: np.ndarray, y: np.ndarray, metric: str = "Cosine", chunk_size: int = 1024) -> np.ndarray:
+    """
+    All-against-all similarity between two sets of vectors, computed in row chunks.
+
+    Cosine and the euclidean metrics go through a matrix product (|x|^2 + |y|^2 - 2xy), the other metrics through
+    broadcasting, which needs chunk_size * len(y) * dimensions floats, so lower chunk_size for those.
+
+    Parameters:
+    -----------
+    x : np.ndarray
+        Vectors of shape (n, dimensions).
+    y : np.ndarray
+        Vectors of shape (m, dimensions).
+    metric : str
+        One of `metrics`.
+    chunk_size : int
+        Rows of x per chunk.
+
+    Returns:
+    --------
+    np.ndarray
+        float32 matrix of shape (n, m).
+    """
+    x = np.asarray(x, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float32)
+    result = np.empty((len(x), len(y)), dtype=np.float32)
+    y_squared = (y ** 2).sum(axis=1)
+
+    for start in range(0, len(x), chunk_size):
+        chunk = x[start:start + chunk_size]
+
+        if metric == "Cosine":
+            norms = np.linalg.norm(chunk, axis=1)[:, None] * np.sqrt(y_squared)[None, :]
+            values = chunk @ y.T / np.where(norms == 0, 1, norms)
+        elif metric in ("Euclidean", "Squared-Euclidean"):
+            squared = np.maximum((chunk ** 2).sum(axis=1)[:, None] + y_squared[None, :] - 2 * chunk @ y.T, 0)
+            values = 1 / (1 + (np.sqrt(squared) if metric == "Euclidean" else squared))
+        else:
+            values = metrics[metric](chunk[:, None, :], y[None, :, :])
+
+        result[start:start + chunk_size] = values
+
+    return result
+
+
+def correlate(gold: np.ndarray, similarities: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    Compare every metric with the human similarity scores.
+
+    Parameters:
+    -----------
+    gold : np.ndarray
+        Gold standard similarity of every pair.
+    similarities : Dict[str, np.ndarray]
+        Output of `paired_similarities`.
+
+    Returns:
+    --------
+    pd.DataFrame
+        Pearson, Spearman and Kendall correlations and the MSE between min-max scaled scores, sorted by Spearman.
+    """
+    def scale(values: np.ndarray) -> np.ndarray:
+        values = values.astype(np.float64)
+        spread = values.max() - values.min()
+        return (values - values.min()) / (spread if spread else 1)
+
+    scaled_gold = scale(gold)
+    rows = {}
+
+    for name, values in similarities.items():
+        scaled = scale(values)
+        rows[name] = {"pearson": pearsonr(scaled_gold, scaled)[0], "spearman": spearmanr(scaled_gold, scaled)[0],
+                      "kendall": kendalltau(scaled_gold, scaled)[0],
+                      "mse": float(((scaled_gold - scaled) ** 2).mean())}
+
+    return pd.DataFrame(rows).T.sort_values("spearman", ascending=False)
+
+
+def load_gold_standard(path: str) -> pd.DataFrame:
+    gold = pd.read_csv(path, delimiter="\t", header=None)
+    gold.columns = ["Word1", "Word2", "Similarity"]
+    return gold
+
+
+def evaluate_metrics(gold: pd.DataFrame, embed: EmbedFunction, batch_size: int = 256,
+                     chunk_size: int = 4096) -> pd.DataFrame:
+    """
+    Embed the vocabulary of a gold standard once and rank the similarity metrics against it.
+
+    Parameters:
+    -----------
+    gold : pd.DataFrame
+        Word pairs with the columns Word1, Word2 and Similarity.
+    embed : EmbedFunction
+        Batch embedding function.
+    batch_size : int
+        Words per embedding call.
+    chunk_size : int
+        Pairs per metric chunk.
+
+    Returns:
+    --------
+    pd.DataFrame
+        Output of `correlate`.
+    """
+    start = time.perf_counter()
+    index, embeddings = embed_vocabulary(gold[["Word1", "Word2"]].to_numpy().ravel(), embed, batch_size=batch_size)
+    embedding_time = time.perf_counter() - start
+
+    first = gold["Word1"].map(index).to_numpy()
+    second = gold["Word2"].map(index).to_numpy()
+
+    start = time.perf_counter()
+    similarities = paired_similarities(embeddings, first, second, chunk_size=chunk_size)
+    metrics_time = time.perf_counter() - start
+
+    print(f"Embedded {len(index)} words in {embedding_time:.2f}s, "
+          f"computed {len(similarities)} metrics over {len(gold)} pairs in {metrics_time:.3f}s")
+
+    return correlate(gold["Similarity"].to_numpy(), similarities)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Rank similarity metrics by their correlation with human judgement.")
+    parser.add_argument("--pairs", default="wordsim_similarity_goldstandard.txt",
+                        help="tab separated word1, word2, similarity")
+    parser.add_argument("--model", default="text-embedding-3-large")
+    parser.add_argument("--backend", choices=["openai", "sentence-transformers"], default="openai")
+    parser.add_argument("--base-url", help="OpenAI compatible API, e.g. http://localhost:1234/v1 for LM Studio")
+    parser.add_argument("--api-key", help="defaults to OPENAI_API_KEY")
+    parser.add_argument("--batch-size", type=int, default=256, help="words per embedding call")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="pairs per metric chunk")
+    args = parser.parse_args()
+
+    if args.backend == "openai":
+        embedder = openai_embedder(model=args.model, base_url=args.base_url, api_key=args.api_key)
+    else:
+        embedder = sentence_transformer_embedder(args.model)
+
+    print(evaluate_metrics(load_gold_standard(args.pairs), embedder, batch_size=args.batch_size,
+                           chunk_size=args.chunk_size).round(4))
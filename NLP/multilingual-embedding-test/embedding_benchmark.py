@@ -0,0 +1,256 @@
+from argparse import ArgumentParser
+from threading import Event, Thread
+from typing import Callable, Dict, List, Optional, Tuple
+import gc
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import psutil
+
+# Takes a batch of sentences, returns one embedding per sentence
+EmbedFunction = Callable[[List[str]], np.ndarray]
+
+
+class MemorySampler:
+    """
+    Samples the resident memory of the process in a background thread and keeps the peak, which catches the
+    activations of a batch that are freed before the batch returns.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak: int = 0
+        self._process = psutil.Process(os.getpid())
+        self._stop: Event = Event()
+        self._thread: Optional[Thread] = None
+
+    def __enter__(self) -> "MemorySampler":
+        self.peak = self._process.memory_info().rss
+        self._thread = Thread(target=self._sample, name="memory-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+
+def rss_mb() -> float:
+    return psutil.Process(os.getpid()).memory_info().rss / 1024 ** 2
+
+
+def load_model(spec: str, device: Optional[str] = None, base_url: Optional[str] = None,
+               api_key: Optional[str] = None) -> Tuple[EmbedFunction, float]:
+    """
+    Load an embedding model from a spec like `hf:Alibaba-NLP/gte-multilingual-base` or
+    `openai:text-embedding-3-large`.
+
+    Parameters:
+    -----------
+    spec : str
+        Backend and model name separated by a colon, `hf:` when no backend is given.
+    device : str, optional
+        Torch device of HuggingFace models, picked by sentence-transformers when not given.
+    base_url : str, optional
+        OpenAI compatible API (e.g. LM Studio at http://localhost:1234/v1), OpenAI when not given.
+    api_key : str, optional
+        API key, read from OPENAI_API_KEY when not given.
+
+    Returns:
+    --------
+    Tuple[EmbedFunction, float]
+        The batch embedding function and the seconds it took to load the model.
+    """
+    backend, _, model_name = spec.partition(":") if ":" in spec else ("hf", "", spec)
+    start = time.perf_counter()
+
+    if backend == "hf":
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(model_name, device=device, trust_remote_code=True)
+
+        def embed(sentences: List[str]) -> np.ndarray:
+            return model.encode(sentences, batch_size=len(sentences), convert_to_numpy=True)
+    elif backend == "openai":
+        from openai import OpenAI
+
+        client = OpenAI(base_url=base_url, api_key=api_key or os.environ.get("OPENAI_API_KEY", "lm-studio"))
+
+        def embed(sentences: List[str]) -> np.ndarray:
+            response = client.embeddings.create(input=[sentence.replace("\n", " ") for sentence in sentences],
+                                                model=model_name)
+            return np.asarray([item.embedding for item in sorted(response.data, key=lambda item: item.index)])
+    else:
+        raise ValueError(f"Unknown backend {backend!r}, expected 'hf' or 'openai'")
+
+    return embed, time.perf_counter() - start
+
+
+def load_parallel_sentences(path: str, limit: Optional[int] = None) -> Dict[str, List[str]]:
+    """
+    Read a parallel corpus like `530-sentences.csv`, where every `<Language> Sentence` column holds the translation
+    of the same sentence.
+
+    Parameters:
+    -----------
+    path : str
+        CSV file of the corpus.
+    limit : int, optional
+        Keep only the first rows.
+
+    Returns:
+    --------
+    Dict[str, List[str]]
+        Sentences per language, aligned by position.
+    """
+    data = pd.read_csv(path)
+    columns = [column for column in data.columns if column.endswith(" Sentence")]
+    data = data.dropna(subset=columns)
+
+    if limit:
+        data = data.head(limit)
+
+    return {column.removesuffix(" Sentence"): data[column].str.strip().tolist() for column in columns}
+
+
+def embed_in_batches(embed: EmbedFunction, sentences: List[str], batch_size: int) -> Tuple[np.ndarray, float]:
+    start = time.perf_counter()
+    batches = [np.asarray(embed(sentences[position:position + batch_size]), dtype=np.float32)
+               for position in range(0, len(sentences), batch_size)]
+    return np.vstack(batches), time.perf_counter() - start
+
+
+def cross_lingual_scores(embeddings: Dict[str, np.ndarray]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Retrieve every sentence of one language among all the sentences of another one.
+
+    With normalized embeddings a whole language pair is one matrix product, the translation of sentence i is at
+    column i, so its rank is the number of columns scoring higher than the diagonal.
+
+    Parameters:
+    -----------
+    embeddings : Dict[str, np.ndarray]
+        Aligned embeddings per language.
+
+    Returns:
+    --------
+    Tuple[pd.DataFrame, pd.DataFrame]
+        Top-1 accuracy and MRR matrices, query language on the rows and searched language on the columns.
+    """
+    languages = list(embeddings)
+    normalized = {language: vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                  for language, vectors in embeddings.items()}
+    accuracy = pd.DataFrame(index=languages, columns=languages, dtype=float)
+    mrr = pd.DataFrame(index=languages, columns=languages, dtype=float)
+
+    for source in languages:
+        for target in languages:
+            similarities = normalized[source] @ normalized[target].T
+            expected = np.diagonal(similarities)[:, None]
+            ranks = (similarities > expected).sum(axis=1) + 1
+
+            accuracy.loc[source, target] = float((ranks == 1).mean())
+            mrr.loc[source, target] = float((1 / ranks).mean())
+
+    return accuracy, mrr
+
+
+def benchmark_model(spec: str, sentences: Dict[str, List[str]], batch_sizes: List[int], device: Optional[str] = None,
+                    base_url: Optional[str] = None, api_key: Optional[str] = None) -> List[Dict[str, float]]:
+    """
+    Load a model once and measure its speed, memory and cross-lingual quality at every batch size.
+
+    Parameters:
+    -----------
+    spec : str
+        Model spec, see `load_model`.
+    sentences : Dict[str, List[str]]
+        Aligned sentences per language.
+    batch_sizes : List[int]
+        Batch sizes to try, the quality scores come from the first one (they don't depend on it).
+    device : str, optional
+        Torch device of HuggingFace models.
+    base_url : str, optional
+        OpenAI compatible API base url.
+    api_key : str, optional
+        API key of the OpenAI compatible API.
+
+    Returns:
+    --------
+    List[Dict[str, float]]
+        One row per batch size.
+    """
+    gc.collect()
+    memory_before = rss_mb()
+    embed, load_time = load_model(spec, device=device, base_url=base_url, api_key=api_key)
+    model_memory = rss_mb() - memory_before
+
+    # The first call pays for lazy initialisation (CUDA context, kernels, connection), keep it out of the timings
+    embed([next(iter(sentences.values()))[0]])
+
+    rows = []
+    total = sum(map(len, sentences.values()))
+
+    for batch_size in batch_sizes:
+        embeddings, seconds = {}, 0.0
+
+        with MemorySampler() as sampler:
+            for language, texts in sentences.items():
+                embeddings[language], elapsed = embed_in_batches(embed, texts, batch_size)
+                seconds += elapsed
+
+        row = {"model": spec, "batch_size": batch_size, "load_seconds": load_time, "model_memory_mb": model_memory,
+               "peak_rss_mb": sampler.peak / 1024 ** 2, "sentences_per_second": total / seconds,
+               "dimensions": next(iter(embeddings.values())).shape[1]}
+
+        if not rows:
+            accuracy, mrr = cross_lingual_scores(embeddings)
+            print(f"\n{spec} top-1 accuracy (query language -> searched language):\n{accuracy.round(3)}")
+            print(f"\n{spec} MRR:\n{mrr.round(3)}")
+
+            off_diagonal = ~np.eye(len(accuracy), dtype=bool)
+            row["cross_lingual_accuracy"] = float(accuracy.to_numpy()[off_diagonal].mean()) if off_diagonal.any() \
+                else float(accuracy.to_numpy().mean())
+            row["cross_lingual_mrr"] = float(mrr.to_numpy()[off_diagonal].mean()) if off_diagonal.any() \
+                else float(mrr.to_numpy().mean())
+
+        rows.append(row)
+        print(f"{spec} batch {batch_size}: {row['sentences_per_second']:.1f} sentences/s, "
+              f"peak RSS {row['peak_rss_mb']:.0f} MB")
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark multilingual embedding models on speed, memory and "
+                                        "cross-lingual retrieval.")
+    parser.add_argument("--models", nargs="+", default=["hf:Alibaba-NLP/gte-multilingual-base"],
+                        help="model specs, hf:<name> for HuggingFace or openai:<name> for OpenAI compatible APIs")
+    parser.add_argument("--data", default="530-sentences.csv", help="parallel corpus with <Language> Sentence columns")
+    parser.add_argument("--limit", type=int, help="use only the first sentences of the corpus")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--device", help="torch device of HuggingFace models, e.g. cpu or cuda")
+    parser.add_argument("--base-url", help="OpenAI compatible API, e.g. http://localhost:1234/v1 for LM Studio")
+    parser.add_argument("--api-key", help="defaults to OPENAI_API_KEY")
+    parser.add_argument("--output", default="embedding_benchmark.csv", help="where to save the summary")
+    args = parser.parse_args()
+
+    corpus = load_parallel_sentences(args.data, limit=args.limit)
+    print(f"{len(next(iter(corpus.values())))} sentences in {', '.join(corpus)}")
+
+    results = []
+    for model_spec in args.models:
+        results.extend(benchmark_model(model_spec, corpus, args.batch_sizes, device=args.device,
+                                       base_url=args.base_url, api_key=args.api_key))
+        gc.collect()
+
+    summary = pd.DataFrame(results)
+    summary.to_csv(args.output, index=False)
+    print(f"\n{summary.round(3).to_string(index=False)}\n\nSummary saved to {args.output}")
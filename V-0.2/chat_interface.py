@@ -117,7 +117,8 @@ if __name__ == "__main__":
     vectorizer = Vectorizer(model_name=env_values['embedding_model_name'])
     milvus_handler = MilvusHandler(collection_name=env_values['collection_name'],
                                    dimensions=vectorizer.dimension,
-                                   milvus_uri=env_values['milvus_uri'])
+                                   milvus_uri=env_values['milvus_uri'],
+                                   vector_precision=env_values.get('vector_precision', 'float32'))
     chatbot = Chatbot(openAI_base_url=env_values['openAI_base_url'],
                       openAI_api_key=env_values['openAI_base_url'],
                       model_name=env_values['LLM_model_name'])
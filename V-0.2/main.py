@@ -15,7 +15,8 @@ def main():
     vectorizer = Vectorizer(model_name=env_values['embedding_model_name'])
     milvus_handler = MilvusHandler(collection_name=env_values['collection_name'],
                                    dimensions=vectorizer.dimension,
-                                   milvus_uri=env_values['milvus_uri'])
+                                   milvus_uri=env_values['milvus_uri'],
+                                   vector_precision=env_values.get('vector_precision', 'float32'))
 
     milvus_handler.reset_database()
 
@@ -44,6 +45,10 @@ def setup_env():
     milvus_uri = uri if (uri := input("Enter your milvus uri (Enter for http://localhost:19530) : "))\
         else "http://localhost:19530"
     set_key(dotenv_path , 'milvus_uri' , milvus_uri)
+    vector_precision = precision if (precision := input("Enter vector precision: float32, float16, bfloat16, int8 or binary"
+        " (Enter for float32) : "))\
+        else "float32"
+    set_key(dotenv_path , 'vector_precision' , vector_precision)
 
     #Chatbot params part
     openAI_base_url = url if (url := input("Enter open ai url to connect (Enter for http://localhost:1234/v1) : "))\
@@ -1,32 +1,196 @@
 from typing import Tuple, Type
+from concurrent.futures import ThreadPoolExecutor
+import time
 
-from pymilvus import MilvusClient, DataType
+import numpy as np
+from pymilvus import MilvusClient, DataType, Collection, connections
 from uuid import uuid4
 
 
 class MilvusHandler:
-    def __init__(self, collection_name, dimensions, milvus_uri):
+    # Milvus rejects insert requests bigger than its gRPC receive limit (64 MB by default), stay well below it
+    max_batch_bytes = 16 * 1024 * 1024
+
+    # Field type, index and metric of the vectors for every storage precision. The quantized precisions over-fetch
+    # candidates and re-score them:
+    # - int8 is the scalar quantized IVF_SQ8 index over the float32 vectors. Only the index shrinks: the index needs a
+    #   float field, so the float32 vectors are still stored at full size, and they are read back for re-scoring.
+    # - binary keeps one bit per dimension (the sign), plus an int8 copy of every vector in a scalar field for
+    #   re-scoring. Milvus only loads collections whose vector fields are all indexed, so that copy cannot be a
+    #   second vector field.
+    vector_precisions = {
+        "float32": (DataType.FLOAT_VECTOR, "IVF_FLAT", "IP"),
+        "float16": (DataType.FLOAT16_VECTOR, "IVF_FLAT", "IP"),
+        "bfloat16": (DataType.BFLOAT16_VECTOR, "IVF_FLAT", "IP"),
+        "int8": (DataType.FLOAT_VECTOR, "IVF_SQ8", "IP"),
+        "binary": (DataType.BINARY_VECTOR, "BIN_IVF_FLAT", "HAMMING"),
+    }
+
+    def __init__(self, collection_name, dimensions, milvus_uri, insert_workers=4, vector_precision="float32",
+                 rescore_factor=4):
+        if vector_precision not in self.vector_precisions:
+            raise ValueError(f"vector_precision must be one of {', '.join(self.vector_precisions)}, "
+                             f"not {vector_precision!r}")
+
         self.milvus_client = MilvusClient(milvus_uri)
         self.collection_name = collection_name
         self.dimensions = dimensions
+        self.milvus_uri = milvus_uri
+        self.insert_workers = insert_workers
+        self.vector_precision = vector_precision
+        self.rescore_factor = rescore_factor  # Candidates re-scored per result with int8 and binary storage
+        self._alias = f"bulk-{uuid4()}"
+        self._collection = None
 
     def save_vectors(self, vectors, chunks, file_id):
-        data = [
-            {"id": str(uuid4()), "vector": vectors[i], "text": chunks[i], "file_id": file_id}
-            for i in range(len(vectors))
-        ]
+        return self.bulk_insert(vectors, chunks, file_id)
+
+    def bulk_insert(self, vectors, chunks, file_id, max_batch_bytes=None):
+        # Column oriented batches: one float32 matrix and the string columns, no dict per row.
+        # Returns the timing of every batch.
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        ids = [str(uuid4()) for _ in range(len(chunks))]
+        batches = self._split_batches(vectors, chunks, ids, file_id, max_batch_bytes or self.max_batch_bytes)
+
+        if not batches:
+            return []
+
+        self._get_collection()
+        with ThreadPoolExecutor(max_workers=min(self.insert_workers, len(batches))) as executor:
+            return list(executor.map(lambda batch: self._insert_batch(*batch), enumerate(batches)))
+
+    def _split_batches(self, vectors, chunks, ids, file_id, max_batch_bytes):
+        file_id_size = len(file_id.encode())
+        batches, start, size = [], 0, 0
+
+        vector_size = self.stored_vector_bytes()
+
+        for row, chunk in enumerate(chunks):
+            row_size = vector_size + len(chunk.encode()) + len(ids[row]) + file_id_size + 64
+
+            if row > start and size + row_size > max_batch_bytes:
+                batches.append((ids[start:row], vectors[start:row], chunks[start:row], [file_id] * (row - start), size))
+                start, size = row, 0
+
+            size += row_size
 
-        print(data)
-        self.milvus_client.insert(collection_name=self.collection_name, data=data)
+        if start < len(chunks):
+            batches.append((ids[start:], vectors[start:], chunks[start:], [file_id] * (len(chunks) - start), size))
+
+        return batches
+
+    def _insert_batch(self, batch_number, batch):
+        ids, vectors, chunks, file_ids, size = batch
+        start = time.perf_counter()
+        vector_column, rescore_columns = self._encode_vectors(vectors)
+        self._get_collection().insert([ids, vector_column, chunks, file_ids, *rescore_columns])
+
+        return {"batch": batch_number, "rows": len(ids), "bytes": size, "seconds": time.perf_counter() - start}
+
+    def flush(self):
+        # Seal the inserted rows, so a search right after an insert (evaluations) sees all of them
+        self._get_collection().flush()
+
+    def _get_collection(self):
+        # MilvusClient only takes rows, the ORM Collection takes columns
+        if self._collection is None:
+            connections.connect(alias=self._alias, uri=self.milvus_uri)
+            self._collection = Collection(self.collection_name, using=self._alias)
+
+        return self._collection
 
     def search_vectors(self, query_vector, top_k=3):
-        results = self.milvus_client.search(
+        return self._search(np.atleast_2d(np.asarray(query_vector, dtype=np.float32)), top_k)
+
+    def search_batch(self, query_vectors, top_k=3, batch_size=1024):
+        # Many queries (evaluation sets, multi-query, HyDE) in one search request per batch instead of one each.
+        # Returns the hits of every query, best first, as dicts with id, score, text and file_id.
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        results = []
+
+        for start in range(0, len(query_vectors), batch_size):
+            hits = self._search(query_vectors[start:start + batch_size], top_k)
+            results.extend([{"id": hit["id"], "score": hit["distance"], **hit["entity"]} for hit in query_hits]
+                           for query_hits in hits)
+
+        return results
+
+    def _search(self, query_vectors, top_k):
+        rescore = self.vector_precision in ("int8", "binary")
+        output_fields = ["text", "file_id"]
+
+        if self.vector_precision == "int8":
+            output_fields.append("vector")
+        elif self.vector_precision == "binary":
+            output_fields += ["rescore_vector", "rescore_scale"]
+
+        hits = self.milvus_client.search(
             collection_name=self.collection_name,
-            data=query_vector,
-            limit=top_k,
-            output_fields=["text", "file_id"],
+            data=self._encode_queries(query_vectors),
+            limit=top_k * self.rescore_factor if rescore else top_k,
+            output_fields=output_fields,
         )
-        return results
+
+        if not rescore:
+            return hits
+
+        return [self._rescore(query_vector, query_hits, top_k) for query_vector, query_hits in zip(query_vectors, hits)]
+
+    def _rescore(self, query_vector, hits, top_k):
+        # Inner product of the query with the float32 (int8 storage) or dequantized int8 (binary storage) vectors of
+        # the candidates, the quantized distances only chose them
+        hits = [{"id": hit["id"], "distance": hit["distance"], "entity": dict(hit["entity"])} for hit in hits]
+        if not hits:
+            return hits
+
+        if self.vector_precision == "int8":
+            vectors = np.asarray([hit["entity"].pop("vector") for hit in hits], dtype=np.float32)
+        else:
+            codes = np.asarray([hit["entity"].pop("rescore_vector") for hit in hits], dtype=np.float32)
+            scales = np.asarray([hit["entity"].pop("rescore_scale") for hit in hits], dtype=np.float32)
+            vectors = codes * scales[:, None]
+
+        scores = vectors @ query_vector
+        order = np.argsort(-scores)[:top_k]
+
+        return [{**hits[index], "distance": float(scores[index])} for index in order]
+
+    def _encode_vectors(self, vectors):
+        # The vector column in the type of the vector field, and the extra columns of the binary storage
+        if self.vector_precision == "float16":
+            return list(vectors.astype(np.float16)), []
+        if self.vector_precision == "bfloat16":
+            from ml_dtypes import bfloat16
+
+            return list(vectors.astype(bfloat16)), []
+        if self.vector_precision == "binary":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+            codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+            return [row.tobytes() for row in np.packbits(vectors > 0, axis=1)], [codes.tolist(), scales.tolist()]
+
+        return vectors, []
+
+    def _encode_queries(self, query_vectors):
+        if self.vector_precision in ("float16", "bfloat16", "binary"):
+            return self._encode_vectors(query_vectors)[0]
+
+        return query_vectors.tolist()
+
+    def stored_vector_bytes(self):
+        # Bytes of one vector as inserted, including the re-scoring copy of the binary storage. int8 stores the float32
+        # vectors as they are, it saves no storage
+        return {"float32": 4 * self.dimensions, "float16": 2 * self.dimensions, "bfloat16": 2 * self.dimensions,
+                "int8": 4 * self.dimensions, "binary": self.dimensions // 8 + self.dimensions + 4
+                }[self.vector_precision]
+
+    def memory_vector_bytes(self):
+        # Bytes of one vector held in the index to search the collection (IVF_SQ8 keeps one byte per dimension) and,
+        # for binary, the re-scoring copy loaded with the scalar fields. The float32 vectors int8 re-scores from are
+        # not counted, they are read from the stored field for the candidates only
+        if self.vector_precision == "int8":
+            return self.dimensions
+
+        return self.stored_vector_bytes()
 
 
     def delete_vectors(self, file_id):
@@ -46,21 +210,31 @@ class MilvusHandler:
 
 
     def reset_database(self, chunk_size=256):
+        vector_type, index_type, metric_type = self.vector_precisions[self.vector_precision]
+
+        if self.vector_precision == "binary" and self.dimensions % 8:
+            raise ValueError(f"binary vectors need a multiple of 8 dimensions, not {self.dimensions}")
+
         schema = MilvusClient.create_schema(
             auto_id=False,
             enable_dynamic_field=True,
         )
         schema.add_field(field_name="id", datatype=DataType.VARCHAR, max_length=64, is_primary=True)
-        schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=self.dimensions)
+        schema.add_field(field_name="vector", datatype=vector_type, dim=self.dimensions)
         schema.add_field(field_name="text", datatype=DataType.VARCHAR, max_length=2*chunk_size)
         schema.add_field(field_name="file_id", datatype=DataType.VARCHAR, max_length=64)
 
+        if self.vector_precision == "binary":
+            schema.add_field(field_name="rescore_vector", datatype=DataType.ARRAY, element_type=DataType.INT8,
+                             max_capacity=self.dimensions)
+            schema.add_field(field_name="rescore_scale", datatype=DataType.FLOAT)
+
         index_params = self.milvus_client.prepare_index_params()
         index_params.add_index("id")
         index_params.add_index(
             field_name="vector",
-            index_type="IVF_FLAT",
-            metric_type="IP",
+            index_type=index_type,
+            metric_type=metric_type,
             params={ "nlist": 128}
         )
         index_params.add_index("text")
@@ -73,4 +247,5 @@ class MilvusHandler:
             collection_name=self.collection_name,
             schema=schema,
             index_params=index_params,
-        )
\ No newline at end of file
+        )
+        self._collection = None
\ No newline at end of file